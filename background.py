@@ -0,0 +1,134 @@
+"""
+ApexProbe | lib/background.py
+Off-main-thread program generation for the tabs
+- A worker thread builds the program lines and runs any post-passes
+  (peephole, cycle time); it never touches Tk.
+- Progress, text chunks and the result go through a queue that the Tk
+  thread drains with after(), a few chunks per tick, so the window keeps
+  repainting while a large program is inserted.
+- cancel() stops the worker between lines and discards chunks not yet shown.
+  A cancelled job never calls back into the tab again, and a partly inserted
+  program is marked CANCELLED_MARK so it cannot pass for a finished one.
+"""
+
+import queue
+import threading
+
+POLL_MS = 40            # queue drain interval
+CHUNK_LINES = 2000      # lines per Text insert
+INSERTS_PER_TICK = 2    # Text inserts per drain, so Tk gets to repaint in between
+PROGRESS_EVERY = 500    # lines between progress messages
+CANCELLED_MARK = "(CANCELLED - INCOMPLETE)"
+
+
+class Cancelled(Exception):
+    pass
+
+
+class GenerationJob:
+    """
+    Runs build() -> iterable of lines on a worker thread and streams the result
+    into a Text widget. post(lines) -> (lines, status) runs on the worker too.
+    on_status(str) and on_done(lines, status) / on_error(exc) run on the Tk thread.
+    """
+
+    def __init__(self, widget, text, build, post=None, on_status=None, on_done=None, on_error=None):
+        self.widget = widget
+        self.text = text
+        self.build = build
+        self.post = post
+        self.on_status = on_status or (lambda msg: None)
+        self.on_done = on_done or (lambda lines, status: None)
+        self.on_error = on_error or (lambda exc: None)
+        self._queue = queue.Queue()
+        self._cancel = threading.Event()
+        self._thread = None
+        self._finished = False
+        self._partial = False  # some, but not all, of the program is in the widget
+
+    @property
+    def running(self):
+        return not self._finished and not self._cancel.is_set()
+
+    def start(self):
+        self.text.delete("1.0", "end")
+        self.on_status("Generating...")
+        self._thread = threading.Thread(target=self._work, name="program-generation", daemon=True)
+        self._thread.start()
+        self.widget.after(POLL_MS, self._poll)
+        return self
+
+    def cancel(self):
+        """Tk thread only. Stops the job; from here on it makes no more tab callbacks."""
+        if not self.running: return
+        self._cancel.set()
+        if self._partial:
+            self.text.insert("end", CANCELLED_MARK + "\n")
+        self.on_status("Cancelled.")
+
+    # --- Worker thread ---
+
+    def _check(self):
+        if self._cancel.is_set():
+            raise Cancelled()
+
+    def _work(self):
+        put = self._queue.put
+        try:
+            lines = []
+            for n, line in enumerate(self.build(), start=1):
+                lines.append(line)
+                if n % PROGRESS_EVERY == 0:
+                    self._check()
+                    put(("status", f"Generating... {n:,} lines"))
+            self._check()
+
+            status = ""
+            if self.post is not None:
+                put(("status", "Post-processing..."))
+                lines, status = self.post(lines)
+                self._check()
+
+            total = len(lines)
+            for start in range(0, total, CHUNK_LINES):
+                self._check()
+                block = lines[start:start + CHUNK_LINES]
+                tail = "\n" if start + CHUNK_LINES < total else ""
+                put(("chunk", "\n".join(block) + tail, min(start + CHUNK_LINES, total), total))
+            put(("done", lines, status))
+        except Cancelled:
+            put(("cancelled",))
+        except Exception as e:
+            put(("error", e))
+
+    # --- Tk thread ---
+
+    def _poll(self):
+        inserts = 0
+        while inserts < INSERTS_PER_TICK:
+            try:
+                msg = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            kind = msg[0]
+            if self._cancel.is_set():
+                # Cancelled: the tab may already be showing another job; finish silently
+                if kind in ("done", "error", "cancelled"):
+                    self._finished = True
+                    return
+                continue
+            if kind == "status":
+                self.on_status(msg[1])
+            elif kind == "chunk":
+                self.text.insert("end", msg[1])
+                self._partial = msg[2] < msg[3]
+                self.on_status(f"Inserting... {100 * msg[2] // max(msg[3], 1)}%")
+                inserts += 1
+            else:
+                self._finished = True
+                if kind == "done":
+                    self.on_done(msg[1], msg[2])
+                else:
+                    self.on_error(msg[1])
+                return
+        self.widget.after(POLL_MS, self._poll)
@@ -0,0 +1,541 @@
+"""
+APEXPROBE | Headless Batch Generator
+------------------------------------------------------------------
+Scope:
+Regenerates probing programs without the Tk front end.
+- Accepts a directory of job files, a manifest, or individual job files.
+- JSON jobs carry the same params/features shape the Measure Features tab builds.
+- CSV jobs list one feature per row; machine settings come from the command line.
+- .apx project files (saved from the app) run their Measure Features list with
+  the project's own settings.
+- Jobs fan out over a process pool; output order is always the input order.
+
+Usage:
+    python batch.py jobs/ -o out/
+    python batch.py cell_40.txt -o out/ --workers 8
+
+JSON job:
+    {"name": "PN-1234", "generator": "measure",
+     "params": {"t_num": "50", "wcs": "54", "is_ext": false,
+                "z_clr": "6.0", "z_protect": "1.0", "features": [...]},
+     "full_pgm": true, "pgm_num": "1234", "use_m99": false}
+
+CSV job columns:
+    cycle_key, comment, x, y, plane, macro, tol, nominal, D, E, H
+
+Optimize:
+    --optimize (or "optimize": true in a JSON job) reorders measure features
+    to shorten XY rapid travel; features with "pinned": true keep their slot.
+
+Peephole:
+    --peephole (or "peephole": true) runs lib/peephole.py over the finished
+    program: redundant modal words, dead moves and blank lines are removed.
+
+Factor:
+    --factor (or "factored": true) turns every measure feature into a single
+    G65 call into one skeleton program, written next to the job as
+    <name>_O<number>.nc; load it on the control together with the program.
+
+Cache:
+    Finished programs are cached in ~/.apexprobe/programs (lib/program_cache.py),
+    keyed on the normalized job inputs (with --optimize, the pinned slots too)
+    and the generator version, so unchanged jobs are not regenerated. The
+    probing order and travel/peephole stats are stored with each entry. A .nc file whose content has not changed is not
+    rewritten (its timestamp stays put). --no-cache always regenerates.
+
+Variable file:
+    --var-table BASE (or "var_table": BASE) moves every nominal/tolerance pair
+    into a Haas macro variable file, <name>.var, written next to the .nc file.
+    The program only references #[BASE+1]..., so a tolerance change means
+    reloading the .var file, not the program.
+
+Parts:
+    --parts "54-57,P1-P4" (or "parts": "...") repeats the feature list in each
+    work offset after a single tool change. Part k stores results at
+    macro + k * stride (--bank-stride / "bank_stride", default: the span of
+    the feature macros).
+
+WIPS queue:
+    A "wips" job whose params hold a "queue" list chains those single cycles
+    into one program (one tool change, probe on once). Each queue entry
+    overrides the job-level params it sets, e.g. {"probe_cycle": "A10", "xpos": 3}.
+
+Linking:
+    --link-regions "X0 Y0 X1 Y1 Z; ..." (or "linking": "...") retracts between
+    measure features only as high as those safe-height regions need, instead
+    of to --z-clr every time; --protect-feed F (or "protect_feed") sets the
+    P9810 feed. The OK line reports the estimated time saved.
+
+Look-ahead:
+    --scoped-lookahead (or "lookahead": "scoped") limits G103 look-ahead only
+    around each probing cycle's capture and checks instead of the whole routine.
+
+Units:
+    --metric (or "units": "metric") formats coordinates to 3 decimals instead of 4.
+
+Manifest:
+    .txt / .lst file with one job path per line, or a JSON file with a
+    "jobs" list. Relative paths resolve against the manifest folder.
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from lib import codes as NC
+from lib import sequencing as SEQ
+from lib import peephole as PH
+from lib import project as PRJ
+from lib import numfmt as NF
+from lib import program_cache as PC
+from lib import cycle_time as CT
+
+JOB_EXTS = (".json", ".csv", PRJ.EXT)
+MANIFEST_EXTS = (".txt", ".lst")
+FEATURE_COLS = ["cycle_key", "comment", "x", "y", "plane", "macro", "tol", "nominal"]
+ARG_COLS = ["D", "E", "H"]
+
+
+# --- JOB LOADING ---
+
+def _read_csv_job(path, defaults):
+    """Builds a measure job from a CSV feature list."""
+    features = []
+    with open(path, newline="") as fh:
+        for row in csv.DictReader(fh):
+            row = {k.strip(): (v or "").strip() for k, v in row.items() if k}
+            if not row.get("cycle_key"):
+                continue
+            feat = {col: row.get(col, "") for col in FEATURE_COLS}
+            feat["args"] = {arg: row.get(arg, row.get(arg.lower(), "0")) or "0" for arg in ARG_COLS}
+            features.append(feat)
+
+    params = dict(defaults["params"])
+    params["features"] = features
+    return {
+        "generator": "measure",
+        "params": params,
+        "full_pgm": defaults["full_pgm"],
+        "pgm_num": defaults["pgm_num"],
+        "use_m99": defaults["use_m99"],
+        "optimize": defaults["optimize"],
+        "peephole": defaults["peephole"],
+        "factored": defaults["factored"],
+        "var_table": defaults["var_table"],
+        "parts": defaults["parts"],
+        "bank_stride": defaults["bank_stride"],
+        "linking": defaults["linking"],
+        "protect_feed": defaults["protect_feed"],
+        "lookahead": defaults["lookahead"],
+        "units": defaults["units"],
+    }
+
+
+def _read_json_job(path, defaults):
+    with open(path) as fh:
+        job = json.load(fh)
+    params = dict(defaults["params"])
+    params.update(job.get("params", {}))
+    job["params"] = params
+    for key in ("full_pgm", "pgm_num", "use_m99", "optimize", "peephole", "factored", "var_table",
+                "parts", "bank_stride", "linking", "protect_feed", "lookahead", "units"):
+        job.setdefault(key, defaults[key])
+    return job
+
+
+def _read_project_job(path, defaults):
+    """Builds a measure job from a saved project; command-line switches can only turn passes on."""
+    prj = PRJ.load(path)
+    params, opts = PRJ.measure_job(prj)
+    job = {"generator": "measure", "params": params, **opts}
+    job["optimize"] = defaults["optimize"]
+    job["peephole"] = prj["measure"]["settings"]["peephole"] or defaults["peephole"]
+    job["factored"] = opts["factored"] or defaults["factored"]
+    if defaults["lookahead"] == "scoped":
+        job["lookahead"] = "scoped"
+    for key in ("var_table", "parts", "bank_stride", "linking"):
+        if job[key] is None:
+            job[key] = defaults[key]
+    job["units"] = defaults["units"]
+    return job
+
+
+def _read_manifest(path):
+    """Returns the job paths listed in a manifest file."""
+    base = os.path.dirname(os.path.abspath(path))
+    if path.lower().endswith(".json"):
+        with open(path) as fh:
+            entries = json.load(fh).get("jobs", [])
+    else:
+        with open(path) as fh:
+            entries = [ln.strip() for ln in fh if ln.strip() and not ln.lstrip().startswith("#")]
+    return [e if os.path.isabs(e) else os.path.join(base, e) for e in entries]
+
+
+def _is_manifest(path):
+    low = path.lower()
+    if low.endswith(MANIFEST_EXTS):
+        return True
+    if low.endswith(".json"):
+        try:
+            with open(path) as fh:
+                return "jobs" in json.load(fh)
+        except (OSError, ValueError, TypeError):
+            return False
+    return False
+
+
+def discover_jobs(sources):
+    """Expands directories and manifests into an ordered list of job file paths."""
+    found = []
+    for src in sources:
+        if os.path.isdir(src):
+            names = sorted(n for n in os.listdir(src) if n.lower().endswith(JOB_EXTS))
+            found.extend(os.path.join(src, n) for n in names)
+        elif _is_manifest(src):
+            found.extend(discover_jobs(_read_manifest(src)))
+        else:
+            found.append(src)
+    return found
+
+
+def load_job(path, defaults):
+    """Loads one job file into a dict ready for _run_job."""
+    if path.lower().endswith(".csv"):
+        job = _read_csv_job(path, defaults)
+    elif path.lower().endswith(PRJ.EXT):
+        job = _read_project_job(path, defaults)
+    else:
+        job = _read_json_job(path, defaults)
+    job.setdefault("name", os.path.splitext(os.path.basename(path))[0])
+    job["source"] = path
+    return job
+
+
+# --- GENERATION (runs inside pool workers) ---
+
+def _wips_params(params):
+    return NC.collect_user_params(
+        t_num=params.get("t_num", 0),
+        wcs=params.get("wcs", "54"),
+        probe_cycle=params.get("probe_cycle", ""),
+        z_clr=params.get("z_clr", 0),
+        z_protect=params.get("z_protect", 0),
+        probe_plane=params.get("probe_plane", 0),
+        xpos=params.get("xpos", 0),
+        ypos=params.get("ypos", 0),
+        is_ext=params.get("is_ext", False),
+        args_dict=params.get("args_dict", params.get("args", {})),
+    )
+
+
+def build_program(job):
+    """Returns the program lines for a loaded job (lazy iterator for measure jobs)."""
+    params = job["params"]
+    generator = job.get("generator") or ("measure" if "features" in params else "wips")
+
+    if generator == "measure":
+        if job.get("optimize"):
+            features = params["features"]
+            ordered, job["travel_before"], job["travel_after"] = SEQ.reorder_features(features)
+            index = {id(f): i for i, f in enumerate(features)}
+            job["order"] = [index[id(f)] for f in ordered]  # stored with the cache entry
+            params = dict(params, features=ordered)
+            job["ordered"] = ordered
+        return NC.iter_feature_sequence(
+            params,
+            full_pgm=bool(job.get("full_pgm")),
+            pgm_num=job.get("pgm_num", "1234"),
+            use_m99=bool(job.get("use_m99")),
+            factored=bool(job.get("factored")),
+            var_table=job.get("var_table"),
+            parts=job.get("parts"),
+            bank_stride=job.get("bank_stride"),
+            linking=job.get("linking"),
+            protect_feed=job.get("protect_feed", 50),
+            lookahead=job.get("lookahead", "routine"),
+        )
+    if generator == "wips":
+        if "queue" in params:
+            # Each queued cycle overrides the job-level values it sets
+            steps = [_wips_params(dict(params, **step)) for step in params["queue"]]
+            return NC.generate_toolpath_chain(steps)
+        return NC.generate_toolpath(_wips_params(params))
+    raise ValueError(f"Unknown generator '{generator}'")
+
+
+# Job keys that change the finished program (units are covered by the key's number format)
+_OUTPUT_KEYS = ("generator", "full_pgm", "pgm_num", "use_m99", "optimize", "peephole", "factored", "var_table",
+                "parts", "bank_stride", "linking", "protect_feed", "lookahead")
+
+
+def _cache_options(job):
+    """Key options for a job: the output keys, plus the pinned slots when optimize reorders around them."""
+    opts = {k: job.get(k) for k in _OUTPUT_KEYS}
+    if job.get("optimize"):
+        opts["pins"] = [i for i, f in enumerate(job["params"].get("features", ())) if f.get("pinned")]
+    return opts
+
+
+def _cache_meta(job, saved, link_saved):
+    """What a cache hit cannot recover from the program text: probing order and stats."""
+    return {"order": job.get("order"), "travel": [job.get("travel_before"), job.get("travel_after")],
+            "peephole": saved, "link_saved": link_saved}
+
+
+def _restore(job, meta):
+    """Puts a cache entry's probing order and travel stats back on the job; returns (peephole, link_saved)."""
+    if meta["order"] is not None:
+        features = job["params"]["features"]
+        job["order"] = meta["order"]
+        job["ordered"] = [features[i] for i in meta["order"]]
+    job["travel_before"], job["travel_after"] = meta["travel"]
+    return meta["peephole"], meta["link_saved"]
+
+
+def _finish(job):
+    """(lines, peephole stats) for a job, without the cache."""
+    lines, saved = build_program(job), None
+    if job.get("peephole"):
+        # Whole-program pass: the streamed output is materialized for this job only
+        lines, saved = PH.optimize(lines)
+    return lines, saved
+
+
+def _unchanged(path, text):
+    """True if path already holds exactly text."""
+    try:
+        if os.path.getsize(path) != len(text.encode("utf-8")):
+            return False
+        with open(path, encoding="utf-8", newline="") as fh:
+            return fh.read() == text
+    except OSError:
+        return False
+
+
+def _probing_params(job):
+    """Measure job params with the features in the order the program probes them."""
+    params = job["params"]
+    if job.get("optimize"):
+        # The order the program was built with (from the cache entry on a hit)
+        params = dict(params, features=job["ordered"])
+    return params
+
+
+def _write_variable_file(job, out_dir):
+    """Writes <name>.var for a variable-table measure job; returns its path (None if off)."""
+    if job.get("var_table") is None or job.get("generator", "measure") != "measure":
+        return None
+    params = _probing_params(job)  # slots follow probing order
+    text = "".join(line + "\n" for line in NC.feature_variable_file(params, job["var_table"]))
+    path = os.path.join(out_dir, f"{job['name']}{NC.VARIABLE_FILE_EXT}")
+    if not _unchanged(path, text):
+        with open(path, "w", newline="\n") as fh:
+            fh.write(text)
+    return path
+
+
+def _write_skeleton(job, out_dir):
+    """Writes <name>_O<sub>.nc, the skeleton a factored measure job calls; returns its path (None if off)."""
+    if not job.get("factored") or job.get("generator", "measure") != "measure":
+        return None
+    pgm_num = job.get("pgm_num", "1234")
+    lines = NC.feature_skeleton(job["params"], pgm_num=pgm_num, parts=job.get("parts"), linking=job.get("linking"),
+                                protect_feed=job.get("protect_feed", 50), lookahead=job.get("lookahead", "routine"))
+    text = "".join(line + "\n" for line in lines)
+    path = os.path.join(out_dir, f"{job['name']}_O{NC.skeleton_number(pgm_num)}.nc")
+    if not _unchanged(path, text):
+        with open(path, "w", newline="\n") as fh:
+            fh.write(text)
+    return path
+
+
+def _linking_saved(job):
+    """Estimated seconds height-aware linking saves over clearance moves around every feature (None if off)."""
+    if not job.get("linking") or job.get("generator", "measure") != "measure":
+        return None
+    params = _probing_params(job)
+    # The written program's options; factored output is timed from the expanded program (same motion)
+    opts = {"var_table": job.get("var_table"), "parts": job.get("parts"), "bank_stride": job.get("bank_stride"),
+            "lookahead": job.get("lookahead", "routine")}
+    return CT.saved_seconds(NC.iter_feature_sequence(params, **opts),
+                            NC.iter_feature_sequence(params, linking=job["linking"],
+                                                     protect_feed=job.get("protect_feed", 50), **opts))
+
+
+def _run_job(job, out_dir):
+    """Pool worker: generate one job (or take it from the cache) and write its .nc file."""
+    try:
+        out_path = os.path.join(out_dir, f"{job['name']}.nc")
+        NF.set_units(job.get("units", "inch"))
+        saved = cached = skipped = link_saved = None
+        if job.get("cache", True):
+            key = PC.program_key("job", job["params"], _cache_options(job))
+            cache = PC.ProgramCache(job.get("cache_dir") or PC.CACHE_DIR)
+            text = cache.get(key)
+            meta = cache.meta(key) if text is not None else None
+            cached = meta is not None and "link_saved" in meta  # entries from before it was stored regenerate
+            if cached:
+                saved, link_saved = _restore(job, meta)
+            else:
+                lines, saved = _finish(job)
+                link_saved = _linking_saved(job)
+                text = cache.put(key, lines, _cache_meta(job, saved, link_saved))
+            n_lines, n_chars = text.count("\n"), len(text)
+            skipped = _unchanged(out_path, text)
+            if not skipped:
+                with open(out_path, "w", newline="\n") as fh:
+                    fh.write(text)
+        else:
+            lines, saved = _finish(job)
+            link_saved = _linking_saved(job)
+            with open(out_path, "w", newline="\n") as fh:
+                n_lines, n_chars = NC.write_program(lines, fh)
+        var_path = _write_variable_file(job, out_dir)
+        return {"name": job["name"], "path": out_path, "lines": n_lines, "bytes": n_chars, "error": None,
+                "travel": (job.get("travel_before"), job.get("travel_after")), "peephole": saved,
+                "cached": cached, "skipped": skipped, "var_path": var_path, "link_saved": link_saved,
+                "skeleton_path": _write_skeleton(job, out_dir)}
+    except Exception as e:
+        return {"name": job["name"], "path": None, "lines": 0, "bytes": 0, "error": str(e), "travel": (None, None),
+                "peephole": None, "cached": None, "skipped": None, "var_path": None, "link_saved": None,
+                "skeleton_path": None}
+
+
+def run_batch(jobs, out_dir, workers=None):
+    """Generates every job and returns results in input order."""
+    os.makedirs(out_dir, exist_ok=True)
+    if workers == 1 or len(jobs) <= 1:
+        return [_run_job(job, out_dir) for job in jobs]
+
+    chunk = max(1, len(jobs) // ((workers or os.cpu_count() or 1) * 4))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_run_job, jobs, [out_dir] * len(jobs), chunksize=chunk))
+
+
+# --- CLI ---
+
+def _build_parser():
+    ap = argparse.ArgumentParser(description="ApexProbe headless batch generator")
+    ap.add_argument("sources", nargs="+", help="Job files, job folders, or manifests")
+    ap.add_argument("-o", "--out", default="nc_out", help="Output folder for .nc files")
+    ap.add_argument("-j", "--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+
+    g = ap.add_argument_group("defaults for CSV jobs / missing JSON keys")
+    g.add_argument("--tool", default="50")
+    g.add_argument("--wcs", default="54")
+    g.add_argument("--ext", action="store_true", help="WCS is a G154 P extended offset")
+    g.add_argument("--z-clr", default="6.0")
+    g.add_argument("--z-protect", default="1.0")
+    g.add_argument("--full-pgm", action="store_true", help="Wrap with %% / O-number")
+    g.add_argument("--pgm-num", default="1234")
+    g.add_argument("--m99", action="store_true", help="End with M99 instead of M30")
+    g.add_argument("--optimize", action="store_true", help="Reorder features to shorten XY rapid travel")
+    g.add_argument("--peephole", action="store_true", help="Strip redundant modal words, dead moves and blanks")
+    g.add_argument("--factor", action="store_true", help="One G65 call per feature into a skeleton program (<name>_O<n>.nc)")
+    g.add_argument("--var-table", default=None, metavar="BASE",
+                   help="Nominals/tolerances in a <name>.var file at #[BASE+1]... instead of inline")
+    g.add_argument("--parts", default=None, metavar="WCS",
+                   help='Repeat the features in each work offset, e.g. "54-57,P1-P4" (one tool change)')
+    g.add_argument("--bank-stride", default=None, type=int, metavar="N",
+                   help="Macro offset between parts' result banks (default: span of the feature macros)")
+    g.add_argument("--link-regions", default=None, metavar="REGIONS",
+                   help='Height-aware linking over safe-height regions, "X0 Y0 X1 Y1 Z; ..."')
+    g.add_argument("--protect-feed", default="50.", metavar="F", help="P9810 protected-move feed (default 50.)")
+    g.add_argument("--scoped-lookahead", action="store_true",
+                   help="G103 P1 only around each capture and its checks, not the whole routine")
+    g.add_argument("--metric", action="store_true", help="Format coordinates to 3 decimals (mm)")
+    ap.add_argument("--no-cache", action="store_true", help="Regenerate every job, ignoring the program cache")
+    return ap
+
+
+def main(argv=None):
+    args = _build_parser().parse_args(argv)
+    defaults = {
+        "params": {
+            "t_num": args.tool,
+            "wcs": args.wcs,
+            "is_ext": args.ext,
+            "z_clr": args.z_clr,
+            "z_protect": args.z_protect,
+        },
+        "full_pgm": args.full_pgm,
+        "pgm_num": args.pgm_num,
+        "use_m99": args.m99,
+        "optimize": args.optimize,
+        "peephole": args.peephole,
+        "factored": args.factor,
+        "var_table": args.var_table,
+        "parts": args.parts,
+        "bank_stride": args.bank_stride,
+        "linking": args.link_regions,
+        "protect_feed": args.protect_feed,
+        "lookahead": "scoped" if args.scoped_lookahead else "routine",
+        "units": "metric" if args.metric else "inch",
+    }
+
+    t0 = time.perf_counter()
+    paths = discover_jobs(args.sources)
+    if not paths:
+        print("No job files found.", file=sys.stderr)
+        return 1
+
+    jobs, failed = [], 0
+    for path in paths:
+        try:
+            jobs.append(load_job(path, defaults))
+            jobs[-1]["cache"] = not args.no_cache
+        except Exception as e:
+            failed += 1
+            print(f"  SKIP  {path}: {e}", file=sys.stderr)
+
+    results = run_batch(jobs, args.out, workers=args.workers)
+    elapsed = time.perf_counter() - t0
+
+    total_lines = total_bytes = 0
+    saved_blocks = saved_bytes = 0
+    n_cached = n_skipped = 0
+    for res in results:
+        if res["error"]:
+            failed += 1
+            print(f"  FAIL  {res['name']}: {res['error']}", file=sys.stderr)
+            continue
+        total_lines += res["lines"]
+        total_bytes += res["bytes"]
+        before, after = res["travel"]
+        travel = f"  XY {before:.2f} -> {after:.2f}" if before is not None else ""
+        if res["var_path"]:
+            travel += f"  + {os.path.basename(res['var_path'])}"
+        if res["skeleton_path"]:
+            travel += f"  + {os.path.basename(res['skeleton_path'])}"
+        if res["link_saved"] is not None:
+            travel += f"  linking -{CT.format_seconds(res['link_saved'])}"
+        if res["peephole"]:
+            saved_blocks += res["peephole"]["blocks_in"] - res["peephole"]["blocks_out"]
+            saved_bytes += res["peephole"]["bytes_in"] - res["peephole"]["bytes_out"]
+        n_cached += bool(res["cached"])
+        n_skipped += bool(res["skipped"])
+        status = "SAME" if res["skipped"] else "OK  "
+        print(f"  {status}  {res['name']:<24} {res['lines']:>8} lines  -> {res['path']}{travel}")
+
+    done = len(results) - sum(1 for r in results if r["error"])
+    rate = done / elapsed if elapsed > 0 else 0.0
+    print(
+        f"\n{done} program(s), {total_lines} lines, {total_bytes / 1024:.1f} KiB "
+        f"in {elapsed:.2f}s ({rate:.1f} jobs/s, {total_lines / elapsed if elapsed > 0 else 0:.0f} lines/s)"
+    )
+    if n_cached or n_skipped:
+        print(f"{n_cached} served from cache, {n_skipped} unchanged on disk (not rewritten)")
+    if saved_blocks or saved_bytes:
+        print(f"Peephole saved {saved_blocks} blocks, {saved_bytes / 1024:.1f} KiB")
+    if failed:
+        print(f"{failed} job(s) failed.", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
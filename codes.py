@@ -3,10 +3,19 @@ ApexProbe | lib/codes.py
 G & M code definitions & combos
 """
 
+from itertools import islice, repeat, tee
+
+from lib import numfmt as NF
+
+# Bump whenever the programs generated from the same inputs change:
+# lib/program_cache.py keys cached programs on it.
+GENERATOR_VERSION = "4"
+
 # --- G CODES (Lobby / Global Scope) ---
 G00  = "G00"
 G01  = "G01"
 G28  = "G28"
+G31  = "G31"
 G43  = "G43"
 G65  = "G65"
 G90  = "G90"
@@ -40,15 +49,111 @@ WIPS_STORM    = "G65 P9995"
 G_HOME_Z  = f"{G00} {G91} {G28} Z0."
 G_SAFE_XY = f"{G00} {G90} {G154} P99 X0. Y0."
 
+# --- LOOK-AHEAD ---
+# "routine": G103 P1 for the whole probing routine (conservative default).
+# "scoped" : G103 P1 only from each probing cycle through its #188 / #5063 capture
+#            and IF checks; linking moves between probes keep normal look-ahead.
+LOOKAHEAD_MODES = ("routine", "scoped")
+G103_LIMIT   = f"{G103} P1 (LIMIT LOOK-AHEAD)"
+G103_RESTORE = f"{G103} P0 (RESTORE LOOK-AHEAD)"
 
-def f_dec(value):  # Helper function for formatting decimals
-    try:
-        s = str(value).strip()
-        if not s:
-            return "0."
-        return s if "." in s else f"{s}."
-    except:
-        return "0."
+
+def _scoped_lookahead(lookahead):
+    if lookahead not in LOOKAHEAD_MODES:
+        raise ValueError(f"Look-ahead mode '{lookahead}': use {' or '.join(LOOKAHEAD_MODES)}")
+    return lookahead == "scoped"
+
+
+# --- WIPS CYCLE REGISTRY ---
+# ROOT SOURCE OF TRUTH for every P9995 cycle. Generators, the WIPS tab and the
+# Measure Features tab all read from CYCLES; nothing else keeps its own copy.
+# Columns: key, A-code, measure label, WIPS label, used args, nominal arg,
+#          diagram, helper text, UI defaults (d, e, h)
+_CYCLE_TABLE = [
+    ("A10",  "A10.", "A10 - Bore",        "A10 - Bore (Internal)",    "D",   "D", "bore.png",
+     "Bore (A10): D = Target Diameter.",                          ("1.0", "0",   "0")),
+    ("A11",  "A11.", "A11 - Boss",        "A11 - Boss (External)",    "DH",  "D", "boss.png",
+     "Boss (A11): D = Diameter, H = Z-depth for probing.",        ("1.0", "0",   "-0.5")),
+    ("A12",  "A12.", "A12 - Rect Pocket", "A12 - Rectangular Pocket", "DE",  "D", "rect_pocket.png",
+     "Rect Pocket (A12): D = X Width, E = Y Width.",              ("1.0", "1.0", "0")),
+    ("A13",  "A13.", "A13 - Rect Boss",   "A13 - Rectangular Boss",   "DEH", "D", "rect_boss.png",
+     "Rect Boss (A13): D = X Width, E = Y Width, H = Z-depth.",   ("1.0", "1.0", "-0.5")),
+    ("A14",  "A14.", "A14 - Web X",       "A14 - Web X",              "DH",  "D", "web_x.png",
+     "Web X (A14): D = Width, H = Z-depth.",                      ("1.0", "0",   "-0.5")),
+    ("A15",  "A15.", "A15 - Pocket X",    "A15 - Pocket X",           "D",   "D", "pocket_x.png",
+     "Pocket X (A15): D = Width.",                                ("1.0", "0",   "0")),
+    ("A16",  "A16.", "A16 - Web Y",       "A16 - Web Y",              "EH",  "E", "web_y.png",
+     "Web Y (A16): E = Width, H = Z-depth.",                      ("0",   "1.0", "-0.5")),
+    ("A17",  "A17.", "A17 - Pocket Y",    "A17 - Pocket Y",           "E",   "E", "pocket_y.png",
+     "Pocket Y (A17): E = Width.",                                ("0",   "1.0", "0")),
+    ("A20X", "A20.", "A20 - Surface X",   "A20 - Surface X",          "D",   "D", "surf_x.png",
+     "X Surface (A20): D = Approach direction/dist.",             ("1.0", "0",   "0")),
+    ("A20Y", "A20.", "A20 - Surface Y",   "A20 - Surface Y",          "E",   "E", "surf_y.png",
+     "Y Surface (A20): E = Approach direction/dist.",             ("0",   "1.0", "0")),
+    ("A20Z", "A20.", "A20 - Surface Z",   "A20 - Surface Z",          "H",   "H", "surf_z.png",
+     "Z Surface (A20): H = Direction (Generator forces negative).", ("0",   "0",   "-1.0")),
+]
+
+
+def _compile_formatter(a_code, args):
+    """
+    Precompiles the P9995 line for one cycle into a (args_dict, w_macro) -> str
+    callable. Positional template slots plus fixed-arity closures keep the
+    per-feature cost to the f_dec calls and one str.format.
+    """
+    words = " ".join(f"{a}{{{n}}}" for n, a in enumerate(args, start=1))
+    fmt = f"{WIPS_STORM} {a_code} {words} {{0}}".format
+    pairs = [(a, a.lower()) for a in args]
+
+    if len(pairs) == 1:
+        (u1, l1), = pairs
+        return lambda ad, w: fmt(w, f_dec(ad.get(u1, ad.get(l1, "0"))))
+    if len(pairs) == 2:
+        (u1, l1), (u2, l2) = pairs
+        return lambda ad, w: fmt(w, f_dec(ad.get(u1, ad.get(l1, "0"))), f_dec(ad.get(u2, ad.get(l2, "0"))))
+    (u1, l1), (u2, l2), (u3, l3) = pairs
+    return lambda ad, w: fmt(w, f_dec(ad.get(u1, ad.get(l1, "0"))), f_dec(ad.get(u2, ad.get(l2, "0"))),
+                             f_dec(ad.get(u3, ad.get(l3, "0"))))
+
+
+def _compile_cycles(table):
+    """Builds the keyed registry with precompiled P9995 format templates."""
+    registry = {}
+    for key, a_code, label, wips_label, args, nominal, image, help_msg, (d, e, h) in table:
+        registry[key] = {
+            "key": key,
+            "a_code": a_code,
+            "label": label,
+            "wips_label": wips_label,
+            "args": tuple(args),
+            "nominal": nominal,
+            "image": image,
+            "help": help_msg,
+            "defaults": {"d": d, "e": e, "h": h},
+            "states": {c: c.upper() in args for c in "deh"},
+            "fmt": _compile_formatter(a_code, args),
+        }
+    return registry
+
+
+CYCLES = _compile_cycles(_CYCLE_TABLE)
+
+# Display label (either tab's wording) or bare key -> cycle key
+CYCLE_KEYS = {}
+for _c in CYCLES.values():
+    CYCLE_KEYS[_c["key"]] = _c["key"]
+    CYCLE_KEYS[_c["label"]] = _c["key"]
+    CYCLE_KEYS[_c["wips_label"]] = _c["key"]
+del _c
+
+
+def get_cycle(key_or_label):
+    """O(1) registry lookup by cycle key or display label. Returns None if unknown."""
+    return CYCLES.get(CYCLE_KEYS.get(key_or_label))
+
+
+# Helper for formatting decimals: fixed precision (inch/metric), always Haas-legal
+f_dec = NF.fmt
 
 
 def format_wcs(wcs_num, is_ext):  
@@ -83,32 +188,19 @@ def collect_user_params(t_num, wcs, probe_cycle, z_clr, z_protect, probe_plane,
     }
 
 
+def _cycle_line(cycle_key, args_dict, w_macro):
+    cycle = CYCLES.get(cycle_key)
+    if cycle is None:
+        return f"(ERROR: UNKNOWN CYCLE {cycle_key})"
+    return cycle["fmt"](args_dict, w_macro)
+
+
 def generate_cycle_line(cycle_key, args_dict, wcs, is_ext):
     """
     Builds the G65 P9995 macro line based on cycle key and arguments.
     """
     _, w_macro = format_wcs(wcs, is_ext)
-
-    # Standard Arg Extraction (Handles both upper and lower case from UI)
-    d = f_dec(args_dict.get("D", args_dict.get("d", "0")))
-    e = f_dec(args_dict.get("E", args_dict.get("e", "0")))
-    h = f_dec(args_dict.get("H", args_dict.get("h", "0")))
-    i = f_dec(args_dict.get("I", args_dict.get("i", "0")))
-
-    # Cycle Mappings
-    if cycle_key == "A10": return f"{WIPS_STORM} A10. D{d} {w_macro}"
-    if cycle_key == "A11": return f"{WIPS_STORM} A11. D{d} H{h} {w_macro}"
-    if cycle_key == "A12": return f"{WIPS_STORM} A12. D{d} E{e} {w_macro}"
-    if cycle_key == "A13": return f"{WIPS_STORM} A13. D{d} E{e} H{h} {w_macro}"
-    if cycle_key == "A14": return f"{WIPS_STORM} A14. D{d} H{h} {w_macro}"
-    if cycle_key == "A15": return f"{WIPS_STORM} A15. D{d} {w_macro}"
-    if cycle_key == "A16": return f"{WIPS_STORM} A16. E{e} H{h} {w_macro}"
-    if cycle_key == "A17": return f"{WIPS_STORM} A17. E{e} {w_macro}"
-    if cycle_key == "A20Z": return f"{WIPS_STORM} A20. H{h} {w_macro}"
-    if cycle_key == "A20X": return f"{WIPS_STORM} A20. D{d} {w_macro}"
-    if cycle_key == "A20Y": return f"{WIPS_STORM} A20. E{e} {w_macro}"
-    
-    return f"(ERROR: UNKNOWN CYCLE {cycle_key})"
+    return _cycle_line(cycle_key, args_dict, w_macro)
 
 
 def generate_toolpath(params: dict):
@@ -150,21 +242,551 @@ def generate_toolpath(params: dict):
     return toolpath
 
 
-def generate_feature_sequence(params: dict, full_pgm=False, pgm_num="1234", use_m99=False):
+def generate_toolpath_chain(steps: list):
     """
-    Builds a sequential measurement toolpath for multiple features.
-    
-    Safety Logic:
-    - ALWAYS homes and clears before Tool Change.
-    - ALWAYS homes and clears after probing completes.
-    - full_pgm only controls O-num, %, and M30/M99 termination.
+    Chains queued single cycles (collect_user_params dicts) behind one sandwich:
+    one T M06, one G43 and one probe-on up front, one probe-off and home at the end.
+    Between cycles the probe stays on: retract to clearance, rapid to the next start,
+    then the protected descent to the plane. A work offset change switches the offset
+    and rises to the new offset's clearance before any XY move (as _part_header does).
+    """
+    if not steps:
+        raise ValueError("The cycle queue is empty.")
+    tools = sorted({int(s["t_num"]) for s in steps})
+    if len(tools) > 1:
+        raise ValueError(f"Queued cycles use tools {', '.join(f'T{t}' for t in tools)}; a chain runs on one probe.")
+    t_num = tools[0]
+
+    first = steps[0]
+    g_prev, _ = format_wcs(first["wcs"], is_ext=first["is_ext"])
+    toolpath = [
+        "",
+        G_HOME_Z,
+        G_SAFE_XY,
+        f"T{t_num} {M06}",
+        f"{G00} {G90} {g_prev} X{f_dec(first['xpos'])} Y{f_dec(first['ypos'])}",
+        f"{G43} H{t_num} Z{f_dec(first['z_clr'])}",
+        f"{G00} Z{f_dec(first['z_protect'])}",
+        PROBE_ON,
+    ]
+    for k, step in enumerate(steps):
+        g_wcs, _ = format_wcs(step["wcs"], is_ext=step["is_ext"])
+        if k:
+            prev = steps[k - 1]
+            if g_wcs != g_prev:
+                # Retract in the old offset, then clear the new part in its own offset, then move over
+                toolpath.append(f"{G00} Z{f_dec(prev['z_clr'])}")
+                toolpath.append(f"{G00} {G90} {g_wcs}")
+                toolpath.append(f"{G00} Z{f_dec(step['z_clr'])}")
+            else:
+                # Same offset: the rapid must clear both cycles' surroundings
+                toolpath.append(f"{G00} Z{f_dec(max(float(prev['z_clr']), float(step['z_clr'])))}")
+            toolpath.append(f"{G00} X{f_dec(step['xpos'])} Y{f_dec(step['ypos'])}")
+            toolpath.append(f"{G00} Z{f_dec(step['z_protect'])}")
+        cycle = CYCLES.get(step["probe_cycle"])
+        label = cycle["label"] if cycle else step["probe_cycle"]
+        toolpath += [
+            f"(CYCLE {k+1} OF {len(steps)}: {label.upper()})",
+            f"{PROBE_PROTECT} Z{f_dec(step['probe_plane'])}",
+            "",
+            generate_cycle_line(step["probe_cycle"], step["args_dict"], step["wcs"], is_ext=step["is_ext"]),
+            "",
+        ]
+        g_prev = g_wcs
+
+    toolpath += [
+        PROBE_OFF,
+        f"{G43} H{t_num} Z{f_dec(steps[-1]['z_clr'])}",
+        G_HOME_Z,
+        G_SAFE_XY,
+        M01,
+        "",
+    ]
+    return toolpath
+
+
+def _feature_macro(feat):
+    return str(feat.get("macro", feat.get("macro_num", ""))).replace("#", "").strip()
+
+
+def _feature_nominal(feat, cycle=None):
+    """Explicit nominal, else the cycle's nominal arg (SMART NOMINAL, from the registry)."""
+    nominal = str(feat.get("nominal", "")).strip()
+    if not nominal:
+        cycle = cycle or CYCLES.get(feat.get("cycle_key", ""))
+        if cycle:
+            n_arg = cycle["nominal"]
+            args = feat.get("args", {})
+            nominal = str(args.get(n_arg, args.get(n_arg.lower(), ""))).strip()
+    return nominal
+
+
+def _feature_check(feat):
+    """(nominal, tol) for a feature evaluated against a tolerance, else None."""
+    tol = str(feat.get("tol", feat.get("tolerance", ""))).strip()
+    if not (_feature_macro(feat) and tol):
+        return None
+    nominal = _feature_nominal(feat)
+    return (nominal, tol) if nominal else None
+
+
+def variable_table_size(features):
+    """Macros a nominal/tolerance variable table needs: two per evaluated feature."""
+    return 2 * sum(1 for feat in features if _feature_check(feat) is not None)
+
+
+def _iter_variable_slots(features, var_table):
+    """
+    Per feature: (nominal macro, tolerance macro) in the variable table starting at
+    #[var_table+1], in feature order; None for features without a tolerance check
+    (and for every feature when var_table is None: inline mode).
+    """
+    if var_table is None or var_table == "":
+        yield from repeat(None, len(features))
+        return
+    k = int(_clean_macro(var_table))
+    for feat in features:
+        if _feature_check(feat) is None:
+            yield None
+        else:
+            yield k + 1, k + 2
+            k += 2
+
+
+def _variable_slots(features, var_table):
+    return list(_iter_variable_slots(features, var_table))
+
+
+def _variable_range(features, var_table):
+    """(first, last) macro of the variable table, or None (inline mode / nothing evaluated)."""
+    if var_table is None or var_table == "":
+        return None
+    size = variable_table_size(features)
+    base = int(_clean_macro(var_table))
+    return (base + 1, base + size) if size else None
+
+
+def _reset_runs(macros, min_run=6):
+    """
+    #mac = 0. resets; runs of min_run or more consecutive macros collapse into one
+    WHILE loop over indirect #[#1], so the opening block stays short for long lists.
+    """
+    try:
+        nums = sorted({int(m) for m in macros})
+    except ValueError:
+        yield from (f"#{m} = 0." for m in macros)  # not plain numbers: reset one by one
+        return
+    i = 0
+    while i < len(nums):
+        j = i
+        while j + 1 < len(nums) and nums[j + 1] == nums[j] + 1:
+            j += 1
+        if j - i + 1 >= min_run:
+            yield f"#1 = {nums[i]} (RESET #{nums[i]}-#{nums[j]})"
+            yield f"WHILE [#1 LE {nums[j]}] DO1"
+            yield "#[#1] = 0."
+            yield "#1 = #1 + 1"
+            yield "END1"
+        else:
+            yield from (f"#{n} = 0." for n in nums[i:j + 1])
+        i = j + 1
+
+
+def _sequence_header(macros, t_int, g_wcs, z_clr, table=None, compact=False, scoped=False, sub_pgm=None):
+    """
+    Opening block: macro resets, safety, tool change, probe on. compact folds long reset runs into loops
+    (which needs every macro number at once); otherwise macros is only walked, so it may be lazy.
+    table: (first, last) macro of the variable table (_variable_range).
+    scoped: no routine-wide G103 P1; each feature block limits look-ahead itself.
+    sub_pgm: factored mode; the skeleton (feature_skeleton) is a separate program on the control.
+    """
+    yield ""
+    yield "(MULTI-FEATURE MEASUREMENT ROUTINE)"
+    if not scoped:
+        yield G103_LIMIT
+
+    if table:
+        # Variable file mode: nominals/tolerances are already on the control
+        yield f"(NOMINAL/TOL TABLE #{table[0]}-#{table[1]}: LOAD THE VARIABLE FILE FIRST)"
+        yield f"IF [#{table[0] + 1} EQ #0] #3000 = 2 (VARIABLE FILE NOT LOADED)"
+    if sub_pgm:
+        yield f"(G65 P{sub_pgm}: LOAD THE FEATURE SKELETON O{sub_pgm} AS ITS OWN PROGRAM FIRST)"
+    yield "(RESET FEATURE MACROS)"
+
+    if compact or table:
+        yield from _reset_runs(macros)
+    else:
+        for mac in macros:
+            yield f"#{mac} = 0."
+
+    yield ""
+    yield G_HOME_Z
+    yield G_SAFE_XY
+    yield f"T{t_int} {M06} (PROBE TOOL)"
+    yield f"{G00} {G90} {g_wcs}"
+    yield f"{G43} H{t_int} Z{f_dec(z_clr)}"
+    yield PROBE_ON
+
+
+XYZ_CHUNK = 1024  # features per vectorized formatting pass while streaming
+
+
+def _iter_xyz(features, chunk=XYZ_CHUNK):
+    """Formatted (x, y, plane) per feature; each column is formatted chunk by chunk, so memory stays bounded."""
+    it = iter(features)
+    while True:
+        block = list(islice(it, chunk))
+        if not block:
+            return
+        yield from zip(*(NF.fmt_many([f.get(k, "0") for f in block]) for k in ("x", "y", "plane")))
+
+
+def _xyz_columns(features):
+    return list(_iter_xyz(features))
+
+
+def _feature_block(i, feat, t_int, w_macro, z_clr, z_protect, xyz=None, slot=None, link=None, feed="50.",
+                   scoped=False):
+    """
+    Probing block for a single feature (move, protect, cycle, store, evaluate, retract).
+    slot: (nominal, tolerance) macros to compare against instead of inline values.
+    link: (approach, retract) heights from _link_plan; approach None = already there.
+    scoped: G103 P1 / P0 around cycle + capture + checks (features that store a result).
+    """
+    comment = feat.get("comment", f"FEATURE {i+1}").strip()
+    if xyz is None:
+        xyz = f_dec(feat.get("x", "0")), f_dec(feat.get("y", "0")), f_dec(feat.get("plane", "0"))
+    x, y, plane = xyz
+    macro   = _feature_macro(feat)
+    check   = _feature_check(feat)
+    args    = feat.get("args", {})
+
+    # Calculate N-Number: (Tool * 100) + (Index + 1)
+    n_val = (t_int * 100) + (i + 1)
+    approach, retract = link[:2] if link else (f_dec(z_protect), f_dec(z_clr))
+
+    yield ""
+    yield f"N{n_val} ({comment.upper()}: {feat['cycle_key']})"
+    yield f"{G00} X{x} Y{y}"
+    if approach is not None:
+        yield f"{G00} Z{approach}"
+    yield f"{PROBE_PROTECT} Z{plane} F{feed}"
+    if scoped and macro:
+        yield G103_LIMIT
+    yield _cycle_line(feat["cycle_key"], args, w_macro)
+
+    if macro:
+        yield f"#{macro} = #188 (STORE MEASURED)"
+
+        if check:
+            if slot:
+                nom_val, tol_val = f"#{slot[0]}", f"#{slot[1]}"
+            else:
+                nom_val, tol_val = f_dec(check[0]), f_dec(check[1])
+            yield f"(--- {comment.upper()} EVALUATION ---)"
+            yield f"#100 = ABS[ #{macro} - {nom_val} ] (DEVIATION)"
+            yield f"IF [ #100 GT {tol_val} ] #3000 = 1 ({comment.upper()} OUT OF TOL)"
+        if scoped:
+            yield G103_RESTORE
+
+    yield f"{G00} Z{retract}"
+
+
+# Factored mode: G65 letters -> local variables inside the feature subprogram
+# (C / R: approach and retract heights, passed only with height-aware linking)
+_SKELETON_ARGS = {"A": 1, "C": 3, "I": 4, "D": 7, "E": 8, "H": 11, "M": 13, "R": 18, "T": 20, "W": 23,
+                  "X": 24, "Y": 25, "Z": 26}
+
+
+def skeleton_number(pgm_num, sub_pgm=None):
+    """Skeleton program number: explicit sub_pgm, else the main O-number + 1."""
+    sub_pgm = str(sub_pgm or "").upper().replace("O", "").strip()
+    if sub_pgm:
+        return sub_pgm
+    try:
+        return str(int(str(pgm_num).upper().replace("O", "").strip()) + 1)
+    except ValueError:
+        return "9000"
+
+
+def _feature_call(i, feat, t_int, sub_pgm, xyz=None, slot=None, w_word=None, link=None):
+    """One-line factored feature: G65 call into the skeleton subprogram (w_word: per-part W, link: C/R heights)."""
+    comment = feat.get("comment", f"FEATURE {i+1}").strip()
+    macro   = _feature_macro(feat)
+    check   = _feature_check(feat)
+    args    = feat.get("args", {})
+    cycle   = CYCLES.get(feat.get("cycle_key", ""))
+    if cycle is None:
+        yield f"(ERROR: UNKNOWN CYCLE {feat.get('cycle_key')})"
+        return
+
+    if xyz is None:
+        xyz = f_dec(feat.get("x", "0")), f_dec(feat.get("y", "0")), f_dec(feat.get("plane", "0"))
+    words = [f"{G65} P{sub_pgm}", cycle["a_code"], f"X{xyz[0]}", f"Y{xyz[1]}", f"Z{xyz[2]}"]
+    # Only the cycle's own args are passed; the rest stay #0 so P9995 never sees them
+    words += [f"{a}{f_dec(args.get(a, args.get(a.lower(), '0')))}" for a in cycle["args"]]
+    if w_word:
+        words.append(w_word)
+    if link:
+        words += [f"C{link[2]}", f"R{link[1]}"]
+    if macro:
+        words.append(f"M{f_dec(macro)}")
+        if slot:
+            words += [f"I#{slot[0]}", f"T#{slot[1]}"]
+        elif check:
+            words += [f"I{f_dec(check[0])}", f"T{f_dec(check[1])}"]
+    yield f"N{(t_int * 100) + (i + 1)} {' '.join(words)} ({comment.upper()}: {feat['cycle_key']})"
+
+
+def _feature_subprogram(sub_pgm, w_macro, z_clr, z_protect, linked=False, feed="50.", scoped=False):
+    """The per-feature skeleton, emitted once; numbers arrive as G65 arguments."""
+    a = {k: f"#{v}" for k, v in _SKELETON_ARGS.items()}
+    yield "%"
+    yield f"O{sub_pgm} (APEXPROBE FEATURE SKELETON)"
+    yield "(A=CYCLE X Y=POSITION Z=PLANE D E H=CYCLE ARGS)"
+    yield "(M=RESULT MACRO I=NOMINAL T=TOLERANCE)"
+    if linked:
+        yield "(C=APPROACH Z R=RETRACT Z)"
+    yield f"{G00} X{a['X']} Y{a['Y']}"
+    yield f"{G00} Z{a['C'] if linked else f_dec(z_protect)}"
+    yield f"{PROBE_PROTECT} Z{a['Z']} F{feed}"
+    if scoped:
+        yield G103_LIMIT
+    yield f"{WIPS_STORM} A{a['A']} D{a['D']} E{a['E']} H{a['H']} {w_macro}"
+    yield f"IF [{a['M']} EQ #0] GOTO10"
+    yield f"#[{a['M']}] = #188 (STORE MEASURED)"
+    yield f"IF [{a['T']} EQ #0] GOTO10"
+    yield f"#100 = ABS[ #[{a['M']}] - {a['I']} ] (DEVIATION)"
+    yield f"IF [ #100 GT {a['T']} ] #3000 = 1 (FEATURE OUT OF TOL)"
+    yield "N10"
+    if scoped:
+        yield G103_RESTORE
+    yield f"{G00} Z{a['R'] if linked else f_dec(z_clr)}"
+    yield M99
+    yield "%"
+
+
+def feature_skeleton(params: dict, pgm_num="1234", sub_pgm=None, parts=None, linking=None,
+                     protect_feed=50, lookahead="routine"):
+    """
+    The skeleton program a factored measure program calls with G65, as its own
+    file (%, O-number, body, M99, %). It must be loaded on the control next to
+    the main program; pass the same options the main program was built with.
+    """
+    _, _, w_macro, z_clr, z_protect = _sequence_context(params)
+    if isinstance(parts, str):
+        parts = parse_wcs_list(parts, params["is_ext"])
+    regions, feed = _linking_opts(linking, protect_feed)
+    return list(_feature_subprogram(skeleton_number(pgm_num, sub_pgm), _skeleton_w(w_macro, len(parts or ()) > 1),
+                                    z_clr, z_protect, regions is not None, feed, _scoped_lookahead(lookahead)))
+
+
+# --- Multi-part replication ---
+# One program probes the same feature set in several work offsets (tombstones,
+# multi-vise loads): one tool change and one probe-on, and part k stores its
+# results in its own macro bank (macro + k * stride).
+
+def parse_wcs_list(text, is_ext=False):
+    """
+    "54-57, P1-P4, G59" -> [(wcs, is_ext)] for format_wcs, in the order given.
+    A P prefix means G154 P1-P99, a G prefix G54-G59; plain numbers follow is_ext.
+    """
+    parts = []
+    for token in str(text).replace(",", " ").split():
+        tok = token.upper()
+        ext = tok.startswith("P") or (is_ext and not tok.startswith("G"))
+        lo, _, hi = tok.replace("P", "").replace("G", "").partition("-")
+        try:
+            lo = int(lo)
+            hi = int(hi) if hi else lo
+        except ValueError:
+            raise ValueError(f"'{token}' is not a work offset or range")
+        legal = range(1, 100) if ext else range(54, 60)
+        if lo not in legal or hi not in legal or hi < lo:
+            raise ValueError(f"'{token}': use {'G154 P1-P99' if ext else 'G54-G59'}")
+        for n in range(lo, hi + 1):
+            entry = (str(n), ext)
+            if entry in parts:
+                raise ValueError(f"{format_wcs(*entry)[0]} is listed twice")
+            parts.append(entry)
+    return parts
+
+
+def macro_span(macros):
+    """max - min + 1 over the macro numbers (0 for none): the smallest stride that keeps banks apart."""
+    nums = [int(_clean_macro(m)) for m in macros if _clean_macro(m)]
+    return max(nums) - min(nums) + 1 if nums else 0
+
+
+def bank_offsets(macros, n_parts, bank_stride=None, reserved=()):
+    """
+    Macro offset per part: 0, stride, 2 * stride, ... (stride default: macro_span).
+    Raises ValueError when a bank would overlap the next, leave the Haas user
+    ranges or land on a reserved macro (tolerance, variable/point tables).
+    """
+    try:
+        nums = sorted({int(_clean_macro(m)) for m in macros if _clean_macro(m)})
+    except ValueError:
+        raise ValueError("Result macros must be plain numbers to replicate across parts.")
+    span = macro_span(nums)
+    stride = span if bank_stride is None or str(bank_stride).strip() == "" else int(bank_stride)
+    if n_parts > 1 and stride < span:
+        raise ValueError(f"Bank stride {stride} is smaller than one part's macro span ({span}); banks would overlap.")
+    blocked = {int(_clean_macro(r)) for r in reserved if _clean_macro(r)}
+    offsets = [k * stride for k in range(n_parts)]
+    for k, off in enumerate(offsets[1:], start=2):
+        for n in nums:
+            m = n + off
+            if m in blocked or m == 100 or not any(m in r for r in haas_user_macros):
+                why = "a reserved macro" if m in blocked or m == 100 else "outside the user macro ranges"
+                raise ValueError(f"Part {k}: #{n} + {off} = #{m} is {why}. Change the bank stride or macros.")
+    return offsets
+
+
+def bank_macros(macros, parts, is_ext=False, bank_stride=None):
+    """Per part, the macros its bank uses (part 1 = macros). [macros] when parts is blank."""
+    macros = [_clean_macro(m) for m in macros if _clean_macro(m)]
+    if not parts:
+        return [macros]
+    if isinstance(parts, str):
+        parts = parse_wcs_list(parts, is_ext)
+    return [[_bank_macro(m, off) for m in macros] for off in bank_offsets(macros, len(parts), bank_stride)]
+
+
+def _bank_macro(mac, offset):
+    return str(int(mac) + offset) if offset and mac else mac
+
+
+def _bank_feature(feat, offset):
+    mac = _feature_macro(feat)
+    return dict(feat, macro=_bank_macro(mac, offset)) if offset and mac else feat
+
+
+def _sequence_banks(params, macros, parts, bank_stride, table=None):
+    """[(g_wcs, w_macro, macro offset)] per part; a single offset-0 entry without parts (macros is then unused)."""
+    if not parts:
+        return [format_wcs(params["wcs"], params["is_ext"]) + (0,)]
+    if isinstance(parts, str):
+        parts = parse_wcs_list(parts, params["is_ext"])
+    reserved = range(table[0], table[1] + 1) if table else ()
+    offsets = bank_offsets(macros, len(parts), bank_stride, reserved=reserved)
+    return [format_wcs(wcs, ext) + (off,) for (wcs, ext), off in zip(parts, offsets)]
+
+
+# --- Height-aware linking ---
+# Optional replacement for "clearance Z -> protect Z" around every feature. The user
+# describes the part as rectangles with a safe height each (the lowest Z a rapid may
+# pass at anywhere inside); each link then retracts only as high as the rectangles
+# its XY move touches, and the protected move starts from the feature's own region.
+# Ground outside every region is unknown: links crossing it use the full clearance.
+
+def parse_regions(text):
+    """
+    "x0 y0 x1 y1 z; ..." (commas or spaces, one region per ';' or line) ->
+    [(x0, y0, x1, y1, safe_z)] with x0 <= x1, y0 <= y1.
+    """
+    regions = []
+    for chunk in str(text).replace("\n", ";").split(";"):
+        nums = chunk.replace(",", " ").split()
+        if not nums: continue
+        try:
+            x0, y0, x1, y1, z = map(float, nums)
+        except ValueError:
+            raise ValueError(f"Region '{chunk.strip()}': expected X0 Y0 X1 Y1 SAFE-Z")
+        regions.append((min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1), z))
+    return regions
+
+
+def _box_covered(regions, x0, y0, x1, y1):
+    """
+    True when the union of regions covers the box. Coverage only changes at region
+    edges, so checking each edge coordinate and each midpoint between them is exact.
+    """
+    def samples(lo, hi, edges):
+        cuts = sorted({lo, hi} | {e for e in edges if lo < e < hi})
+        return cuts + [(a + b) / 2 for a, b in zip(cuts, cuts[1:])]
+
+    xs = samples(x0, x1, [e for r in regions for e in (r[0], r[2])])
+    ys = samples(y0, y1, [e for r in regions for e in (r[1], r[3])])
+    return all(any(r[0] <= x <= r[2] and r[1] <= y <= r[3] for r in regions) for x in xs for y in ys)
+
+
+def _link_height(regions, a, b, z_clr):
+    """
+    Lowest safe rapid height from XY a to XY b. G00 is not guaranteed to be a
+    straight line, so the whole bounding box of the move counts.
+    """
+    x0, x1 = sorted((a[0], b[0]))
+    y0, y1 = sorted((a[1], b[1]))
+    touched = [r for r in regions if r[0] <= x1 and r[2] >= x0 and r[1] <= y1 and r[3] >= y0]
+    if not touched or not _box_covered(touched, x0, y0, x1, y1):
+        return z_clr
+    return min(max(r[4] for r in touched), z_clr)
+
+
+def _iter_link_plan(xyz, regions, z_clr, z_protect):
+    """
+    Per feature (approach, retract, approach-for-the-skeleton), formatted. approach
+    is None when the previous link already left the probe at that height. The
+    first feature starts from clearance and the last one retracts to it.
+    xyz may be lazy: the plan looks only one feature ahead.
+    """
+    pts = ((float(x), float(y)) for x, y, _ in xyz)
+    z_clr, z_protect = float(z_clr), float(z_protect)
+    prev, pt = z_clr, next(pts, None)
+    while pt is not None:
+        nxt = next(pts, None)
+        here = [r[4] for r in regions if r[0] <= pt[0] <= r[2] and r[1] <= pt[1] <= r[3]]
+        approach = min(max(here), z_clr) if here else z_protect
+        retract = _link_height(regions, pt, nxt, z_clr) if nxt is not None else z_clr
+        yield None if approach == prev else f_dec(approach), f_dec(retract), f_dec(approach)
+        prev, pt = retract, nxt
+
+
+def _link_plan(xyz, regions, z_clr, z_protect):
+    return list(_iter_link_plan(xyz, regions, z_clr, z_protect))
+
+
+def _linking_opts(linking, protect_feed):
+    """(regions or None, feed word) for the generators; linking is a region list or parse_regions text."""
+    feed = f_dec(protect_feed)
+    if float(feed) <= 0:
+        raise ValueError(f"Protected-move feed '{protect_feed}' must be positive.")
+    if linking is None or linking is False:
+        return None, feed
+    return parse_regions(linking) if isinstance(linking, str) else [tuple(map(float, r)) for r in linking], feed
+
+
+def _part_header(k, n_parts, g_part, z_clr, retract=False):
+    """
+    Switches to part k's work offset (part 1 is already active after the tool change).
+    retract: the previous part left the probe below clearance; rise in the old offset
+    first, so no Z move is ever measured from the new offset's zero over the old part.
     """
+    yield ""
+    yield f"(=== PART {k+1} OF {n_parts}: {g_part} ===)"
+    if k:
+        if retract:
+            yield f"{G00} Z{f_dec(z_clr)}"
+        yield f"{G00} {G90} {g_part}"
+        yield f"{G00} Z{f_dec(z_clr)}"
+
+
+def _sequence_footer():
+    """Closing block: mandatory safety linking (the G103 P0 also stays in scoped mode, as a reset)."""
+    yield ""
+    yield PROBE_OFF
+    yield G103_RESTORE
+    yield G_HOME_Z
+    yield G_SAFE_XY
+    yield ""
+
+
+def _sequence_context(params):
+    """Resolves the per-program values every feature block shares."""
     t_num_raw  = params.get("t_num", "0")
     wcs        = params["wcs"]
     is_ext     = params["is_ext"]
-    z_clr      = params["z_clr"]
-    z_protect  = params["z_protect"]
-    features   = params.get("features", [])
 
     # Ensure tool number is an integer for N-line math
     try:
@@ -172,123 +794,652 @@ def generate_feature_sequence(params: dict, full_pgm=False, pgm_num="1234", use_
     except:
         t_int = 0
 
-    g_wcs, _ = format_wcs(wcs, is_ext=is_ext)
+    g_wcs, w_macro = format_wcs(wcs, is_ext=is_ext)
+    return t_int, g_wcs, w_macro, params["z_clr"], params["z_protect"]
+
+
+def _program_open(pgm_num):
+    o_val = str(pgm_num).upper().replace("O", "").strip()
+    yield "%"
+    yield f"O{o_val} (APEXPROBE MEASURE)"
+
+
+def _program_close(use_m99):
+    yield M99 if use_m99 else M30
+    yield "%"
+
+
+def iter_feature_sequence(params: dict, full_pgm=False, pgm_num="1234", use_m99=False,
+                          factored=False, sub_pgm=None, var_table=None, parts=None, bank_stride=None,
+                          linking=None, protect_feed=50, lookahead="routine"):
+    """
+    Lazily yields the lines of a multi-feature measurement program.
+    Same output as generate_feature_sequence, one block at a time, so
+    large programs can be streamed to a file or socket with bounded memory.
+    params["features"] must be re-iterable (list/tuple): it is walked for the
+    macro resets and once per part for the probing blocks. Coordinates are
+    formatted XYZ_CHUNK features at a time and linking looks one feature ahead,
+    so memory does not grow with the feature count. Multi-part and variable-table
+    programs fold their resets into runs, which holds the macro numbers (one int
+    each) for the opening block.
+
+    factored=True: each feature becomes one G65 call into a skeleton
+    subprogram (sub_pgm, default pgm_num + 1). The skeleton is a separate
+    program (feature_skeleton) that must be loaded on the control as well.
+
+    var_table: base macro of a nominal/tolerance table (see feature_variable_file).
+    The program compares against #[var_table+1]... instead of inline values, so
+    tolerances change by reloading the variable file, not the program.
+
+    parts: work offsets to replicate the feature set over ("54-57, P1-P4" or
+    [(wcs, is_ext)]), all after one tool change; part k stores its results at
+    macro + k * bank_stride (default: the span of the feature macros).
+
+    linking: safe-height regions (parse_regions text or [(x0, y0, x1, y1, z)]).
+    Each feature then retracts only as high as the move to the next one needs
+    instead of to z_clr; protect_feed is the P9810 protected-move feed.
+
+    lookahead: "routine" (G103 P1 for the whole routine) or "scoped" (only around
+    each cycle's capture and checks; see LOOKAHEAD_MODES).
+    """
+    features = params.get("features", [])
+    t_int, g_wcs, w_macro, z_clr, z_protect = _sequence_context(params)
+    table = _variable_range(features, var_table)
+    macros = lambda: (m for m in map(_feature_macro, features) if m)
+    banks = _sequence_banks(params, macros(), parts, bank_stride, table)
+    multi = len(banks) > 1
+    regions, feed = _linking_opts(linking, protect_feed)
+    scoped = _scoped_lookahead(lookahead)
+
+    # Administrative Wrapping (O-Num, %)
+    if full_pgm:
+        yield from _program_open(pgm_num)
+
+    # 1. Opening: Safety first, then tool change (once, whatever the part count)
+    sub_pgm = skeleton_number(pgm_num, sub_pgm) if factored else None
+    resets = (_bank_macro(m, off) for _, _, off in banks for m in macros())
+    yield from _sequence_header(resets, t_int, banks[0][0], z_clr, table, compact=multi, scoped=scoped,
+                                sub_pgm=sub_pgm)
+
+    # 2. Sequential Probing, part by part (every column streamed, nothing held per feature)
+    for k, (g_part, w_part, off) in enumerate(banks):
+        if multi:
+            yield from _part_header(k, len(banks), g_part, z_clr)
+        xyz = _iter_xyz(features)
+        if regions is None:
+            links = repeat(None)
+        else:
+            xyz, ahead = tee(xyz)
+            links = _iter_link_plan(ahead, regions, z_clr, z_protect)
+        slots = _iter_variable_slots(features, var_table)
+        for i, (feat, pos, slot, link) in enumerate(zip(features, xyz, slots, links)):
+            feat = _bank_feature(feat, off)
+            if factored:
+                yield from _feature_call(i, feat, t_int, sub_pgm, pos, slot, w_part if multi else None, link)
+            else:
+                yield from _feature_block(i, feat, t_int, w_part, z_clr, z_protect, pos, slot, link, feed, scoped)
+
+    # 3. Closing: Mandatory safety linking
+    yield from _sequence_footer()
+
+    # 4. Termination (M30/M99, %)
+    if full_pgm:
+        yield from _program_close(use_m99)
+
+
+def _skeleton_w(w_macro, multi):
+    """Fixed W word, or the W argument when every part passes its own offset."""
+    return f"W#{_SKELETON_ARGS['W']}" if multi else w_macro
+
 
-    # 1. Opening: Safety first, then tool change
+_FEATURE_SIG_KEYS = ("cycle_key", "comment", "x", "y", "plane", "macro", "macro_num", "tol", "tolerance", "nominal")
+
+
+def _feature_sig(feat):
+    """Hashable snapshot of everything a feature block depends on."""
+    args = feat.get("args", {})
+    return tuple(str(feat.get(k, "")) for k in _FEATURE_SIG_KEYS) + tuple(sorted((k, str(v)) for k, v in args.items()))
+
+
+def feature_sequence_blocks(params: dict, full_pgm=False, pgm_num="1234", use_m99=False, cache=None,
+                            factored=False, sub_pgm=None, var_table=None, parts=None, bank_stride=None,
+                            linking=None, protect_feed=50, lookahead="routine"):
+    """
+    Same program as generate_feature_sequence, split into line blocks:
+    [opening, feature 1, ..., feature n, closing], each a tuple of lines.
+    Pass the same dict as cache on every call to reuse unchanged feature
+    blocks; entries are keyed by index (the N-number) and feature content,
+    and are dropped whenever tool, WCS or heights change.
+    """
+    features = params.get("features", [])
+    t_int, g_wcs, w_macro, z_clr, z_protect = _sequence_context(params)
+    table = _variable_range(features, var_table)
+    slots = _variable_slots(features, var_table) if var_table is not None else None
+    macros = [m for m in map(_feature_macro, features) if m]
+    banks = _sequence_banks(params, macros, parts, bank_stride, table)
+    multi = len(banks) > 1
+    regions, feed = _linking_opts(linking, protect_feed)
+    plan = _link_plan(_xyz_columns(features), regions, z_clr, z_protect) if regions is not None else None
+    links = plan or [None] * len(features)
+    scoped = _scoped_lookahead(lookahead)
+
+    sub_pgm = skeleton_number(pgm_num, sub_pgm) if factored else None
+    opening = list(_program_open(pgm_num)) if full_pgm else []
+    resets = [_bank_macro(m, off) for _, _, off in banks for m in macros]
+    opening.extend(_sequence_header(resets, t_int, banks[0][0], z_clr, table, compact=multi, scoped=scoped,
+                                    sub_pgm=sub_pgm))
+    blocks = [tuple(opening)]
+
+    if cache is None: cache = {}
+    ctx = (t_int, str(z_clr), str(z_protect), sub_pgm, tuple(banks), feed, scoped)
+    if cache.get("ctx") != ctx:
+        cache["ctx"] = ctx
+        cache["blocks"] = {}
+    memo, fresh = cache["blocks"], {}
+
+    slots = slots or [None] * len(features)
+    for k, (g_part, w_part, off) in enumerate(banks):
+        if multi:
+            blocks.append(tuple(_part_header(k, len(banks), g_part, z_clr)))
+        for i, feat in enumerate(features):
+            key = (k, i, _feature_sig(feat), slots[i], links[i])
+            block = memo.get(key)
+            if block is None:
+                feat = _bank_feature(feat, off)
+                if factored:
+                    block = tuple(_feature_call(i, feat, t_int, sub_pgm, slot=slots[i],
+                                                w_word=w_part if multi else None, link=links[i]))
+                else:
+                    block = tuple(_feature_block(i, feat, t_int, w_part, z_clr, z_protect, slot=slots[i],
+                                                 link=links[i], feed=feed, scoped=scoped))
+            fresh[key] = block
+            blocks.append(block)
+    cache["blocks"] = fresh  # only the current features stay cached
+
+    closing = list(_sequence_footer())
+    if full_pgm:
+        closing.extend(_program_close(use_m99))
+    blocks.append(tuple(closing))
+    return blocks
+
+
+def generate_feature_sequence(params: dict, full_pgm=False, pgm_num="1234", use_m99=False,
+                              factored=False, sub_pgm=None, var_table=None, parts=None, bank_stride=None,
+                              linking=None, protect_feed=50, lookahead="routine"):
+    """
+    Builds a sequential measurement toolpath for multiple features.
+    
+    Safety Logic:
+    - ALWAYS homes and clears before Tool Change.
+    - ALWAYS homes and clears after probing completes.
+    - full_pgm only controls O-num, %, and M30/M99 termination.
+    - factored swaps the per-feature blocks for G65 calls into one skeleton program (feature_skeleton).
+    - var_table moves nominals/tolerances into a variable file (feature_variable_file).
+    - parts replicates the features over several work offsets after one tool change.
+    - linking retracts between features only as high as the safe-height regions need.
+    - lookahead="scoped" limits look-ahead only around each capture and its checks.
+    """
+    return list(iter_feature_sequence(params, full_pgm=full_pgm, pgm_num=pgm_num, use_m99=use_m99,
+                                      factored=factored, sub_pgm=sub_pgm, var_table=var_table,
+                                      parts=parts, bank_stride=bank_stride,
+                                      linking=linking, protect_feed=protect_feed, lookahead=lookahead))
+
+
+# --- Macro variable files ---
+# Haas macro variable file, as saved from Current Commands > Macro Vars and loaded
+# back the same way: "%", one "N<variable> <value>" line per variable, "%".
+VARIABLE_FILE_EXT = ".var"
+
+
+def variable_file(assignments):
+    """(macro, value) pairs -> variable file lines. Values must be plain numbers."""
+    assignments = list(assignments)
+    values = NF.fmt_many([v for _, v in assignments])
+    lines = ["%"]
+    for (num, raw), val in zip(assignments, values):
+        if val[0] in "#[":
+            raise ValueError(f"#{num}: '{raw}' is an expression; a variable file only holds numbers")
+        lines.append(f"N{_clean_macro(num)} {val}")
+    lines.append("%")
+    return lines
+
+
+def feature_variable_file(params: dict, var_table):
+    """Nominal/tolerance table for iter_feature_sequence(..., var_table=var_table)."""
+    features = params.get("features", [])
+    pairs = []
+    for feat, slot in zip(features, _iter_variable_slots(features, var_table)):
+        if slot is None: continue
+        nominal, tol = _feature_check(feat)
+        pairs += [(slot[0], nominal), (slot[1], tol)]
+    return variable_file(pairs)
+
+
+def write_program(lines, fh, chunk_lines=512):
+    """
+    Streams program lines to a text file/socket wrapper in fixed-size chunks.
+    Accepts any iterable (e.g. iter_feature_sequence) and never holds more
+    than chunk_lines lines in memory. Returns (line_count, char_count).
+    """
+    buf = []
+    n_lines = n_chars = 0
+    for line in lines:
+        buf.append(line)
+        if len(buf) >= chunk_lines:
+            block = "\n".join(buf) + "\n"
+            fh.write(block)
+            n_lines += len(buf)
+            n_chars += len(block)
+            buf.clear()
+    if buf:
+        block = "\n".join(buf) + "\n"
+        fh.write(block)
+        n_lines += len(buf)
+        n_chars += len(block)
+    return n_lines, n_chars
+
+
+def _clean_macro(value):
+    return str(value).replace("#", "").strip()
+
+
+def _flatness_opening(w_sac, title, scoped=False, fast=False):
     lines = [
+        f"(--- 3-STAGE FLATNESS ROUTINE{title} ---)",
+        "(FAST MODE: G31 SKIP TOUCH PER POINT, NO SACRIFICIAL OFFSET)" if fast else
+        f"(USING SACRIFICIAL OFFSET {w_sac} FOR DUMP)",
+        G103_LIMIT,
         "",
-        "(MULTI-FEATURE MEASUREMENT ROUTINE)",
-        f"{G103} P1 (LIMIT LOOK-AHEAD)",
-        "(RESET FEATURE MACROS)",
+        "(INITIALIZE VARIABLES - CLEAN SLATE)"
     ]
-    
-    for feat in features:
-        mac = str(feat.get("macro", feat.get("macro_num", ""))).replace("#", "").strip()
-        if mac: lines.append(f"#{mac} = 0.")
+    if scoped:
+        del lines[2]
+    return lines
 
-    lines.extend([
-        "",
-        G_HOME_Z,
-        G_SAFE_XY,
-        f"T{t_int} {M06} (PROBE TOOL)",
-        f"{G00} {G90} {g_wcs}",
-        f"{G43} H{t_int} Z{f_dec(z_clr)}",
-        PROBE_ON
-    ])
-
-    # 2. Sequential Probing
-    for i, feat in enumerate(features):
-        comment = feat.get("comment", f"FEATURE {i+1}").strip()
-        x       = f_dec(feat.get("x", "0"))
-        y       = f_dec(feat.get("y", "0"))
-        plane   = f_dec(feat.get("plane", "0"))
-        macro   = str(feat.get("macro", feat.get("macro_num", ""))).replace("#", "").strip()
-        tol     = str(feat.get("tol", feat.get("tolerance", ""))).strip()
-        args    = feat.get("args", {})
-        
-        # Calculate N-Number: (Tool * 100) + (Index + 1)
-        n_val = (t_int * 100) + (i + 1)
-
-        # SMART NOMINAL LOGIC
-        nominal = feat.get("nominal", "").strip()
-        if not nominal:
-            ck = feat.get("cycle_key", "")
-            if ck in ["A10", "A11", "A14", "A15", "A20X"]: 
-                nominal = args.get("D", args.get("d", ""))
-            elif ck in ["A16", "A17", "A20Y"]: 
-                nominal = args.get("E", args.get("e", ""))
-            elif ck == "A20Z": 
-                nominal = args.get("H", args.get("h", ""))
-            elif ck in ["A12", "A13"]: 
-                nominal = args.get("D", args.get("d", ""))
-
-        lines.append("")
-        lines.append(f"N{n_val} ({comment.upper()}: {feat['cycle_key']})")
-        lines.append(f"{G00} X{x} Y{y}")
-        lines.append(f"{G00} Z{f_dec(z_protect)}")
-        lines.append(f"{PROBE_PROTECT} Z{plane} F50.")
-        
-        cycle_line = generate_cycle_line(feat["cycle_key"], args, wcs, is_ext)
-        lines.append(cycle_line)
-
-        if macro:
-            lines.append(f"#{macro} = #188 (STORE MEASURED)")
-            
-            if tol and nominal:
-                nom_val = f_dec(nominal)
-                tol_val = f_dec(tol)
-                lines.append(f"(--- {comment.upper()} EVALUATION ---)")
-                lines.append(f"#100 = ABS[ #{macro} - {nom_val} ] (DEVIATION)")
-                lines.append(f"IF [ #100 GT {tol_val} ] #3000 = 1 ({comment.upper()} OUT OF TOL)")
-        
-        lines.append(f"{G00} Z{f_dec(z_clr)}")
 
-    # 3. Closing: Mandatory safety linking
-    lines.extend([
+def _flatness_setup(t_num, g_work, z_clr):
+    return [
         "",
-        PROBE_OFF,
-        f"{G103} P0 (RESTORE LOOK-AHEAD)",
-        G_HOME_Z,
-        G_SAFE_XY,
+        f"{G_HOME_Z}",
+        f"{G_SAFE_XY}",
+        f"T{t_num} {M06} (PROBE)",
+        f"{G90} {g_work} (ACTIVE WORK OFFSET)",
+        f"{G43} H{t_num} Z{z_clr} (1. CLEARANCE)",
+        f"{PROBE_ON}",
         ""
-    ])
+    ]
+
+
+def _flatness_park():
+    return [f"{PROBE_OFF}", f"{G_HOME_Z}", f"{G_SAFE_XY}", f"{M01}", ""]
+
+
+def _flatness_verdict(checks, t_mac):
+    """checks: (label, dev, max, min) per part."""
+    lines = [""]
+    for label, dev_mac, max_mac, min_mac in checks:
+        lines.append(f"#{dev_mac}=[#{max_mac}-#{min_mac}]")
+        lines.append(f"IF [#{dev_mac} GT #{t_mac}] #3000=1 ({label}FLATNESS TOL EXCEEDED)")
+    lines.append("(FLATNESS WITHIN LIMITS)")
+    lines.append(G103_RESTORE)
+    return lines
+
+
+def _flatness_touch(xy, z_prot, w_sac, fast, capture):
+    """
+    (approach, touch, check) lines for one point around its #5063 capture.
+    fast = (plane, search, skip feed, protect feed): protected descent to the probe
+    plane, then one G31 skip touch instead of P9995. G31's F is modal, so every
+    protected move carries its own feed.
+    """
+    if not fast:
+        return [f"{PROBE_PROTECT} {xy} Z{z_prot}"], [f"{WIPS_STORM} {w_sac} A20. H-1.0 (SURFACE Z)"], []
+    plane, search, feed, protect = fast
+    approach = [f"{PROBE_PROTECT} {xy} Z{z_prot} F{protect}", f"{PROBE_PROTECT} Z{plane} F{protect}"]
+    touch = [f"{G31} Z{search} F{feed} (SKIP TO SURFACE)"]
+    check = [f"IF [{capture} LE {search}] #3000 = 3 (NO SURFACE FOUND)", f"{G00} Z{z_prot} (BACK OFF)"]
+    return approach, touch, check
+
+
+def _contiguous_base(macros):
+    """Base such that macros[i] == base + i + 1, or None if the run has gaps."""
+    try:
+        nums = [int(m) for m in macros]
+    except ValueError:
+        return None
+    base = nums[0] - 1
+    return base if all(n == base + i for i, n in enumerate(nums, start=1)) else None
 
-    # 4. Administrative Wrapping (O-Num, %, M30/M99)
+
+def generate_flatness(params: dict, full_pgm=False, pgm_num="01234", term="M99",
+                      loop=False, table_base=None, var_file=False,
+                      parts=None, bank_stride=None, lookahead="routine",
+                      fast=False, skip_feed=30, skip_depth=0.2, protect_feed=50):
+    """
+    Builds the multi-point flatness routine (P9995 Surface Z into a sacrificial offset).
+
+    loop=False: classic unrolled output, one probe block and two IF lines per point.
+    loop=True : point X/Y live in a contiguous macro table starting at #[table_base+1]
+                (X block then Y block). Probing and min/max run in a WHILE loop with
+                indirect addressing, so the routine body is the same size for 4 or
+                4,000 points. The table is set inline ahead of the loop (two short
+                assignments per point), so no second program has to be on the control;
+                the whole program only stays constant in size with var_file=True.
+    var_file=True: the tolerance (and in loop mode the point table) comes from the
+                variable file built by flatness_variable_file; the program only reads it.
+    parts:      work offsets to repeat the routine in after one tool change (see
+                iter_feature_sequence). Point/min/max/dev macros move to each part's
+                bank; the tolerance and the point table are shared.
+    lookahead:  "routine" or "scoped": G103 P1 only from each P9995 through its #5063
+                capture (and the loop's min/max IFs), and over the final range checks.
+    fast=True:  no P9995 per point: a protected move (protect_feed) down to
+                params["probe_plane"], set just above the surface, then one G31 skip
+                touch at skip_feed searching skip_depth below the plane, and #5063
+                straight from the skip. The sacrificial offset is never written; a
+                point that finds no surface alarms (#3000 = 3). Same min/max/dev
+                macros. Calibrate the probe at skip_feed.
+    term: "M30", "M99" or None (M01) when full_pgm wraps the program.
+    """
+    t_num     = params["t_num"]
+    g_work, _ = format_wcs(params["wcs"], params["is_ext"])
+    _, w_sac  = format_wcs(params["sac_wcs"], params["sac_ext"])
+    z_clr     = f_dec(params["z_clr"])
+    z_prot    = f_dec(params["z_protect"])
+    tol_val   = f_dec(params["tol"])
+    t_mac     = _clean_macro(params["tol_macro"])
+    min_mac   = _clean_macro(params["min_macro"])
+    max_mac   = _clean_macro(params["max_macro"])
+    dev_mac   = _clean_macro(params["dev_macro"])
+    points    = params["points"]
+    pt_macs   = [_clean_macro(pt["macro"]) for pt in points]
+    xs        = NF.fmt_many([pt["x"] for pt in points])  # whole columns in one pass
+    ys        = NF.fmt_many([pt["y"] for pt in points])
+
+    o_num = str(pgm_num).strip().upper().replace("O", "") or "01234"
+    n = len(points)
+    scoped = _scoped_lookahead(lookahead)
+    if fast:
+        plane = float(params.get("probe_plane", params["z_protect"]))
+        if min(float(skip_depth), float(skip_feed), float(protect_feed)) <= 0:
+            raise ValueError("Fast mode needs a positive skip feed, search depth and protect feed.")
+        fast = (f_dec(plane), f_dec(plane - float(skip_depth)), f_dec(skip_feed), f_dec(protect_feed))
+    if loop:
+        if table_base is None:
+            raise ValueError("Loop mode needs a macro table base for the point coordinates.")
+        tb = int(_clean_macro(table_base))
+    else:
+        missing = [i + 1 for i, m in enumerate(pt_macs) if not m]
+        if missing:
+            raise ValueError(f"Point {missing[0]} has no result macro "
+                             f"({len(missing)} total). Assign macros or use Loop mode.")
+
+    # Per part: (label, work offset, min, max, dev, point macros)
+    if parts:
+        if isinstance(parts, str):
+            parts = parse_wcs_list(parts, params["is_ext"])
+        reserved = [t_mac] + (list(range(tb + 1, tb + 2 * n + 1)) if loop else [])
+        offsets = bank_offsets([min_mac, max_mac, dev_mac] + pt_macs, len(parts), bank_stride, reserved)
+        banks = [(f"PART {k+1} ", format_wcs(wcs, ext)[0], *(_bank_macro(m, off) for m in (min_mac, max_mac, dev_mac)),
+                  [_bank_macro(m, off) for m in pt_macs])
+                 for k, ((wcs, ext), off) in enumerate(zip(parts, offsets))]
+    else:
+        banks = [("", g_work, min_mac, max_mac, dev_mac, pt_macs)]
+    multi = len(banks) > 1
+
+    lines = []
     if full_pgm:
-        lines.insert(0, "%")
-        o_val = str(pgm_num).upper().replace("O", "").strip()
-        lines.insert(1, f"O{o_val} (APEXPROBE MEASURE)")
-        
-        # Append termination
-        lines.append(M99 if use_m99 else M30)
-        lines.append("%")
+        lines.extend(["%", f"O{o_num}"])
+
+    if not loop:
+        lines.extend(_flatness_opening(w_sac, "", scoped, fast))
+        for label, _, _, _, _, macs in banks:
+            for i, p_mac in enumerate(macs):
+                lines.append(f"#{p_mac}=0. (RESET {label}P{i+1})")
+    else:
+        lines.extend(_flatness_opening(w_sac, " (LOOP)", scoped, fast))
+        lines.append(f"(POINT TABLE: X #{tb+1}-#{tb+n}, Y #{tb+n+1}-#{tb+2*n})")
+        if not var_file:
+            lines.extend(f"#{tb+i}={x_val}" for i, x_val in enumerate(xs, start=1))
+            lines.extend(f"#{tb+n+i}={y_val}" for i, y_val in enumerate(ys, start=1))
+
+    for label, _, b_min, b_max, b_dev, _ in banks:
+        lines.append(f"#{b_min}=0. (RESET {label}MIN)")
+        lines.append(f"#{b_max}=0. (RESET {label}MAX)")
+        lines.append(f"#{b_dev}=0. (RESET {label}DEV)")
+    if var_file:
+        lines.append(f"(TOLERANCE #{t_mac}: LOAD THE VARIABLE FILE FIRST)")
+        lines.append(f"IF [#{t_mac} EQ #0] #3000 = 2 (VARIABLE FILE NOT LOADED)")
+    else:
+        lines.append(f"#{t_mac}={tol_val} (SET TOLERANCE)")
+    lines.extend(_flatness_setup(t_num, banks[0][1], z_clr))
 
+    for k, (label, g_part, b_min, b_max, _, macs) in enumerate(banks):
+        if multi:
+            header = list(_part_header(k, len(banks), g_part, z_clr, retract=True))
+            lines.extend(header if lines[-1] else header[1:])  # one blank line between parts
+        if not loop:
+            for i, (x_val, y_val) in enumerate(zip(xs, ys)):
+                p_mac = macs[i]
+                approach, touch, check = _flatness_touch(f"X{x_val} Y{y_val}", z_prot, w_sac, fast, f"#{p_mac}")
+                lines.append(f"(POINT {i+1} -> #{p_mac})")
+                lines.extend(approach)
+                if scoped:
+                    lines.append(G103_LIMIT)
+                lines.extend(touch)
+                lines.append(f"#{p_mac}=#5063 (CAPTURE Z MACHINE POS)")
+                lines.extend(check[:1])
+                if scoped:
+                    lines.append(G103_RESTORE)
+                lines.extend(check[1:])
+                lines.append("")
+        else:
+            # Locals #1-#3 are safe: every G65 call below gets its own local level
+            res_base = _contiguous_base(macs)
+            lines.append("#1=1 (POINT INDEX)")
+            lines.append(f"#2={n} (POINT COUNT)")
+            lines.append("WHILE [#1 LE #2] DO1")
+            approach, touch, check = _flatness_touch(f"X#[{tb}+#1] Y#[{tb+n}+#1]", z_prot, w_sac, fast, "#3")
+            lines.extend(approach)
+            if scoped:
+                lines.append(G103_LIMIT)
+            lines.extend(touch)
+            lines.append("#3=#5063 (CAPTURE Z MACHINE POS)")
+            lines.extend(check[:1])
+            if res_base is not None:
+                lines.append(f"#[{res_base}+#1]=#3 (STORE POINT Z #{res_base+1}-#{res_base+n})")
+            lines.append(f"IF [#1 EQ 1] THEN #{b_min}=#3 (SEED MIN)")
+            lines.append(f"IF [#1 EQ 1] THEN #{b_max}=#3 (SEED MAX)")
+            lines.append(f"IF [#3 LT #{b_min}] THEN #{b_min}=#3")
+            lines.append(f"IF [#3 GT #{b_max}] THEN #{b_max}=#3")
+            if scoped:
+                lines.append(G103_RESTORE)
+            lines.extend(check[1:])
+            lines.append("#1=#1+1")
+            lines.append("END1")
+            lines.append("")
+
+    lines.extend(_flatness_park())
+    if scoped:
+        lines.append(G103_LIMIT)  # range checks: the alarm must not fire ahead of the park moves
+    if not loop:
+        for label, _, b_min, b_max, _, macs in banks:
+            lines.append(f"(--- CALCULATE {label}MIN/MAX RANGE ---)")
+            lines.append(f"#{b_min}=#{macs[0]} (SEED MIN)")
+            lines.append(f"#{b_max}=#{macs[0]} (SEED MAX)")
+            for p_mac in macs[1:]:
+                lines.append(f"IF [#{p_mac} LT #{b_min}] THEN #{b_min}=#{p_mac}")
+                lines.append(f"IF [#{p_mac} GT #{b_max}] THEN #{b_max}=#{p_mac}")
+    else:
+        lines.append("(--- MIN/MAX RANGE TRACKED IN LOOP ---)")
+
+    lines.extend(_flatness_verdict([(label, b_dev, b_max, b_min) for label, _, b_min, b_max, b_dev, _ in banks], t_mac))
+
+    # Termination (Only if wrapped)
+    if full_pgm:
+        lines.append(term or f"{M01}")
+    else:
+        lines.append(f"{M01}")
+
+    if full_pgm:
+        lines.append("%")
     return lines
 
+def expand_flatness_loop(lines, params: dict, table_base):
+    """
+    Loop-mode flatness lines with each WHILE body written out once per point and the
+    table reads replaced by the point's X/Y: the same motion, in a form cycle_time can time.
+    """
+    tb, n = int(_clean_macro(table_base)), len(params["points"])
+    xs = NF.fmt_many([pt["x"] for pt in params["points"]])
+    ys = NF.fmt_many([pt["y"] for pt in params["points"]])
+    body = None
+    for line in lines:
+        if body is None:
+            if line.startswith("WHILE [#1 LE #2]"):
+                body = []
+            else:
+                yield line
+        elif line.startswith("END1"):
+            for x_val, y_val in zip(xs, ys):
+                for b in body:
+                    yield b.replace(f"#[{tb}+#1]", x_val).replace(f"#[{tb+n}+#1]", y_val)
+            body = None
+        elif line != "#1=#1+1":
+            body.append(line)
+
+
+def flatness_variable_file(params: dict, loop=False, table_base=None):
+    """Variable file for generate_flatness(..., var_file=True): tolerance, plus the point table in loop mode."""
+    pairs = [(_clean_macro(params["tol_macro"]), params["tol"])]
+    if loop:
+        if table_base is None:
+            raise ValueError("Loop mode needs a macro table base for the point coordinates.")
+        tb, points = int(_clean_macro(table_base)), params["points"]
+        pairs += [(tb + i, pt["x"]) for i, pt in enumerate(points, start=1)]
+        pairs += [(tb + len(points) + i, pt["y"]) for i, pt in enumerate(points, start=1)]
+    return variable_file(pairs)
+
 
 def get_cycle_metadata(selection):
-    """ROOT SOURCE OF TRUTH for cycle arguments and helper text."""
-    if "A10" in selection:
-        return "Bore (A10): D = Target Diameter.", {"d": "1.0", "e": "0", "h": "0"}, {"d": True, "e": False, "h": False}
-    elif "A11" in selection:
-        return "Boss (A11): D = Diameter, H = Z-depth for probing.", {"d": "1.0", "e": "0", "h": "-0.5"}, {"d": True, "e": False, "h": True}
-    elif "A12" in selection:
-        return "Rect Pocket (A12): D = X Width, E = Y Width.", {"d": "1.0", "e": "1.0", "h": "0"}, {"d": True, "e": True, "h": False}
-    elif "A13" in selection:
-        return "Rect Boss (A13): D = X Width, E = Y Width, H = Z-depth.", {"d": "1.0", "e": "1.0", "h": "-0.5"}, {"d": True, "e": True, "h": True}
-    elif "A14" in selection:
-        return "Web X (A14): D = Width, H = Z-depth.", {"d": "1.0", "e": "0", "h": "-0.5"}, {"d": True, "e": False, "h": True}
-    elif "A15" in selection:
-        return "Pocket X (A15): D = Width.", {"d": "1.0", "e": "0", "h": "0"}, {"d": True, "e": False, "h": False}
-    elif "A16" in selection:
-        return "Web Y (A16): E = Width, H = Z-depth.", {"d": "0", "e": "1.0", "h": "-0.5"}, {"d": False, "e": True, "h": True}
-    elif "A17" in selection:
-        return "Pocket Y (A17): E = Width.", {"d": "0", "e": "1.0", "h": "0"}, {"d": False, "e": True, "h": False}
-    elif "Surface Z" in selection:
-        return "Z Surface (A20): H = Direction (Generator forces negative).", {"d": "0", "e": "0", "h": "-1.0"}, {"d": False, "e": False, "h": True}
-    elif "Surface X" in selection:
-        return "X Surface (A20): D = Approach direction/dist.", {"d": "1.0", "e": "0", "h": "0"}, {"d": True, "e": False, "h": False}
-    elif "Surface Y" in selection:
-        return "Y Surface (A20): E = Approach direction/dist.", {"d": "0", "e": "1.0", "h": "0"}, {"d": False, "e": True, "h": False}
-
-    return "Selection Error.", {"d": "0", "e": "0", "h": "0"}, {"d": True, "e": True, "h": True}
\ No newline at end of file
+    """Helper text, UI defaults and arg usage states for a cycle key or display label."""
+    cycle = get_cycle(selection)
+    if cycle is None:
+        return "Selection Error.", {"d": "0", "e": "0", "h": "0"}, {"d": True, "e": True, "h": True}
+    return cycle["help"], dict(cycle["defaults"]), dict(cycle["states"])
+
+
+# --- Benchmark ---
+
+def _legacy_cycle_line(cycle_key, args_dict, wcs, is_ext):
+    """The pre-registry generate_cycle_line if-chain, kept only as the benchmark baseline."""
+    _, w_macro = format_wcs(wcs, is_ext)
+    d = f_dec(args_dict.get("D", args_dict.get("d", "0")))
+    e = f_dec(args_dict.get("E", args_dict.get("e", "0")))
+    h = f_dec(args_dict.get("H", args_dict.get("h", "0")))
+    i = f_dec(args_dict.get("I", args_dict.get("i", "0")))
+    if cycle_key == "A10": return f"{WIPS_STORM} A10. D{d} {w_macro}"
+    if cycle_key == "A11": return f"{WIPS_STORM} A11. D{d} H{h} {w_macro}"
+    if cycle_key == "A12": return f"{WIPS_STORM} A12. D{d} E{e} {w_macro}"
+    if cycle_key == "A13": return f"{WIPS_STORM} A13. D{d} E{e} H{h} {w_macro}"
+    if cycle_key == "A14": return f"{WIPS_STORM} A14. D{d} H{h} {w_macro}"
+    if cycle_key == "A15": return f"{WIPS_STORM} A15. D{d} {w_macro}"
+    if cycle_key == "A16": return f"{WIPS_STORM} A16. E{e} H{h} {w_macro}"
+    if cycle_key == "A17": return f"{WIPS_STORM} A17. E{e} {w_macro}"
+    if cycle_key == "A20Z": return f"{WIPS_STORM} A20. H{h} {w_macro}"
+    if cycle_key == "A20X": return f"{WIPS_STORM} A20. D{d} {w_macro}"
+    if cycle_key == "A20Y": return f"{WIPS_STORM} A20. E{e} {w_macro}"
+    return f"(ERROR: UNKNOWN CYCLE {cycle_key})"
+
+
+def cycle_benchmark(n=100_000, seed=1, repeat=5):
+    """
+    Per-feature P9995 formatting cost: the old if-chain (WCS resolved per feature)
+    against the registry's precompiled formatters (WCS resolved once per program),
+    on n random features over every cycle (best of repeat). Returns [(name, seconds)].
+    """
+    import random
+    import time
+    rng = random.Random(seed)
+    keys = list(CYCLES)
+    feats = [(rng.choice(keys), {"D": f"{rng.uniform(0.1, 5):.4f}", "E": f"{rng.uniform(0.1, 5):.4f}",
+                                 "H": f"{rng.uniform(-1, 0):.4f}"}) for _ in range(n)]
+    results = []
+
+    def clock(name, fn):
+        best = None
+        for _ in range(repeat):
+            t = time.perf_counter()
+            fn()
+            t = time.perf_counter() - t
+            best = t if best is None else min(best, t)
+        results.append((name, best))
+
+    clock("if-chain (old)", lambda: [_legacy_cycle_line(k, a, "54", False) for k, a in feats])
+    clock("generate_cycle_line", lambda: [generate_cycle_line(k, a, "54", False) for k, a in feats])
+    w_macro = format_wcs("54", False)[1]
+    clock("registry, W per program", lambda: [CYCLES[k]["fmt"](a, w_macro) for k, a in feats])
+
+    assert [_legacy_cycle_line(k, a, "54", False) for k, a in feats] == [CYCLES[k]["fmt"](a, w_macro) for k, a in feats]
+    return results
+
+
+# --- Memory check ---
+# iter_feature_sequence + write_program must stream: peak memory may not grow with
+# the feature count. "python -m lib.codes [features]" runs the cycle benchmark and
+# then this check up to that many features.
+
+MEMORY_BUDGET = 4 * 1024 * 1024  # bytes; a materialized 100k-feature program is ~10x this
+
+
+def memory_check(counts=(100, 1_000, 10_000, 100_000), options=None, seed=1):
+    """
+    Streams a random measure program for each feature count to os.devnull under
+    tracemalloc. Returns [(count, peak bytes)]; raises AssertionError when a peak
+    leaves MEMORY_BUDGET, or when the peaks of counts of at least one XYZ_CHUNK
+    differ by more than 25% (below that the formatting chunk is still filling).
+    The feature lists are built before tracing starts: only generation is measured.
+    """
+    import os
+    import random
+    import tracemalloc
+    rng = random.Random(seed)
+    NF.fmt_many([0.0])  # lazy NumPy import outside the measurement
+    results = []
+    for n in counts:
+        features = [{"cycle_key": rng.choice(("A10", "A20", "A1")), "comment": f"F{i}",
+                     "x": f"{rng.uniform(-50, 50):.4f}", "y": f"{rng.uniform(-50, 50):.4f}", "plane": "-0.1",
+                     "macro": str(500 + i % 50), "tol": "0.002", "nominal": "1.0",
+                     "args": {"D": "1.0", "E": "0", "H": "-0.5"}} for i in range(n)]
+        params = {"t_num": "50", "wcs": "54", "is_ext": False, "z_clr": "6.0", "z_protect": "1.0",
+                  "features": features}
+        with open(os.devnull, "w") as fh:
+            tracemalloc.start()
+            write_program(iter_feature_sequence(params, full_pgm=True, **(options or {})), fh)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        results.append((n, peak))
+        del features, params
+
+    for n, peak in results:
+        assert peak <= MEMORY_BUDGET, f"{n:,} features peaked at {peak:,} bytes"
+    full = [(n, peak) for n, peak in results if n >= XYZ_CHUNK]
+    if len(full) > 1:
+        (n0, p0), (n1, p1) = min(full, key=lambda r: r[1]), max(full, key=lambda r: r[1])
+        assert p1 <= 1.25 * p0, f"peak grew from {p0:,} bytes ({n0:,} features) to {p1:,} ({n1:,})"
+    return results
+
+
+if __name__ == "__main__":
+    import sys
+    top = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    timings = cycle_benchmark(top)
+    base = timings[0][1]  # speedups are against the old if-chain
+    print(f"P9995 formatting, {top:,} features")
+    for name, sec in timings:
+        print(f"  {name:<24}{sec / top * 1e6:7.2f} us/feature  {base / sec:4.1f}x")
+    counts = [n for n in (100, 2_000, 10_000, 100_000, 1_000_000) if n <= top]
+    for opts in ({}, {"factored": True}, {"linking": "-50 -50 50 50 2"}):
+        label = ", ".join(f"{k}={v}" for k, v in opts.items()) or "plain"
+        print(label)
+        for n, peak in memory_check(counts, opts):
+            print(f"  {n:>9,} features  peak {peak / 1024:8.1f} KiB")
@@ -0,0 +1,245 @@
+"""
+ApexProbe | lib/cycle_time.py
+Cycle-time estimator for generated probing programs
+- Walks program lines, tracking modal G00/G01/G90/G91, position and feed.
+- Collects every motion segment, then times them in one vectorized pass.
+- Fixed costs: tool change, G28 home, G154 P99 park, probe on/off, P9995 cycles.
+- G31 skip moves are timed as feed moves over their full search distance.
+Rates are machine-specific; MACHINE_DEFAULTS is a starting point, not gospel.
+"""
+
+import importlib.util
+import re
+
+# NumPy is imported the first time a program is timed, not at app startup
+NUMPY_AVAILABLE = importlib.util.find_spec("numpy") is not None
+np = None
+
+
+def _numpy():
+    global np
+    if np is None:
+        import numpy
+        np = numpy
+    return np
+
+# Inch / inch-per-minute / seconds
+MACHINE_DEFAULTS = {
+    "rapid_xy": 1000.0,     # G00 X/Y rapid rate
+    "rapid_z": 1000.0,      # G00 Z rapid rate
+    "tool_change_s": 4.5,   # T M06 chip-to-chip
+    "home_z_s": 1.5,        # G91 G28 Z0.
+    "safe_xy_s": 2.0,       # G154 P99 X0. Y0. park move (position unknown to the estimator)
+    "probe_on_s": 1.0,      # G65 P9832
+    "probe_off_s": 1.0,     # G65 P9833
+    "block_s": 0.004,       # per-block read/evaluate overhead
+}
+
+# Seconds per P9995 cycle, keyed by A-code
+CYCLE_SECONDS = {
+    10: 6.0,   # Bore
+    11: 8.0,   # Boss
+    12: 8.5,   # Rect pocket
+    13: 10.5,  # Rect boss
+    14: 6.5,   # Web X
+    15: 5.0,   # Pocket X
+    16: 6.5,   # Web Y
+    17: 5.0,   # Pocket Y
+    20: 2.5,   # Single surface
+}
+DEFAULT_CYCLE_S = 6.0
+
+_WORD = re.compile(r"([A-Z])\s*([-+]?\d*\.?\d*)")
+_COMMENT = re.compile(r"\(.*?\)")
+
+# Segment kinds
+RAPID, FEED = 0, 1
+
+
+def _words(line):
+    """Address words of a block, comments stripped. Repeated letters keep every value."""
+    out = {}
+    for letter, num in _WORD.findall(_COMMENT.sub("", line.upper())):
+        if num in ("", "+", "-", ".", "-.", "+."): continue
+        out.setdefault(letter, []).append(float(num))
+    return out
+
+
+def _segments(lines, machine):
+    """
+    Parses lines into motion segments and fixed costs.
+    Returns (segments, fixed): segments = [(dx, dy, dz, kind, feed)], fixed = {bucket: seconds}.
+    """
+    fixed = {"tool_change": 0.0, "home": 0.0, "probe_on_off": 0.0, "cycles": 0.0, "blocks": 0.0}
+    segs = []
+    pos = [None, None, None]
+    motion, absolute, feed = RAPID, True, 0.0
+
+    for raw in lines:
+        line = raw.strip()
+        if not line or line == "%": continue
+        if line.startswith("(") and line.endswith(")"): continue
+        fixed["blocks"] += machine["block_s"]
+        if line.startswith("#") or line.startswith("IF") or line.startswith("WHILE") or line.startswith("END"):
+            continue
+
+        w = _words(line)
+        g = w.get("G", [])
+        if 0 in g: motion = RAPID
+        if 1 in g: motion = FEED
+        if 90 in g: absolute = True
+        if 91 in g: absolute = False
+
+        if 28 in g:
+            fixed["home"] += machine["home_z_s"]
+            pos[2] = None
+            continue
+        if 154 in g and w.get("P") == [99.0] and ("X" in w or "Y" in w):
+            # Park move in G154 P99: distance in the part WCS is unknown
+            fixed["home"] += machine["safe_xy_s"]
+            pos[0] = pos[1] = None
+            continue
+        if "M" in w and 6 in w["M"]:
+            fixed["tool_change"] += machine["tool_change_s"]
+            continue
+
+        kind, seg_feed = motion, feed
+        if 65 in g:
+            p = w.get("P", [0])[0]
+            if p == 9832:
+                fixed["probe_on_off"] += machine["probe_on_s"]
+                continue
+            if p == 9833:
+                fixed["probe_on_off"] += machine["probe_off_s"]
+                continue
+            if p == 9995:
+                a_code = int(w.get("A", [0])[0])
+                fixed["cycles"] += CYCLE_SECONDS.get(a_code, DEFAULT_CYCLE_S)
+                continue
+            if p == 9810:
+                kind, seg_feed = FEED, w.get("F", [feed])[0] or 50.0
+            else:
+                continue  # other macro calls: no motion the estimator can see
+        elif "F" in w:
+            feed = seg_feed = w["F"][0]
+        if 31 in g:
+            kind = FEED  # G31 skip: one-shot feed move, timed to its full search depth
+
+        delta = [0.0, 0.0, 0.0]
+        moved = False
+        for ax, letter in enumerate("XYZ"):
+            if letter not in w: continue
+            target = w[letter][-1]
+            if not absolute:
+                target = (pos[ax] or 0.0) + target
+            if pos[ax] is not None:
+                delta[ax] = target - pos[ax]
+                moved = True
+            pos[ax] = target
+        if moved:
+            segs.append((delta[0], delta[1], delta[2], kind, seg_feed))
+
+    return segs, fixed
+
+
+def _time_segments(segs, machine, group=None, n_groups=1):
+    """
+    Vectorized timing: rapids run axes simultaneously, feeds follow the path length.
+    group assigns each segment to a program index so a whole library is timed in
+    one pass. Returns per-group lists (rapid_s, feed_s, rapid_dist, feed_dist).
+    """
+    zeros = [0.0] * n_groups
+    if not segs:
+        return zeros, list(zeros), list(zeros), list(zeros)
+
+    if NUMPY_AVAILABLE:
+        _numpy()
+        arr = np.asarray(segs, dtype=float)
+        grp = np.zeros(len(segs), dtype=np.intp) if group is None else np.asarray(group, dtype=np.intp)
+        d = np.abs(arr[:, :3])
+        is_feed = arr[:, 3] == FEED
+        path = np.sqrt((d * d).sum(axis=1))
+        rapid_t = np.maximum(np.maximum(d[:, 0], d[:, 1]) / machine["rapid_xy"], d[:, 2] / machine["rapid_z"]) * 60.0
+        feed_t = path / np.where(arr[:, 4] > 0, arr[:, 4], 50.0) * 60.0
+
+        def per_group(values, mask):
+            return np.bincount(grp, weights=np.where(mask, values, 0.0), minlength=n_groups).tolist()
+
+        return (per_group(rapid_t, ~is_feed), per_group(feed_t, is_feed),
+                per_group(path, ~is_feed), per_group(path, is_feed))
+
+    rapid_s, feed_s, rapid_d, feed_d = list(zeros), list(zeros), list(zeros), list(zeros)
+    for n, (dx, dy, dz, kind, f) in enumerate(segs):
+        g = 0 if group is None else group[n]
+        dist = (dx * dx + dy * dy + dz * dz) ** 0.5
+        if kind == FEED:
+            feed_s[g] += dist / (f if f > 0 else 50.0) * 60.0
+            feed_d[g] += dist
+        else:
+            rapid_s[g] += max(max(abs(dx), abs(dy)) / machine["rapid_xy"], abs(dz) / machine["rapid_z"]) * 60.0
+            rapid_d[g] += dist
+    return rapid_s, feed_s, rapid_d, feed_d
+
+
+def _result(fixed, rapid_s, feed_s, rapid_d, feed_d):
+    est = dict(fixed, rapid=rapid_s, feed=feed_s, rapid_dist=rapid_d, feed_dist=feed_d)
+    est["total"] = rapid_s + feed_s + sum(fixed.values())
+    return est
+
+
+def estimate(lines, machine=None):
+    """
+    Estimated run time of one program (iterable of lines).
+    Returns a dict of seconds per bucket plus "total" and rapid/feed distances.
+    """
+    m = dict(MACHINE_DEFAULTS, **(machine or {}))
+    segs, fixed = _segments(lines, m)
+    rapid_s, feed_s, rapid_d, feed_d = _time_segments(segs, m)
+    return _result(fixed, rapid_s[0], feed_s[0], rapid_d[0], feed_d[0])
+
+
+def estimate_many(programs, machine=None):
+    """
+    Bulk estimate for a program library: {name: lines} -> {name: estimate dict}.
+    Segments from every program are timed together in one vectorized pass.
+    """
+    m = dict(MACHINE_DEFAULTS, **(machine or {}))
+    names, fixed_all, all_segs, group = [], [], [], []
+    for idx, (name, lines) in enumerate(programs.items()):
+        segs, fixed = _segments(lines, m)
+        names.append(name)
+        fixed_all.append(fixed)
+        all_segs.extend(segs)
+        group.extend([idx] * len(segs))
+
+    rapid_s, feed_s, rapid_d, feed_d = _time_segments(all_segs, m, group, len(names))
+    return {name: _result(fixed_all[i], rapid_s[i], feed_s[i], rapid_d[i], feed_d[i])
+            for i, name in enumerate(names)}
+
+
+def format_seconds(sec):
+    m, s = divmod(max(sec, 0.0), 60.0)
+    return f"{int(m)}:{s:04.1f}"
+
+
+def summary(est):
+    """One-line label text for the tabs."""
+    return (f"Est. cycle time {format_seconds(est['total'])}  |  rapid {est['rapid']:.1f}s, "
+            f"protected {est['feed']:.1f}s, cycles {est['cycles']:.1f}s, "
+            f"tool/home {est['tool_change'] + est['home']:.1f}s")
+
+
+def saved_seconds(before, after, machine=None):
+    """Estimated seconds the after program saves over the before program, timed in one pass."""
+    est = estimate_many({"before": before, "after": after}, machine)
+    return est["before"]["total"] - est["after"]["total"]
+
+
+def chain_summary(separate, chained, machine=None):
+    """
+    Label text for a chained program against the same cycles run one program each:
+    separate = list of programs (lines), chained = the chained program's lines.
+    """
+    apart = estimate_many(dict(enumerate(separate)), machine)
+    saved = sum(est["total"] for est in apart.values()) - estimate(chained, machine)["total"]
+    return f"{len(separate)} cycles chained, saves {format_seconds(saved)} vs separate programs"
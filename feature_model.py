@@ -0,0 +1,68 @@
+"""
+ApexProbe | lib/feature_model.py
+Plain-Python feature models for the list-style tabs
+- No Tk objects: rows are cheap to create, copy, save and generate from.
+- Values are kept as the strings the user typed; the generators format them.
+"""
+
+# Argument letters shared by every P9995 cycle
+ARG_FIELDS = ("d", "e", "h")
+
+
+class Feature:
+    """One Measure Features row."""
+    __slots__ = ("cycle", "comment", "x", "y", "plane", "d", "e", "h", "tol", "macro", "pinned", "alloc")
+
+    FIELDS = ("cycle", "comment", "x", "y", "plane", "d", "e", "h", "tol", "macro", "pinned")
+
+    def __init__(self, cycle="A10 - Bore", comment="", x="0.0", y="0.0", plane="0.1",
+                 d="0.0", e="0.0", h="0.0", tol="", macro="", pinned=False, alloc=None):
+        self.cycle = cycle
+        self.comment = comment
+        self.x = x
+        self.y = y
+        self.plane = plane
+        self.d = d
+        self.e = e
+        self.h = h
+        self.tol = tol
+        self.macro = macro
+        self.pinned = pinned  # keeps its slot when the probe path is optimized
+        self.alloc = alloc  # macro handed out by the session allocator (released on delete)
+
+    def values(self):
+        return tuple(getattr(self, f) for f in self.FIELDS)
+
+    def to_generator(self, cycle_key):
+        """Feature dict in the shape codes.generate_feature_sequence expects."""
+        return {
+            "cycle_key": cycle_key,
+            "comment": self.comment,
+            "x": self.x,
+            "y": self.y,
+            "plane": self.plane,
+            "macro": self.macro,
+            "tol": self.tol,
+            "args": {"D": self.d, "E": self.e, "H": self.h},
+            "pinned": self.pinned,
+        }
+
+
+class FlatPoint:
+    """One Flatness inspection point."""
+    __slots__ = ("x", "y", "macro", "alloc")
+
+    FIELDS = ("x", "y", "macro")
+
+    def __init__(self, x="0.0", y="0.0", macro="", alloc=None):
+        self.x = x
+        self.y = y
+        self.macro = macro  # blank = no per-point result (loop mode only)
+        self.alloc = alloc
+
+    def values(self):
+        return tuple(getattr(self, f) for f in self.FIELDS)
+
+    def to_generator(self):
+        """Point dict in the shape codes.generate_flatness expects."""
+        return {"x": self.x, "y": self.y, "macro": self.macro}
@@ -5,24 +5,68 @@ Scope:
 Generates G-code for multi-point flatness inspection using the 
 3-stage height manager (Clearance, Protected, Plane).
 - Dynamic point entry with individual macro assignment.
+- Points live in FlatPoint models shown in a ttk.Treeview (edit in place).
+- Pattern fill: grid, bolt circle, polyline and Poisson disc (lib/patterns.py),
+  de-duplicated and given macros in bulk.
 - Uses P9995 (WIPS Surface Z) for measurements into a sacrificial offset.
 - Uses #5063 for capturing Z results.
 - User-definable macros for Tolerance, Min, Max, and Dev results.
 - Automatic variable initialization for a "clean slate" start.
 - Block Look-Ahead Control: Uses G103 P1 during probing.
 - Post-processing: Optional %, O-number, and M30/M99 termination.
+- Loop mode: WHILE loop over a macro point table. The routine is constant-size; the
+  table is set inline (two lines per point) unless it comes from the variable file.
+- Variable file: tolerance (and loop table) saved as a Haas .var file the program only reads.
+- Multi-part: the routine repeats in each listed work offset after one tool change.
+- Fast mode: one G31 skip touch per point from the Probe Plane instead of a full
+  P9995 cycle; the sacrificial offset is left alone.
+- Logic delegated to lib/codes.py (generate_flatness).
 """
 
 import tkinter as tk
-from tkinter import ttk, messagebox
-from lib.codes import G43, G65, G90, G91, G00, M01, M06, PROBE_ON, PROBE_OFF, PROBE_PROTECT, G_HOME_Z, G_SAFE_XY, f_dec, format_wcs, WIPS_STORM
+from tkinter import ttk, messagebox, filedialog
+from lib import codes as NC
+from lib import macro_alloc
+from lib import cycle_time
+from lib import patterns
+from lib import peephole
+from lib import background
+from lib import project
+from lib import program_cache
+from lib.feature_model import FlatPoint
+
+# Treeview columns: (model field, heading, width)
+POINT_COLUMNS = [
+    ("idx",   "#",       36),
+    ("x",     "X",       80),
+    ("y",     "Y",       80),
+    ("macro", "Macro #", 64),
+]
+
+# Project file settings -> Tk variable attributes
+PROJECT_VARS = {
+    "t_num": "tool_var", "wcs": "work_var", "is_ext": "is_ext_var",
+    "sac_wcs": "sac_work_var", "sac_ext": "sac_ext_var",
+    "z_clr": "clearance_z", "z_protect": "protected_z", "probe_plane": "probing_plane",
+    "tol": "tolerance", "tol_macro": "tol_macro", "min_macro": "min_macro",
+    "max_macro": "max_macro", "dev_macro": "dev_macro",
+    "full_pgm": "post_wrap_var", "pgm_num": "o_number_var", "m30": "m30_var", "m99": "m99_var",
+    "peephole": "peephole_var", "loop": "loop_var", "table_base": "table_base_var",
+    "var_file": "var_file_var", "parts": "parts_var", "bank_stride": "bank_stride_var",
+    "scoped_lookahead": "scoped_var",
+    "fast": "fast_var", "skip_feed": "skip_feed_var", "skip_depth": "skip_depth_var",
+    "protect_feed": "protect_feed_var",
+}
 
 class FlatnessTab(ttk.Frame):
     def __init__(self, parent):
         super().__init__(parent)
         
         # --- State ---
-        self.points = [] # List of dicts: {"x": SV, "y": SV, "macro": SV, "frame": Frame}
+        self.points = []   # FlatPoint models, in probing order
+        self._by_iid = {}  # Treeview item id -> FlatPoint
+        self._next_iid = 0
+        self._editor = None
         
         # Machine Setup
         self.tool_var = tk.StringVar(value="50")
@@ -47,11 +91,42 @@ class FlatnessTab(ttk.Frame):
         self.max_macro = tk.StringVar(value="802")
         self.dev_macro = tk.StringVar(value="803")
 
+        # Session allocator: result macros are claimed so points never land on them
+        self.macros = macro_alloc.session()
+        for var in (self.tol_macro, self.min_macro, self.max_macro, self.dev_macro):
+            self.macros.claim(var.get(), owner=self)
+
         # Post Processing
         self.post_wrap_var = tk.BooleanVar(value=False)
         self.o_number_var = tk.StringVar(value="01234")
         self.m30_var = tk.BooleanVar(value=False)
         self.m99_var = tk.BooleanVar(value=True) # Default checked for sub-programs
+        self.peephole_var = tk.BooleanVar(value=False)
+        self.scoped_var = tk.BooleanVar(value=False)  # G103 P1 only around each capture, not the whole routine
+
+        # Fast mode: G31 skip touch per point instead of P9995 into the sacrificial offset
+        self.fast_var = tk.BooleanVar(value=False)
+        self.skip_feed_var = tk.StringVar(value="30.")
+        self.skip_depth_var = tk.StringVar(value="0.2")   # search distance below the Probe Plane
+        self.protect_feed_var = tk.StringVar(value="50.")
+        self._job = None  # background generation in flight
+
+        # Loop Mode (WHILE + indirect addressing over a point table)
+        self.loop_var = tk.BooleanVar(value=False)
+        self.table_base_var = tk.StringVar(value="")  # blank = auto-allocate
+        self._table_block = None
+        self.var_file_var = tk.BooleanVar(value=False)  # tolerance/table from a Haas variable file
+        self._var_lines = None  # variable file matching the last generated program
+
+        # Multi-part: same points in several work offsets, results in per-part macro banks
+        self.parts_var = tk.StringVar(value="")        # e.g. "54-57, P1-P4"; blank = single part
+        self.bank_stride_var = tk.StringVar(value="")  # blank = span of min/max/dev + point macros
+        self._bank_claims = []
+
+        # Pattern Fill
+        self.pattern_var = tk.StringVar(value=next(iter(patterns.PATTERNS)))
+        self.pattern_vars = {}
+        self.replace_var = tk.BooleanVar(value=False)
         
         self._build_ui()
         
@@ -87,6 +162,12 @@ class FlatnessTab(ttk.Frame):
         ttk.Entry(r_sac, textvariable=self.sac_work_var, width=8).pack(side="left")
         ttk.Checkbutton(r_sac, text="Ext", variable=self.sac_ext_var).pack(side="left", padx=5)
 
+        r_parts = ttk.Frame(setup_f); r_parts.pack(fill="x", pady=2)
+        ttk.Label(r_parts, text="Parts WCS:", width=14).pack(side="left")
+        ttk.Entry(r_parts, textvariable=self.parts_var, width=14).pack(side="left")
+        ttk.Label(r_parts, text=" Bank +").pack(side="left")
+        ttk.Entry(r_parts, textvariable=self.bank_stride_var, width=5).pack(side="left", padx=2)
+
         # 2. Height Manager
         phys_f = ttk.LabelFrame(input_panel, text=" 3-Stage Height Manager ", padding=10)
         phys_f.pack(fill="x", pady=(0, 10))
@@ -123,6 +204,10 @@ class FlatnessTab(ttk.Frame):
         ttk.Checkbutton(self.post_f, text="Post with % & O-Number", 
                         variable=self.post_wrap_var, 
                         command=self._update_post_visibility).pack(anchor="w")
+        ttk.Checkbutton(self.post_f, text="Optimize Output (strip redundant codes)",
+                        variable=self.peephole_var).pack(anchor="w")
+        ttk.Checkbutton(self.post_f, text="Scoped look-ahead (G103 only around captures)",
+                        variable=self.scoped_var).pack(anchor="w")
         
         # Sub-container for conditional options
         self.post_options_f = ttk.Frame(self.post_f)
@@ -138,17 +223,71 @@ class FlatnessTab(ttk.Frame):
         # Initialize visibility based on default state
         self._update_post_visibility()
 
-        # 5. Points List
+        # 4b. Loop Mode
+        loop_f = ttk.LabelFrame(input_panel, text=" Loop Mode ", padding=10)
+        loop_f.pack(fill="x", pady=(0, 10))
+        ttk.Checkbutton(loop_f, text="WHILE loop over point table", variable=self.loop_var).pack(anchor="w")
+        loop_r = ttk.Frame(loop_f); loop_r.pack(fill="x", pady=(5, 0))
+        ttk.Label(loop_r, text="Table #").pack(side="left")
+        ttk.Entry(loop_r, textvariable=self.table_base_var, width=6).pack(side="left", padx=2)
+        ttk.Label(loop_f, text="Blank = auto", font=("Segoe UI", 8, "italic")).pack(anchor="w")
+        ttk.Checkbutton(loop_f, text="Tolerance + table in variable file", variable=self.var_file_var).pack(anchor="w", pady=(5, 0))
+        ttk.Label(loop_f, text="Without it the table is set inline: 2 lines per point",
+                  font=("Segoe UI", 8, "italic")).pack(anchor="w")
+
+        # 4c. Fast Mode
+        fast_f = ttk.LabelFrame(input_panel, text=" Fast Mode ", padding=10)
+        fast_f.pack(fill="x", pady=(0, 10))
+        ttk.Checkbutton(fast_f, text="G31 skip touch per point (no P9995)", variable=self.fast_var).pack(anchor="w")
+        fast_r = ttk.Frame(fast_f); fast_r.pack(fill="x", pady=(5, 0))
+        for label, var in [("Skip F", self.skip_feed_var), ("Depth", self.skip_depth_var),
+                           ("Protect F", self.protect_feed_var)]:
+            ttk.Label(fast_r, text=label).pack(side="left", padx=(0, 2))
+            ttk.Entry(fast_r, textvariable=var, width=6).pack(side="left", padx=(0, 8))
+        ttk.Label(fast_f, text="Searches Depth below the Probe Plane", font=("Segoe UI", 8, "italic")).pack(anchor="w")
+
+        # 5. Pattern Fill
+        pat_f = ttk.LabelFrame(input_panel, text=" Pattern Fill ", padding=10)
+        pat_f.pack(fill="x", pady=(0, 10))
+        pat_r = ttk.Frame(pat_f); pat_r.pack(fill="x")
+        pat_cb = ttk.Combobox(pat_r, textvariable=self.pattern_var, values=list(patterns.PATTERNS),
+                              state="readonly", width=14)
+        pat_cb.pack(side="left")
+        pat_cb.bind("<<ComboboxSelected>>", lambda e: self._build_pattern_fields())
+        ttk.Checkbutton(pat_r, text="Replace", variable=self.replace_var).pack(side="left", padx=5)
+        pat_btn = ttk.Button(pat_r, text="Add Pattern", command=self._add_pattern)
+        pat_btn.pack(side="right")
+        self.pattern_fields_f = ttk.Frame(pat_f)
+        self.pattern_fields_f.pack(fill="x", pady=(5, 0))
+        self.pattern_status = tk.StringVar()
+        if not patterns.NUMPY_AVAILABLE:
+            pat_btn.state(["disabled"])
+            self.pattern_status.set("Install NumPy for pattern fill.")
+        ttk.Label(pat_f, textvariable=self.pattern_status, foreground="#27ae60").pack(anchor="w")
+        self._build_pattern_fields()
+
+        # 6. Points List
         self.points_lab = ttk.LabelFrame(input_panel, text=" Inspection Points ", padding=10)
         self.points_lab.pack(fill="both", expand=True)
         
         pt_btn_f = ttk.Frame(self.points_lab)
         pt_btn_f.pack(fill="x", pady=(0, 10))
         ttk.Button(pt_btn_f, text="+ Add Point", command=self._add_point, width=12).pack(side="left", padx=2)
+        ttk.Button(pt_btn_f, text="Remove Selected", command=self._remove_selected).pack(side="left", padx=2)
         ttk.Button(pt_btn_f, text="Clear All", command=self._clear_points, width=12).pack(side="left", padx=2)
         
-        self.points_container = ttk.Frame(self.points_lab)
-        self.points_container.pack(fill="both", expand=True)
+        tree_f = ttk.Frame(self.points_lab)
+        tree_f.pack(fill="both", expand=True)
+        self.tree = ttk.Treeview(tree_f, columns=[c[0] for c in POINT_COLUMNS], show="headings", height=8)
+        for field, heading, width in POINT_COLUMNS:
+            self.tree.heading(field, text=heading)
+            self.tree.column(field, width=width, minwidth=30, stretch=False, anchor="center")
+        self.scrollbar = ttk.Scrollbar(tree_f, orient="vertical", command=self.tree.yview)
+        self.tree.configure(yscrollcommand=self._on_scroll)
+        self.tree.pack(side="left", fill="both", expand=True)
+        self.scrollbar.pack(side="right", fill="y")
+        self.tree.bind("<Double-1>", self._begin_edit)
+        self.tree.bind("<Delete>", lambda e: self._remove_selected())
 
         # --- RIGHT PANEL: OUTPUT ---
         output_panel = ttk.Frame(self)
@@ -160,6 +299,12 @@ class FlatnessTab(ttk.Frame):
         ttk.Button(action_f, text="GENERATE", command=self._generate_code, style="Accent.TButton").pack(side="left", fill="x", expand=True, padx=(0, 2))
         ttk.Button(action_f, text="CLEAR", command=self._clear_output).pack(side="left", fill="x", expand=True, padx=2)
         ttk.Button(action_f, text="COPY OUTPUT", command=self._copy_output).pack(side="left", fill="x", expand=True, padx=(2, 0))
+        ttk.Button(action_f, text="SAVE .VAR", command=self._save_var_file).pack(side="left", fill="x", expand=True, padx=(2, 0))
+        self.cancel_btn = ttk.Button(action_f, text="Cancel", command=self._cancel_generate, state="disabled")
+        self.cancel_btn.pack(side="left", padx=(5, 0))
+
+        self.time_var = tk.StringVar()
+        ttk.Label(output_panel, textvariable=self.time_var, foreground="#2980b9").pack(side="bottom", anchor="w", pady=(5, 0))
 
         self.output_text = tk.Text(
             output_panel, font=("Consolas", 11), bg="#1e272e", fg="#d2dae2", 
@@ -181,38 +326,209 @@ class FlatnessTab(ttk.Frame):
         elif code == 99 and self.m99_var.get():
             self.m30_var.set(False)
 
+    # --- Points Model / View ---
+
+    def _next_hint(self):
+        """Macro after the last point's, so new points continue the run."""
+        for p in reversed(self.points):
+            if p.alloc is not None:
+                return p.alloc + 1
+        return macro_alloc.DEFAULT_HINT
+
+    def _insert_points(self, new_points):
+        start = len(self.points)
+        for i, pt in enumerate(new_points, start=start + 1):
+            iid = f"P{self._next_iid}"
+            self._next_iid += 1
+            self._by_iid[iid] = pt
+            self.tree.insert("", "end", iid=iid, values=(i,) + pt.values())
+        self.points.extend(new_points)
+        if new_points:
+            self.tree.see(iid)
+
+    def _renumber(self, start=0):
+        for i, iid in enumerate(self.tree.get_children()[start:], start=start + 1):
+            self.tree.set(iid, "idx", i)
+
     def _add_point(self, x="0.0", y="0.0"):
-        row = ttk.Frame(self.points_container)
-        row.pack(fill="x", pady=2)
-        next_m = 901
-        if self.points:
-            try: next_m = int(self.points[-1]["macro"].get()) + 1
-            except: pass
-
-        x_var = tk.StringVar(value=x); y_var = tk.StringVar(value=y); m_var = tk.StringVar(value=str(next_m))
-        ttk.Label(row, text=f"P{len(self.points)+1}:", width=4, font=("Segoe UI", 9, "bold")).pack(side="left")
-        ttk.Label(row, text="X").pack(side="left", padx=(5, 0))
-        ttk.Entry(row, textvariable=x_var, width=8).pack(side="left", padx=2)
-        ttk.Label(row, text="Y").pack(side="left", padx=(5, 0))
-        ttk.Entry(row, textvariable=y_var, width=8).pack(side="left", padx=2)
-        ttk.Label(row, text="#").pack(side="left", padx=(5, 0))
-        ttk.Entry(row, textvariable=m_var, width=5, foreground="#2980b9").pack(side="left", padx=2)
-        ttk.Button(row, text="✖", width=3, command=lambda r=row: self._remove_point(r)).pack(side="right", padx=5)
-        self.points.append({"x": x_var, "y": y_var, "macro": m_var, "frame": row})
-
-    def _remove_point(self, frame):
-        if len(self.points) <= 2: return
-        for i, p in enumerate(self.points):
-            if p["frame"] == frame:
-                p["frame"].destroy()
-                self.points.pop(i)
-                break
+        self._end_edit(commit=True)
+        next_m = self.macros.allocate(owner=self, hint=self._next_hint())
+        self._insert_points([FlatPoint(x=x, y=y, macro=str(next_m), alloc=next_m)])
+
+    def _release_points(self, points):
+        for p in points:
+            if p.alloc is not None:
+                self.macros.release(p.alloc)
+
+    def _remove_selected(self):
+        self._end_edit(commit=False)
+        doomed = set(self.tree.selection())
+        if not doomed or len(self.points) - len(doomed) < 2: return
+        first = min(self.tree.index(iid) for iid in doomed)
+        self._release_points([self._by_iid.pop(iid) for iid in doomed])
+        self.tree.delete(*doomed)
+        self.points = [self._by_iid[iid] for iid in self.tree.get_children()]
+        self._renumber(first)
+
+    def _drop_points(self):
+        self._end_edit(commit=False)
+        self.tree.delete(*self.tree.get_children())
+        self._release_points(self.points)
+        self.points = []
+        self._by_iid = {}
 
     def _clear_points(self):
-        for p in self.points: p["frame"].destroy()
-        self.points = []
+        self._drop_points()
         self._add_point(); self._add_point()
 
+    # --- Pattern Fill ---
+
+    def _build_pattern_fields(self):
+        for child in self.pattern_fields_f.winfo_children():
+            child.destroy()
+        self.pattern_vars = {}
+        _, spec = patterns.PATTERNS[self.pattern_var.get()]
+        row, col = 0, 0
+        for arg, label, _, default in spec:
+            var = tk.StringVar(value=default)
+            self.pattern_vars[arg] = var
+            wide = arg == "vertices"  # free text gets a row of its own
+            if wide and col:
+                row, col = row + 1, 0
+            ttk.Label(self.pattern_fields_f, text=label).grid(row=row, column=col, sticky="w", padx=(0, 4))
+            ttk.Entry(self.pattern_fields_f, textvariable=var, width=24 if wide else 7).grid(
+                row=row, column=col + 1, columnspan=3 if wide else 1, sticky="w", padx=(0, 8), pady=1)
+            col += 4 if wide else 2
+            if col >= 4:
+                row, col = row + 1, 0
+
+    def _add_pattern(self):
+        """Generates a point pattern, drops coincident points and assigns macros in bulk."""
+        self._end_edit(commit=True)
+        name = self.pattern_var.get()
+        replace = self.replace_var.get()
+        try:
+            xy = patterns.build(name, {arg: var.get() for arg, var in self.pattern_vars.items()})
+            existing = [] if replace else [(float(p.x), float(p.y)) for p in self.points]
+            fresh = patterns.dedupe(xy, existing)
+        except (ValueError, RuntimeError) as e:
+            messagebox.showerror("Pattern Error", str(e))
+            return
+        if replace and len(fresh) < 2:
+            messagebox.showerror("Pattern Error", "Pattern needs at least 2 distinct points.")
+            return
+
+        if replace:
+            self._drop_points()
+        n_mac = min(len(fresh), self.macros.free_count())
+        macs = self.macros.allocate_many(owner=self, count=n_mac, hint=self._next_hint())
+        macs += [None] * (len(fresh) - n_mac)
+        self._insert_points([FlatPoint(x=x, y=y, macro="" if m is None else str(m), alloc=m)
+                             for (x, y), m in zip(patterns.format_points(fresh), macs)])
+
+        status = f"{name}: {len(fresh)} points added"
+        if len(xy) > len(fresh):
+            status += f", {len(xy) - len(fresh)} duplicates dropped"
+        if n_mac < len(fresh):
+            status += f", {len(fresh) - n_mac} without macros (Loop mode only)"
+        self.pattern_status.set(status)
+
+    # --- In-place editing ---
+
+    def _on_scroll(self, first, last):
+        self._end_edit(commit=True)
+        self.scrollbar.set(first, last)
+
+    def _begin_edit(self, event):
+        self._end_edit(commit=True)
+        iid = self.tree.identify_row(event.y)
+        col = self.tree.identify_column(event.x)
+        if not iid or not col: return
+        field = POINT_COLUMNS[int(col[1:]) - 1][0]
+        if field == "idx": return
+        bbox = self.tree.bbox(iid, col)
+        if not bbox: return
+        x, y, w, h = bbox
+        var = tk.StringVar(value=getattr(self._by_iid[iid], field))
+        editor = ttk.Entry(self.tree, textvariable=var)
+        editor.select_range(0, tk.END)
+        editor.place(x=x, y=y, width=max(w, 60), height=h)
+        editor.focus_set()
+        editor.bind("<Return>", lambda e: self._end_edit(commit=True))
+        editor.bind("<Escape>", lambda e: self._end_edit(commit=False))
+        editor.bind("<FocusOut>", lambda e: self._end_edit(commit=True))
+        self._editor = (editor, var, iid, field)
+
+    def _end_edit(self, commit=True):
+        if self._editor is None: return
+        editor, var, iid, field = self._editor
+        self._editor = None
+        pt = self._by_iid.get(iid)
+        if commit and pt is not None:
+            value = var.get().strip()
+            if field != "macro" or self._claim_edit(pt, value):
+                setattr(pt, field, value)
+                self.tree.set(iid, field, getattr(pt, field))
+        editor.destroy()
+
+    def _claim_edit(self, pt, text):
+        """Moves the point's allocator claim to a typed macro; False (edit rejected) if it cannot be claimed."""
+        num = macro_alloc.parse_macro(text)
+        if num == pt.alloc: return True
+        if num is not None and not self.macros.claim(num, owner=self):
+            why = "outside the Haas user macro ranges" if not self.macros.is_legal(num) else "already in use"
+            messagebox.showwarning("Point Macro", f"#{num} is {why}. The macro was not changed.")
+            return False
+        if pt.alloc is not None:
+            self.macros.release(pt.alloc)
+        pt.alloc = num
+        return True
+
+    def macro_claims(self):
+        """Macro numbers used by this tab for the session audit."""
+        claims = {
+            "Flatness Tol": [self.tol_macro.get()],
+            "Flatness Min": [self.min_macro.get()],
+            "Flatness Max": [self.max_macro.get()],
+            "Flatness Dev": [self.dev_macro.get()],
+        }
+        for i, p in enumerate(self.points):
+            claims[f"Flatness P{i+1}"] = [p.macro]
+        try:
+            banks = NC.bank_macros(self._banked_macros(), *self._part_opts())
+        except ValueError:
+            banks = []  # the generator reports bad part settings
+        for k, bank in enumerate(banks[1:], start=2):
+            claims[f"Flatness part {k}"] = bank
+        return claims
+
+    def project_state(self):
+        """Settings and point models for the project file."""
+        self._end_edit(commit=True)
+        return {"settings": project.read_vars(self, PROJECT_VARS), "points": list(self.points)}
+
+    def load_project(self, section):
+        """Replaces settings and the point list with a loaded project section."""
+        project.write_vars(self, PROJECT_VARS, section["settings"])
+        self._update_post_visibility()
+        points = section.get("points")
+        if points is None: return
+        self._drop_points()
+        self._cancel_generate()
+        # Result macros and the loop table are re-claimed from the new settings
+        self.macros.release_owner(self)
+        self._table_block = None
+        self._bank_claims = []
+        for var in (self.tol_macro, self.min_macro, self.max_macro, self.dev_macro):
+            num = macro_alloc.parse_macro(var.get())
+            if num is not None: self.macros.claim(num, owner=self)
+        for pt in points:
+            num = macro_alloc.parse_macro(pt.macro)
+            pt.alloc = num if num is not None and self.macros.claim(num, owner=self) else None
+        self._insert_points(list(points))
+        while len(self.points) < 2:
+            self._add_point()
+
     def _clear_output(self):
         self.output_text.delete("1.0", tk.END)
 
@@ -222,105 +538,128 @@ class FlatnessTab(ttk.Frame):
             self.clipboard_clear()
             self.clipboard_append(content)
 
+    def _collect_params(self):
+        """Tab state in the shape codes.generate_flatness expects."""
+        return {
+            "t_num": self.tool_var.get(),
+            "wcs": self.work_var.get(),
+            "is_ext": self.is_ext_var.get(),
+            "sac_wcs": self.sac_work_var.get(),
+            "sac_ext": self.sac_ext_var.get(),
+            "z_clr": self.clearance_z.get(),
+            "z_protect": self.protected_z.get(),
+            "probe_plane": self.probing_plane.get(),
+            "tol": self.tolerance.get(),
+            "tol_macro": self.tol_macro.get(),
+            "min_macro": self.min_macro.get(),
+            "max_macro": self.max_macro.get(),
+            "dev_macro": self.dev_macro.get(),
+            "points": [p.to_generator() for p in self.points],
+        }
+
+    def _part_opts(self):
+        """(parts, is_ext, bank_stride) as typed; parts None = single part."""
+        return (self.parts_var.get().strip() or None, self.is_ext_var.get(),
+                self.bank_stride_var.get().strip() or None)
+
+    def _banked_macros(self):
+        """Macros each part moves into its own bank (the tolerance is shared)."""
+        return [self.min_macro.get(), self.max_macro.get(), self.dev_macro.get()] + [p.macro for p in self.points]
+
+    def _reserve_banks(self):
+        """Claims parts 2..n's banks before the loop table is allocated. Returns generator options."""
+        parts, is_ext, stride = self._part_opts()
+        banks = NC.bank_macros(self._banked_macros(), parts, is_ext, stride)
+        for num in self._bank_claims: self.macros.release(num)
+        if self._table_block is not None:
+            for num in self._table_block: self.macros.release(num)
+            self._table_block = None
+        taken = {int(m) for bank in banks[1:] for m in bank}
+        self._bank_claims = [n for n in sorted(taken) if self.macros.claim(n, owner=self)]
+        return {"parts": parts, "bank_stride": stride}
+
+    def _table_base(self, count):
+        """User-set table base, or a fresh contiguous block from the session allocator."""
+        if self._table_block is not None:
+            for num in self._table_block: self.macros.release(num)
+            self._table_block = None
+        manual = self.table_base_var.get().replace("#", "").strip()
+        if manual:
+            return int(manual)
+        self._table_block = self.macros.allocate_block(owner=self, count=count)
+        return self._table_block.start - 1
+
     def _generate_code(self):
         if len(self.points) < 2: return
+        self._end_edit(commit=True)
         try:
-            t_num = self.tool_var.get()
-            g_work, _ = format_wcs(self.work_var.get(), self.is_ext_var.get())
-            _, w_sac = format_wcs(self.sac_work_var.get(), self.sac_ext_var.get())
-
-            z_clr = f_dec(self.clearance_z.get())
-            z_prot = f_dec(self.protected_z.get())
-            
-            tol_val = f_dec(self.tolerance.get())
-            t_mac = self.tol_macro.get().replace("#", "")
-            min_mac = self.min_macro.get().replace("#", "")
-            max_mac = self.max_macro.get().replace("#", "")
-            dev_mac = self.dev_macro.get().replace("#", "")
-            first_pt_mac = self.points[0]["macro"].get().replace("#", "")
-            
-            o_num = self.o_number_var.get().strip().upper().replace("O", "")
-            if not o_num: o_num = "01234"
+            params = self._collect_params()
+            term = None
+            if self.m30_var.get(): term = "M30"
+            elif self.m99_var.get(): term = "M99"
+
+            part_opts = self._reserve_banks()
+            loop = self.loop_var.get()
+            table_base = self._table_base(2 * len(self.points)) if loop else None
+            var_file = self.var_file_var.get()
+            self._var_lines = NC.flatness_variable_file(params, loop, table_base) if var_file else None
+            opts = dict(
+                full_pgm=self.post_wrap_var.get(),
+                pgm_num=self.o_number_var.get(),
+                term=term,
+                loop=loop,
+                table_base=table_base,
+                var_file=var_file,
+                lookahead="scoped" if self.scoped_var.get() else "routine",
+                fast=self.fast_var.get(),
+                skip_feed=self.skip_feed_var.get(),
+                skip_depth=self.skip_depth_var.get(),
+                protect_feed=self.protect_feed_var.get(),
+                **part_opts,
+            )
         except Exception as e:
             messagebox.showerror("Input Error", f"Check inputs: {e}")
             return
-
-        lines = []
-        # Post-wrap logic still applies internally if the user has it toggled
-        is_wrapped = self.post_wrap_var.get()
-
-        if is_wrapped:
-            lines.extend(["%", f"O{o_num}"])
-
-        lines.extend([
-            "(--- 3-STAGE FLATNESS ROUTINE ---)",
-            f"(USING SACRIFICIAL OFFSET {w_sac} FOR DUMP)",
-            "G103 P1 (LIMIT LOOK-AHEAD)",
-            "",
-            "(INITIALIZE VARIABLES - CLEAN SLATE)"
-        ])
-
-        for pt in self.points:
-            p_mac = pt["macro"].get().replace("#", "")
-            lines.append(f"#{p_mac}=0. (RESET P{self.points.index(pt)+1})")
-        
-        lines.append(f"#{min_mac}=0. (RESET MIN)")
-        lines.append(f"#{max_mac}=0. (RESET MAX)")
-        lines.append(f"#{dev_mac}=0. (RESET DEV)")
-        lines.append(f"#{t_mac}={tol_val} (SET TOLERANCE)")
-        
-        lines.extend([
-            "",
-            f"{G_HOME_Z}",
-            f"{G_SAFE_XY}",
-            f"T{t_num} {M06} (PROBE)",
-            f"{G90} {g_work} (ACTIVE WORK OFFSET)",
-            f"{G43} H{t_num} Z{z_clr} (1. CLEARANCE)",
-            f"{PROBE_ON}",
-            ""
-        ])
-
-        for i, pt in enumerate(self.points):
-            p_mac = pt["macro"].get().replace("#", "")
-            x_val = f_dec(pt['x'].get())
-            y_val = f_dec(pt['y'].get())
-            lines.append(f"(POINT {i+1} -> #{p_mac})")
-            lines.append(f"{PROBE_PROTECT} X{x_val} Y{y_val} Z{z_prot}")
-            lines.append(f"{WIPS_STORM} {w_sac} A20. H-1.0 (SURFACE Z)")
-            lines.append(f"#{p_mac}=#5063 (CAPTURE Z MACHINE POS)")
-            lines.append("")
-
-        lines.append(f"{PROBE_OFF}")
-        lines.append(f"{G_HOME_Z}")
-        lines.append(f"{G_SAFE_XY}")
-        lines.append(f"{M01}")
-        lines.append("")
-        lines.append("(--- CALCULATE MIN/MAX RANGE ---)")
-        lines.append(f"#{min_mac}=#{first_pt_mac} (SEED MIN)")
-        lines.append(f"#{max_mac}=#{first_pt_mac} (SEED MAX)")
-        
-        for i in range(1, len(self.points)):
-            p_mac = self.points[i]["macro"].get().replace("#", "")
-            lines.append(f"IF [#{p_mac} LT #{min_mac}] THEN #{min_mac}=#{p_mac}")
-            lines.append(f"IF [#{p_mac} GT #{max_mac}] THEN #{max_mac}=#{p_mac}")
-
-        lines.append("")
-        lines.append(f"#{dev_mac}=[#{max_mac}-#{min_mac}]")
-        lines.append(f"IF [#{dev_mac} GT #{t_mac}] #3000=1 (FLATNESS TOL EXCEEDED)")
-        lines.append("(FLATNESS WITHIN LIMITS)")
-        lines.append("G103 P0 (RESTORE LOOK-AHEAD)")
-        
-        # Termination (Only if wrapped)
-        if is_wrapped:
-            if self.m30_var.get():
-                lines.append("M30")
-            elif self.m99_var.get():
-                lines.append("M99")
-            else:
-                lines.append(f"{M01}")
-            lines.append("%")
-        else:
-            lines.append(f"{M01}")
-
-        self.output_text.delete("1.0", tk.END)
-        self.output_text.insert(tk.END, "\n".join(lines))
\ No newline at end of file
+        optimize = self.peephole_var.get()
+
+        def post(lines):
+            status = ""
+            if optimize:
+                lines, saved = peephole.optimize(lines)
+                status = "  |  " + peephole.summary(saved)
+            timed = NC.expand_flatness_loop(lines, params, table_base) if loop else lines
+            return lines, cycle_time.summary(cycle_time.estimate(timed)) + status
+
+        self._cancel_generate()
+        self.cancel_btn.config(state="normal")
+        self._job = background.GenerationJob(
+            self, self.output_text, lambda: program_cache.flatness(params, **opts), post,
+            on_status=self.time_var.set, on_done=self._generate_done, on_error=self._generate_failed).start()
+
+    def _save_var_file(self):
+        if not self._var_lines:
+            messagebox.showinfo("Variable File", "Generate with 'Tolerance + table in variable file' checked first.")
+            return
+        path = filedialog.asksaveasfilename(defaultextension=NC.VARIABLE_FILE_EXT,
+                                            filetypes=[("Haas macro variables", f"*{NC.VARIABLE_FILE_EXT}"),
+                                                       ("All files", "*.*")])
+        if not path: return
+        try:
+            with open(path, "w", newline="\n") as fh:
+                NC.write_program(self._var_lines, fh)
+        except OSError as e:
+            messagebox.showerror("Variable File", str(e))
+
+    def _cancel_generate(self):
+        if self._job is not None and self._job.running:
+            self._job.cancel()
+        self.cancel_btn.config(state="disabled")
+
+    def _generate_done(self, lines, status):
+        self.cancel_btn.config(state="disabled")
+        self.time_var.set(status)
+
+    def _generate_failed(self, e):
+        self.cancel_btn.config(state="disabled")
+        self.time_var.set("")
+        messagebox.showerror("Input Error", f"Check inputs: {e}")
\ No newline at end of file
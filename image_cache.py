@@ -0,0 +1,149 @@
+"""
+ApexProbe | lib/image_cache.py
+Cycle diagram loading for the WIPS tab
+- Asset paths are resolved once per name.
+- Resized thumbnails are cached on disk, keyed by a hash of the source bytes
+  and the target size, so the LANCZOS resize runs once per asset version.
+- Ready PhotoImages sit in a small LRU; a background thread decodes every
+  diagram at startup and Tk picks them up from a queue via after().
+- Pillow itself is only imported on first use.
+"""
+
+import hashlib
+import importlib.util
+import io
+import os
+import queue
+import threading
+from collections import OrderedDict
+
+# Pillow is required for handling PNG/JPG diagrams in Tkinter
+PILLOW_AVAILABLE = importlib.util.find_spec("PIL") is not None
+if not PILLOW_AVAILABLE:
+    print("CRITICAL: Pillow library not found. Run 'pip install Pillow' in your terminal.")
+Image = ImageTk = None
+
+THUMB_SIZE = (350, 250)
+THUMB_DIR = os.path.join(os.path.expanduser("~"), ".apexprobe", "thumbs")
+CACHE_SIZE = 32     # PhotoImages kept alive (11 diagrams today)
+POLL_MS = 30        # how often Tk drains the preload queue
+
+_MISSING = object()
+_asset_paths = {}
+
+
+def _pillow():
+    """Imports Pillow on first use, so app startup never pays for it."""
+    global Image, ImageTk
+    if Image is None:
+        from PIL import Image as _Image, ImageTk as _ImageTk
+        Image, ImageTk = _Image, _ImageTk
+
+
+def _search_paths(name):
+    return [
+        os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "assets", name),
+        os.path.join(os.getcwd(), "assets", name),
+    ]
+
+
+def find_asset(name):
+    """Path of an asset file, or None. Looked up once per name."""
+    if name not in _asset_paths:
+        _asset_paths[name] = next((p for p in _search_paths(name) if os.path.exists(p)), None)
+    return _asset_paths[name]
+
+
+def load_thumbnail(name, size=THUMB_SIZE):
+    """
+    PIL image of the asset scaled to size, or None if the asset is missing.
+    Goes through the on-disk thumbnail cache. No Tk calls, so it is safe off the main thread.
+    """
+    path = find_asset(name)
+    if path is None:
+        return None
+    _pillow()
+    with open(path, "rb") as fh:
+        data = fh.read()
+    w, h = size
+    digest = hashlib.sha1(data + f"|{w}x{h}".encode()).hexdigest()[:16]
+    stem = os.path.splitext(os.path.basename(name))[0]
+    thumb = os.path.join(THUMB_DIR, f"{stem}-{w}x{h}-{digest}.png")
+
+    if os.path.exists(thumb):
+        try:
+            img = Image.open(thumb)
+            img.load()
+            return img
+        except OSError:
+            pass  # corrupt cache entry: rebuild below
+
+    img = Image.open(io.BytesIO(data)).resize(size, Image.Resampling.LANCZOS)
+    try:
+        os.makedirs(THUMB_DIR, exist_ok=True)
+        # Preload thread and a Tk-thread miss can write the same thumbnail at once
+        tmp = f"{thumb}.{os.getpid()}.{threading.get_ident()}.tmp"
+        img.save(tmp, "PNG")
+        os.replace(tmp, thumb)
+    except OSError:
+        pass  # read-only home: still works, just without the disk cache
+    return img
+
+
+class DiagramCache:
+    """LRU of ready PhotoImages keyed by (asset name, size), owned by one Tk widget."""
+
+    def __init__(self, widget, size=THUMB_SIZE, capacity=CACHE_SIZE):
+        self.widget = widget
+        self.size = tuple(size)
+        self.capacity = capacity
+        self._photos = OrderedDict()
+        self._queue = queue.Queue()
+        self._thread = None
+
+    def _store(self, name, img):
+        key = (name,) + self.size
+        _pillow()
+        self._photos[key] = _MISSING if img is None else ImageTk.PhotoImage(img)
+        self._photos.move_to_end(key)
+        while len(self._photos) > self.capacity:
+            self._photos.popitem(last=False)
+        return self._photos[key]
+
+    def photo(self, name):
+        """PhotoImage for name (None if missing). Loads synchronously on a cache miss."""
+        key = (name,) + self.size
+        if key in self._photos:
+            self._photos.move_to_end(key)
+            found = self._photos[key]
+        else:
+            found = self._store(name, load_thumbnail(name, self.size))
+        return None if found is _MISSING else found
+
+    def preload(self, names):
+        """Decodes names on a worker thread; PhotoImages are built on the Tk thread."""
+        names = [n for n in dict.fromkeys(names) if (n,) + self.size not in self._photos]
+        if not PILLOW_AVAILABLE or not names: return
+        _pillow()  # import on the Tk thread, not inside the worker
+
+        def work():
+            for name in names:
+                try:
+                    self._queue.put((name, load_thumbnail(name, self.size)))
+                except Exception:
+                    pass  # a bad asset is reported when it is actually shown
+
+        self._thread = threading.Thread(target=work, name="diagram-preload", daemon=True)
+        self._thread.start()
+        self.widget.after(POLL_MS, self._drain)
+
+    def _drain(self):
+        while True:
+            try:
+                name, img = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if (name,) + self.size not in self._photos:
+                self._store(name, img)
+        if self._thread.is_alive() or not self._queue.empty():
+            self.widget.after(POLL_MS, self._drain)
@@ -0,0 +1,206 @@
+"""
+ApexProbe | lib/macro_alloc.py
+Automatic user-macro allocation over codes.haas_user_macros
+- Free-list of [start, end) intervals, kept sorted for bisect lookup.
+- Scratch #100 (deviation) is reserved and never handed out.
+- Session-wide audit of macro claims across features and tabs.
+"""
+
+from bisect import bisect_left, bisect_right
+
+from lib.codes import haas_user_macros
+
+# Scratch variables the generators write to directly
+RESERVED_MACROS = {100: "DEVIATION SCRATCH"}
+
+# Persistent 900s first, then wrap to the remaining user ranges
+DEFAULT_HINT = 901
+
+
+class MacroAllocator:
+    """Hands out non-colliding user macros in O(log n) per request."""
+
+    def __init__(self, ranges=None, reserved=None):
+        ranges = haas_user_macros if ranges is None else ranges
+        self.reserved = dict(RESERVED_MACROS if reserved is None else reserved)
+        self._legal = sorted((r.start, r.stop) for r in ranges)
+        self._legal_starts = [s for s, _ in self._legal]
+        self._starts = []  # free interval starts (sorted)
+        self._ends = []    # matching exclusive ends
+        for start, stop in self._legal:
+            self._starts.append(start)
+            self._ends.append(stop)
+        self.owners = {}   # macro -> owner tag
+        for num in self.reserved:
+            self._take(num)
+
+    # --- Interval bookkeeping ---
+
+    def _find(self, num):
+        """Index of the free interval containing num, or -1."""
+        i = bisect_right(self._starts, num) - 1
+        if i >= 0 and num < self._ends[i]:
+            return i
+        return -1
+
+    def _take(self, num):
+        i = self._find(num)
+        if i < 0:
+            return False
+        start, end = self._starts[i], self._ends[i]
+        if start == num and end == num + 1:
+            del self._starts[i], self._ends[i]
+        elif start == num:
+            self._starts[i] = num + 1
+        elif end == num + 1:
+            self._ends[i] = num
+        else:
+            self._ends[i] = num
+            self._starts.insert(i + 1, num + 1)
+            self._ends.insert(i + 1, end)
+        return True
+
+    def _give_back(self, num):
+        i = bisect_right(self._starts, num)
+        joins_left = i > 0 and self._ends[i - 1] == num
+        joins_right = i < len(self._starts) and self._starts[i] == num + 1
+        if joins_left and joins_right:
+            self._ends[i - 1] = self._ends[i]
+            del self._starts[i], self._ends[i]
+        elif joins_left:
+            self._ends[i - 1] = num + 1
+        elif joins_right:
+            self._starts[i] = num
+        else:
+            self._starts.insert(i, num)
+            self._ends.insert(i, num + 1)
+
+    # --- Public API ---
+
+    def is_legal(self, num):
+        """True if num sits inside one of the Haas user macro ranges."""
+        i = bisect_right(self._legal_starts, num) - 1
+        return i >= 0 and num < self._legal[i][1]
+
+    def is_free(self, num):
+        return self._find(num) >= 0
+
+    def free_count(self):
+        return sum(e - s for s, e in zip(self._starts, self._ends))
+
+    def claim(self, num, owner):
+        """Marks a specific macro as used. Returns False if it was not free."""
+        num = int(num)
+        if not self._take(num):
+            return False
+        self.owners[num] = owner
+        return True
+
+    def allocate(self, owner, hint=DEFAULT_HINT):
+        """Next free macro at or above hint, wrapping to the lowest free range."""
+        i = bisect_right(self._starts, hint) - 1
+        if i >= 0 and hint < self._ends[i]:
+            num = hint
+        elif i + 1 < len(self._starts):
+            num = self._starts[i + 1]
+        elif self._starts:
+            num = self._starts[0]
+        else:
+            raise ValueError("No free user macros left in haas_user_macros.")
+        self.claim(num, owner)
+        return num
+
+    def allocate_block(self, owner, count, hint=DEFAULT_HINT):
+        """First contiguous run of count free macros (at/after hint, then from the bottom)."""
+        order = list(range(len(self._starts)))
+        first = max(0, bisect_right(self._starts, hint) - 1)
+        for i in order[first:] + order[:first]:
+            start = max(self._starts[i], hint) if i >= first else self._starts[i]
+            if self._ends[i] - start >= count:
+                block = range(start, start + count)
+                for num in block:
+                    self.claim(num, owner)
+                return block
+        raise ValueError(f"No contiguous block of {count} free user macros.")
+
+    def allocate_many(self, owner, count, hint=DEFAULT_HINT):
+        """
+        count macros in ascending order from hint (wrapping to the bottom), gaps allowed.
+        Walks whole free intervals instead of searching once per macro.
+        """
+        if count > self.free_count():
+            raise ValueError(f"Only {self.free_count()} free user macros left, {count} requested.")
+        first = max(0, bisect_right(self._starts, hint) - 1)
+        spans = []
+        for i in list(range(first, len(self._starts))) + list(range(first)):
+            start = max(self._starts[i], hint) if i >= first else self._starts[i]
+            spans.append((start, self._ends[i]))
+        if first < len(self._starts) and hint > self._starts[first]:
+            spans.append((self._starts[first], min(hint, self._ends[first])))  # skipped head of the hint interval
+
+        out = []
+        for start, end in spans:
+            take = min(count - len(out), end - start)
+            if take <= 0: continue
+            out.extend(range(start, start + take))
+            if len(out) == count: break
+        for num in out:
+            self.claim(num, owner)
+        return out
+
+    def release(self, num):
+        num = int(num)
+        if self.owners.pop(num, None) is not None:
+            self._give_back(num)
+
+    def release_owner(self, owner):
+        for num in [n for n, o in self.owners.items() if o == owner]:
+            self.release(num)
+
+
+def parse_macro(value):
+    """'#901' / '901' / 901 -> 901, or None if blank or non-numeric."""
+    try:
+        return int(float(str(value).replace("#", "").strip()))
+    except ValueError:
+        return None
+
+
+def audit(claims, allocator=None):
+    """
+    Cross-checks macro usage for a whole session.
+    claims: {owner label: iterable of macro numbers/strings}
+    Returns a list of human-readable conflict lines (empty = clean).
+    """
+    alloc = allocator or MacroAllocator()
+    users = {}
+    problems = []
+    for owner, macros in claims.items():
+        for raw in macros:
+            num = parse_macro(raw)
+            if num is None:
+                if str(raw).strip():
+                    problems.append(f"{owner}: '{raw}' is not a macro number")
+                continue
+            users.setdefault(num, []).append(owner)
+
+    for num in sorted(users):
+        owners = users[num]
+        if num in alloc.reserved:
+            problems.append(f"#{num} is reserved ({alloc.reserved[num]}) but used by {', '.join(owners)}")
+        elif not alloc.is_legal(num):
+            problems.append(f"#{num} is outside the Haas user macro ranges ({', '.join(owners)})")
+        if len(owners) > 1:
+            problems.append(f"#{num} is shared by {', '.join(owners)}")
+    return problems
+
+
+_session = None
+
+
+def session():
+    """Shared allocator for every tab in the running app."""
+    global _session
+    if _session is None:
+        _session = MacroAllocator()
+    return _session
@@ -5,18 +5,127 @@ Scope:
 Fast lookup of Haas NGC macro variables for Tool and Work Offsets.
 - Tool Section: Tn (1–200) lookup.
 - Work Section: G52, G54–G59, and G154 P1–P99 (7k/14k banks).
-- Reverse Lookup: Range-aware variable identification.
+- Reverse Lookup: Range-aware variable identification (bisect over a sorted range table).
+- Program Audit: Annotates every #nnnn reference in a pasted/loaded program in one pass.
 """
 
+import re
 import tkinter as tk
-from tkinter import ttk
+from bisect import bisect_right
+from tkinter import ttk, filedialog
+
+AXES = ["X", "Y", "Z", "A", "B", "C"]
+
+
+# --- RANGE TABLE (built once at import) ---
+
+def _tool_desc(base, kind):
+    return lambda num: f"Tool {num - base} - {kind}"
+
+
+def _bank_desc(first, label, tail=""):
+    # 20 variables per offset; the first six are the axes
+    def describe(num):
+        idx, ax_idx = divmod(num - first, 20)
+        name = label(idx)
+        if ax_idx < len(AXES): return f"{name} Axis: {AXES[ax_idx]}"
+        return f"{name}{tail}"
+    return describe
+
+
+# (first, last, describer) sorted by first
+MACRO_RANGES = [
+    (188, 188, lambda num: "Probe Result: Measured Size (Diameter/Width/Pocket)"),
+    (2001, 2200, _tool_desc(2000, "Length Geometry")),
+    (2201, 2400, _tool_desc(2200, "Length Wear")),
+    (2401, 2600, _tool_desc(2400, "Diameter Geometry")),
+    (2601, 2800, _tool_desc(2600, "Diameter Wear")),
+    (5201, 5206, lambda num: f"G52 Axis: {AXES[num - 5201]}"),
+    (5221, 5339, _bank_desc(5221, lambda i: f"G{54 + i}", " Variable")),
+    (7001, 7400, _bank_desc(7001, lambda i: f"G154 P{i + 1} (7k)")),
+    (14001, 15980, _bank_desc(14001, lambda i: f"G154 P{i + 1} (14k)")),
+]
+_RANGE_STARTS = [r[0] for r in MACRO_RANGES]
+
+OUT_OF_SCOPE = "Variable outside Tool/Work offset scope."
+
+
+def describe_macro(num):
+    """Bisect lookup of a macro number in MACRO_RANGES. Returns None if unmapped."""
+    i = bisect_right(_RANGE_STARTS, num) - 1
+    if i >= 0 and num <= MACRO_RANGES[i][1]:
+        return MACRO_RANGES[i][2](num)
+    return None
+
+
+def _axis_map(base):
+    return {ax: f"#{base + i}" for i, ax in enumerate(AXES)}
+
+
+def _build_work_maps():
+    """Selection -> (7k mapping, 14k mapping) for every entry in the WCS combobox."""
+    maps = {"G52": (_axis_map(5201), {})}
+    for g_num in range(54, 60):
+        maps[f"G{g_num}"] = (_axis_map(5221 + (g_num - 54) * 20), {})
+    for p in range(1, 100):
+        m7 = _axis_map(7001 + (p - 1) * 20) if p <= 20 else {}
+        maps[f"G154 P{p}"] = (m7, _axis_map(14001 + (p - 1) * 20))
+    return maps
+
+
+WORK_MAPS = _build_work_maps()
+
+# #1234 references; a following '=' marks a write
+_MACRO_REF = re.compile(r"#(\d+)(\s*=(?!=))?")
+_COMMENT = re.compile(r"\(.*?\)")  # "(POINT 1 -> #901)": a label, not a reference
+
+
+def audit_program(text):
+    """
+    Single pass over a program: every #nnnn reference with read/write line numbers.
+    Returns a list of (num, description, write_lines, read_lines) sorted by num.
+    """
+    refs = {}
+    for line_no, line in enumerate(text.splitlines(), start=1):
+        if "#" not in line: continue
+        for m in _MACRO_REF.finditer(_COMMENT.sub("", line)):
+            entry = refs.get(m.group(1))
+            if entry is None:
+                entry = refs[m.group(1)] = ([], [])
+            entry[0 if m.group(2) else 1].append(line_no)
+
+    result = []
+    for key in sorted(refs, key=int):
+        num = int(key)
+        writes, reads = refs[key]
+        result.append((num, describe_macro(num) or OUT_OF_SCOPE, writes, reads))
+    return result
+
+
+def format_audit(rows, max_lines=8):
+    """Renders audit_program rows as a fixed-width report."""
+    def fmt_lines(nums):
+        shown = ", ".join(str(n) for n in nums[:max_lines])
+        return shown + (f" (+{len(nums) - max_lines})" if len(nums) > max_lines else "")
+
+    out = []
+    mapped = [r for r in rows if r[1] != OUT_OF_SCOPE]
+    out.append(f"{len(rows)} variables referenced, {len(mapped)} mapped to tool/work offsets")
+    out.append(f"{sum(1 for r in mapped if r[2])} offset variables WRITTEN by this program")
+    out.append("")
+    for num, desc, writes, reads in rows:
+        out.append(f"#{num:<6} {desc}")
+        if writes: out.append(f"        WRITE  L{fmt_lines(writes)}")
+        if reads: out.append(f"        READ   L{fmt_lines(reads)}")
+    return "\n".join(out)
+
 
 class MacroOffsetsTab(ttk.Frame):
     def __init__(self, parent):
         super().__init__(parent)
         
         # --- Internal Data ---
-        self.AXES = ["X", "Y", "Z", "A", "B", "C"]
+        self.AXES = AXES
         
         # --- UI Variables ---
         self.tool_input = tk.StringVar(value="1")
@@ -130,6 +239,25 @@ class MacroOffsetsTab(ttk.Frame):
                                    font=("Segoe UI", 11, "italic bold"), pady=10)
         self.rev_display.pack(fill="x")
 
+        # --- Program Audit (bulk annotation) ---
+        audit_lab = ttk.LabelFrame(footer_f, text=" Program Macro Audit ", padding=15)
+        audit_lab.pack(fill="both", expand=True, pady=(10, 0))
+
+        audit_btn_f = ttk.Frame(audit_lab)
+        audit_btn_f.pack(fill="x", pady=(0, 5))
+        ttk.Button(audit_btn_f, text="Load Program...", command=self._load_program).pack(side="left")
+        ttk.Button(audit_btn_f, text="Annotate All", command=self._do_bulk_audit).pack(side="left", padx=5)
+        self.audit_status = tk.StringVar(value="Paste a program on the left, then Annotate All.")
+        ttk.Label(audit_btn_f, textvariable=self.audit_status).pack(side="left", padx=10)
+
+        audit_body = ttk.Frame(audit_lab)
+        audit_body.pack(fill="both", expand=True)
+        self.audit_in = tk.Text(audit_body, font=("Consolas", 10), height=10, width=40, undo=True)
+        self.audit_in.pack(side="left", fill="both", expand=True, padx=(0, 5))
+        self.audit_out = tk.Text(audit_body, font=("Consolas", 10), height=10, width=60, 
+                                 bg="#1e272e", fg="#d2dae2")
+        self.audit_out.pack(side="left", fill="both", expand=True)
+
     # --- Logic Methods ---
 
     def _update_tool_macros(self):
@@ -146,70 +274,35 @@ class MacroOffsetsTab(ttk.Frame):
             for v in [self.h_geom, self.h_wear, self.d_geom, self.d_wear]: v.set("---")
 
     def _update_work_macros(self):
-        sel = self.wcs_selection.get()
+        m7, m14 = WORK_MAPS.get(self.wcs_selection.get(), ({}, {}))
         for ax in self.AXES:
-            self.wo7[ax].set("")
-            self.wo14[ax].set("")
-
-        def get_axis_map(base):
-            return {ax: f"#{base + i}" for i, ax in enumerate(self.AXES)}
-
-        if sel == "G52":
-            mapping = get_axis_map(5201)
-            for ax in self.AXES: self.wo7[ax].set(mapping[ax])
-        elif sel.startswith("G5") and " " not in sel:
-            g_num = int(sel[1:])
-            base = 5221 + (g_num - 54) * 20
-            mapping = get_axis_map(base)
-            for ax in self.AXES: self.wo7[ax].set(mapping[ax])
-        elif "P" in sel:
-            p = int(sel.split("P")[1])
-            if 1 <= p <= 20:
-                base7 = 7001 + (p-1)*20
-                m7 = get_axis_map(base7)
-                for ax in self.AXES: self.wo7[ax].set(m7[ax])
-            if 1 <= p <= 99:
-                base14 = 14001 + (p-1)*20
-                m14 = get_axis_map(base14)
-                for ax in self.AXES: self.wo14[ax].set(m14[ax])
+            self.wo7[ax].set(m7.get(ax, ""))
+            self.wo14[ax].set(m14.get(ax, ""))
 
     def _do_reverse_lookup(self):
         try:
             raw = self.rev_input.get().replace("#", "").strip()
             if not raw: return
-            num = int(raw)
-            
-            # Ranges
-            if 2001 <= num <= 2200: 
-                self.rev_output.set(f"Tool {num-2000} - Length Geometry")
-            elif 2201 <= num <= 2400: 
-                self.rev_output.set(f"Tool {num-2200} - Length Wear")
-            elif 2401 <= num <= 2600: 
-                self.rev_output.set(f"Tool {num-2400} - Diameter Geometry")
-            elif 2601 <= num <= 2800: 
-                self.rev_output.set(f"Tool {num-2600} - Diameter Wear")
-            elif 5201 <= num <= 5206: 
-                self.rev_output.set(f"G52 Axis: {self.AXES[num-5201]}")
-            elif 5221 <= num <= 5339:
-                offset = (num - 5221) // 20
-                g_num = 54 + offset
-                ax_idx = (num - 5221) % 20
-                if ax_idx < len(self.AXES): self.rev_output.set(f"G{g_num} Axis: {self.AXES[ax_idx]}")
-                else: self.rev_output.set(f"G{g_num} Variable")
-            elif 7001 <= num <= 7400:
-                p = ((num - 7001) // 20) + 1
-                ax_idx = (num - 7001) % 20
-                if ax_idx < len(self.AXES): self.rev_output.set(f"G154 P{p} (7k) Axis: {self.AXES[ax_idx]}")
-                else: self.rev_output.set(f"G154 P{p} (7k)")
-            elif 14001 <= num <= 15980:
-                p = ((num - 14001) // 20) + 1
-                ax_idx = (num - 14001) % 20
-                if ax_idx < len(self.AXES): self.rev_output.set(f"G154 P{p} (14k) Axis: {self.AXES[ax_idx]}")
-                else: self.rev_output.set(f"G154 P{p} (14k)")
-            elif num == 188:
-                self.rev_output.set("Probe Result: Measured Size (Diameter/Width/Pocket)")
-            else:
-                self.rev_output.set("Variable outside Tool/Work offset scope.")
-                    
+            self.rev_output.set(describe_macro(int(raw)) or OUT_OF_SCOPE)
         except ValueError:
-            self.rev_output.set("Error: Enter numeric value")
\ No newline at end of file
+            self.rev_output.set("Error: Enter numeric value")
+
+    def _load_program(self):
+        path = filedialog.askopenfilename(
+            title="Load Program",
+            filetypes=[("NC Programs", "*.nc *.txt *.tap"), ("All Files", "*.*")]
+        )
+        if not path: return
+        with open(path, errors="replace") as fh:
+            text = fh.read()
+        self.audit_in.delete("1.0", tk.END)
+        self.audit_in.insert(tk.END, text)
+        self._do_bulk_audit()
+
+    def _do_bulk_audit(self):
+        text = self.audit_in.get("1.0", "end-1c")
+        rows = audit_program(text)
+        self.audit_out.delete("1.0", tk.END)
+        self.audit_out.insert(tk.END, format_audit(rows))
+        n_lines = text.count("\n") + 1
+        self.audit_status.set(f"{n_lines} lines scanned.")
\ No newline at end of file
@@ -6,8 +6,9 @@ Modular G-Code generation tool for Haas NGC Mills, specializing in
 Renishaw WIPS (Wireless Intuitive Probing System) cycles.
 Architecture:
 - main.py: Application entry point and Tab/Notebook controller.
+- batch.py: Headless batch generation over job files (no Tk).
 - lib/codes.py: Centralized 'Source of Truth' for Haas G/M codes.
-- tabs/: Individual modules for specific machining workflows.
+- tabs/: Individual modules for specific machining workflows (built on first view).
 
 Author: Gemini/Olaf Gromotka Collaborative Build
 Version: 1.2.3 (Fix Import Mapping)
@@ -21,42 +22,157 @@ V1.2.4 - I need to collaborate with Gemini to hunt down the cause of the imprope
          if the user selects extended woffsegt 69: linking move SHOULD output as G154 P69
 """
 
+import time
+_T0 = time.perf_counter()
+
+import importlib
+import os
 import tkinter as tk
-from tkinter import ttk
-from tabs.wips_tab import WIPSTab
-from tabs.macro_offsets_tab import MacroOffsetsTab
-from tabs.flatness_tab import FlatnessTab
-# Ensure this matches the filename measure_features.py exactly
-from tabs.measure_features import MeasureFeaturesTab
+from tkinter import ttk, messagebox, filedialog
+from lib import macro_alloc
+_T_IMPORTS = time.perf_counter()
+
+# Launch-to-first-paint budget (seconds) for the shop-floor PCs
+STARTUP_BUDGET_S = 1.0
+
+# Tabs are registered as factories and built the first time they are shown:
+# (attribute, title, module, class). Module names must match the tabs/ filenames exactly.
+TABS = [
+    ("wips_page",     " Virtual WIPS ",      "tabs.wips_tab",          "WIPSTab"),
+    ("measure_page",  " Measure Features ",  "tabs.measure_features",  "MeasureFeaturesTab"),
+    ("flatness_page", " Flatness Probing ",  "tabs.flatness_tab",      "FlatnessTab"),
+    ("macro_page",    " Macro Offsets ",     "tabs.macro_offsets_tab", "MacroOffsetsTab"),
+]
+
+# Project file section saved/restored by each tab
+PROJECT_SECTIONS = {"wips_page": "wips", "measure_page": "measure", "flatness_page": "flatness"}
 
 class ApexProbe(tk.Tk):
     def __init__(self):
         super().__init__()
+        self.timings = {"imports": _T_IMPORTS - _T0, "tk init": time.perf_counter() - _T_IMPORTS}
 
         self.title("ApexProbe | Haas Automation Suite")
         
         # Optimized for multi-feature lists and side-by-side G-code preview
         self.geometry("1200x900")
         self.minsize(1000, 800)
+
+        # Menu: session-wide tools
+        menubar = tk.Menu(self)
+        file_menu = tk.Menu(menubar, tearoff=0)
+        file_menu.add_command(label="Open Project...", command=self._open_project)
+        file_menu.add_command(label="Save Project", command=self._save_project)
+        file_menu.add_command(label="Save Project As...", command=lambda: self._save_project(ask=True))
+        menubar.add_cascade(label="File", menu=file_menu)
+        tools_menu = tk.Menu(menubar, tearoff=0)
+        tools_menu.add_command(label="Check Macro Conflicts", command=self._check_macros)
+        tools_menu.add_command(label="Startup Report", command=self._show_startup_report)
+        menubar.add_cascade(label="Tools", menu=tools_menu)
+        self.config(menu=menubar)
         
         # 1. Main Notebook Container
         self.notebook = ttk.Notebook(self)
         self.notebook.pack(fill="both", expand=True, padx=10, pady=10)
 
-        # 2. Add Tabs
-        self.wips_page = WIPSTab(self.notebook)
-        self.notebook.add(self.wips_page, text=" Virtual WIPS ")
-        
-        # The tab logic is contained in tabs/measure_features.py
-        self.measure_page = MeasureFeaturesTab(self.notebook)
-        self.notebook.add(self.measure_page, text=" Measure Features ")
-        
-        self.flatness_page = FlatnessTab(self.notebook)
-        self.notebook.add(self.flatness_page, text=" Flatness Probing ")
+        # Loaded project: sections for tabs not built yet are applied on first view
+        self.project = None
+        self.project_path = None
+
+        # 2. Add Tabs (empty holders; the page is built on first view)
+        self._pending = {}
+        for attr, title, module, cls in TABS:
+            holder = ttk.Frame(self.notebook)
+            self.notebook.add(holder, text=title)
+            self._pending[str(holder)] = (holder, attr, title, module, cls)
+            setattr(self, attr, None)
+        self.notebook.bind("<<NotebookTabChanged>>", self._build_selected)
+        self._build_selected()
+
+        self.after(0, lambda: self.after_idle(self._first_paint))
+
+    def _build_selected(self, event=None):
+        """Imports and builds the selected tab the first time it is shown."""
+        spec = self._pending.pop(self.notebook.select(), None)
+        if spec is None: return
+        holder, attr, title, module, cls = spec
+        t = time.perf_counter()
+        page = getattr(importlib.import_module(module), cls)(holder)
+        page.pack(fill="both", expand=True)
+        setattr(self, attr, page)
+        if self.project is not None and attr in PROJECT_SECTIONS:
+            page.load_project(self.project[PROJECT_SECTIONS[attr]])
+        self.timings[f"build{title.rstrip()}"] = time.perf_counter() - t
+
+    def _first_paint(self):
+        self.timings["first paint"] = time.perf_counter() - _T0
+        if os.environ.get("APEXPROBE_STARTUP_REPORT") or self.timings["first paint"] > STARTUP_BUDGET_S:
+            print(self.startup_report())
+
+    def startup_report(self):
+        lines = [f"{name:<28}{sec * 1000:8.1f} ms" for name, sec in self.timings.items()]
+        total = self.timings.get("first paint")
+        if total is not None:
+            verdict = "OK" if total <= STARTUP_BUDGET_S else "OVER BUDGET"
+            lines.append(f"{'budget':<28}{STARTUP_BUDGET_S * 1000:8.1f} ms  {verdict}")
+        return "ApexProbe startup\n" + "\n".join(lines)
+
+    def _show_startup_report(self):
+        messagebox.showinfo("Startup Report", self.startup_report())
+
+    def _open_project(self):
+        from lib import project
+        path = filedialog.askopenfilename(filetypes=[("ApexProbe project", f"*{project.EXT}"), ("All files", "*.*")])
+        if not path: return
+        t = time.perf_counter()
+        try:
+            self.project = project.load(path)
+        except (OSError, project.ProjectError) as e:
+            messagebox.showerror("Open Project", f"{os.path.basename(path)}:\n{e}")
+            return
+        self.project_path = path
+        for attr, section in PROJECT_SECTIONS.items():
+            page = getattr(self, attr)
+            if page is not None:
+                page.load_project(self.project[section])
+        self.timings["project load"] = time.perf_counter() - t
+        self.title(f"ApexProbe | {os.path.basename(path)}")
+
+    def _save_project(self, ask=False):
+        from lib import project
+        path = self.project_path
+        if ask or path is None:
+            path = filedialog.asksaveasfilename(defaultextension=project.EXT,
+                                                filetypes=[("ApexProbe project", f"*{project.EXT}")])
+            if not path: return
+        # Tabs never opened keep whatever the loaded project had for them
+        data = self.project or project.new_project()
+        for attr, section in PROJECT_SECTIONS.items():
+            page = getattr(self, attr)
+            if page is not None:
+                data[section] = page.project_state()
+        try:
+            project.save(path, data)
+        except OSError as e:
+            messagebox.showerror("Save Project", str(e))
+            return
+        self.project, self.project_path = data, path
+        self.title(f"ApexProbe | {os.path.basename(path)}")
+
+    def _check_macros(self):
+        """Audits every tab's macro usage against the Haas user ranges and each other."""
+        claims = {}
+        for attr, *_ in TABS:
+            page = getattr(self, attr)  # tabs never opened hold no macros
+            if page is not None and hasattr(page, "macro_claims"):
+                claims.update(page.macro_claims())
 
-        self.macro_page = MacroOffsetsTab(self.notebook)
-        self.notebook.add(self.macro_page, text=" Macro Offsets ")
+        problems = macro_alloc.audit(claims, macro_alloc.session())
+        if problems:
+            messagebox.showwarning("Macro Conflicts", "\n".join(problems))
+        else:
+            messagebox.showinfo("Macro Conflicts", f"No conflicts across {len(claims)} macro assignments.")
 
 if __name__ == "__main__":
     app = ApexProbe()
-    app.mainloop()
\ No newline at end of file
+    app.mainloop()
@@ -4,32 +4,78 @@ APEXPROBE | Measure Features Tab
 Scope:
 Generates a sequence of Renishaw probing cycles with optional
 program headers/wrappers. Logic delegated to lib/codes.py.
+- Feature list lives in a plain-Python model (lib/feature_model.py).
+- A ttk.Treeview shows it; cells are edited in place, so only the
+  visible rows ever cost any widgets.
 """
 
 import tkinter as tk
-from tkinter import ttk, messagebox
+from tkinter import ttk, messagebox, filedialog
 from lib import codes as NC
+from lib import macro_alloc
+from lib import sequencing as SEQ
+from lib import cycle_time
+from lib import peephole
+from lib import background
+from lib import project
+from lib import program_cache
+from lib.feature_model import Feature, ARG_FIELDS
+
+# Treeview columns: (model field, heading, width)
+COLUMNS = [
+    ("idx",     "#",       36),
+    ("pinned",  "Pin",     30),
+    ("cycle",   "Cycle",  120),
+    ("comment", "Comment", 90),
+    ("x",       "X",       56),
+    ("y",       "Y",       56),
+    ("plane",   "Plane Z", 56),
+    ("d",       "D",       48),
+    ("e",       "E",       48),
+    ("h",       "H",       48),
+    ("tol",     "Tol",     52),
+    ("macro",   "Macro #", 56),
+]
+
+PIN_MARK = "●"
+
+# Project file settings -> Tk variable attributes
+PROJECT_VARS = {
+    "t_num": "tool_var", "wcs": "work_var", "is_ext": "is_ext_var",
+    "z_clr": "clearance_z", "z_protect": "protected_z",
+    "full_pgm": "post_header_var", "pgm_num": "program_num_var", "use_m99": "use_m99_var",
+    "factored": "factored_var", "peephole": "peephole_var",
+    "var_file": "var_file_var", "var_base": "var_base_var",
+    "parts": "parts_var", "bank_stride": "bank_stride_var",
+    "linking": "linking_var", "regions": "regions_var", "protect_feed": "protect_feed_var",
+    "scoped_lookahead": "scoped_var",
+}
+
+# Live preview waits this long after the last edit before regenerating
+PREVIEW_DELAY_MS = 250
 
 class MeasureFeaturesTab(ttk.Frame):
     def __init__(self, parent):
         super().__init__(parent)
         
         # --- State ---
-        self.features = [] 
+        self.features = []   # Feature models, in probing order
+        self._by_iid = {}    # Treeview item id -> Feature
+        self._next_iid = 0
+        self._editor = None
+        self.macros = macro_alloc.session()
+
+        # Live preview: blocks currently shown in self.out (None = out of sync)
+        self.live_var = tk.BooleanVar(value=False)
+        self.peephole_var = tk.BooleanVar(value=False)
+        self._preview_blocks = None
+        self._preview_job = None
+        self._job = None  # background generation in flight
+        self._block_cache = {}
         
-        # Cycle Specifications (Mapped to Brain keys)
+        # Cycle Specifications (Mapped to Brain keys, read from the cycle registry)
         self.cycle_specs = {
-            "A10 - Bore":        {"req": ["D"],           "key": "A10"},
-            "A11 - Boss":        {"req": ["D", "H"],      "key": "A11"},
-            "A12 - Rect Pocket": {"req": ["D", "E"],      "key": "A12"},
-            "A13 - Rect Boss":   {"req": ["D", "E", "H"], "key": "A13"},
-            "A14 - Web X":       {"req": ["D", "H"],      "key": "A14"},
-            "A15 - Pocket X":    {"req": ["D"],           "key": "A15"},
-            "A16 - Web Y":       {"req": ["E", "H"],      "key": "A16"},
-            "A17 - Pocket Y":    {"req": ["E"],           "key": "A17"},
-            "A20 - Surface X":   {"req": ["D"],           "key": "A20X"},
-            "A20 - Surface Y":   {"req": ["E"],           "key": "A20Y"},
-            "A20 - Surface Z":   {"req": ["H"],           "key": "A20Z"}
+            c["label"]: {"req": list(c["args"]), "key": c["key"]} for c in NC.CYCLES.values()
         }
 
         # Machine & Program Setup
@@ -41,14 +87,39 @@ class MeasureFeaturesTab(ttk.Frame):
         self.post_header_var = tk.BooleanVar(value=False)
         self.program_num_var = tk.StringVar(value="1234")
         self.use_m99_var = tk.BooleanVar(value=False)
+        self.factored_var = tk.BooleanVar(value=False)  # one G65 call per feature into a skeleton sub
+        self.scoped_var = tk.BooleanVar(value=False)    # G103 P1 only around each capture, not the whole routine
+
+        # Variable file: nominal/tolerance table loaded on the control, not written inline
+        self.var_file_var = tk.BooleanVar(value=False)
+        self.var_base_var = tk.StringVar(value="")  # blank = auto-allocate
+        self._var_block = None
+        self._var_lines = None  # variable file matching the last generated program
+        self._skel_lines = None  # factored mode: skeleton program matching the last generated program
+
+        # Multi-part: the same features in several work offsets, one tool change
+        self.parts_var = tk.StringVar(value="")        # e.g. "54-57, P1-P4"; blank = single part
+        self.bank_stride_var = tk.StringVar(value="")  # blank = span of the feature macros
+        self._bank_claims = []
         
         # Global Heights
         self.clearance_z = tk.StringVar(value="6.0")
         self.protected_z = tk.StringVar(value="1.0")
+        self.protect_feed_var = tk.StringVar(value="50.")  # P9810 protected-move feed
+
+        # Height-aware linking: "X0 Y0 X1 Y1 Z; ..." safe-height regions
+        self.linking_var = tk.BooleanVar(value=False)
+        self.regions_var = tk.StringVar(value="")
 
         self._build_ui()
         self._add_feature()
 
+        for var in (self.tool_var, self.work_var, self.is_ext_var, self.post_header_var,
+                    self.program_num_var, self.use_m99_var, self.factored_var, self.clearance_z, self.protected_z,
+                    self.var_file_var, self.var_base_var, self.parts_var, self.bank_stride_var,
+                    self.protect_feed_var, self.linking_var, self.regions_var, self.scoped_var):
+            var.trace_add("write", self._schedule_preview)
+
     def _build_ui(self):
         self.columnconfigure(1, weight=1)
         self.rowconfigure(0, weight=1)
@@ -78,6 +149,23 @@ class MeasureFeaturesTab(ttk.Frame):
         r4 = ttk.Frame(setup_f); r4.pack(fill="x", pady=2)
         ttk.Checkbutton(r4, text="End with M99 (Sub-Prog)", variable=self.use_m99_var).pack(side="left")
 
+        r5 = ttk.Frame(setup_f); r5.pack(fill="x", pady=2)
+        ttk.Checkbutton(r5, text="Factor features into G65 sub (O+1, own file)", variable=self.factored_var).pack(side="left")
+
+        r5b = ttk.Frame(setup_f); r5b.pack(fill="x", pady=2)
+        ttk.Checkbutton(r5b, text="Scoped look-ahead (G103 only around captures)", variable=self.scoped_var).pack(side="left")
+
+        r6 = ttk.Frame(setup_f); r6.pack(fill="x", pady=2)
+        ttk.Checkbutton(r6, text="Nominals/Tols in variable file", variable=self.var_file_var).pack(side="left")
+        ttk.Label(r6, text=" Table #").pack(side="left")
+        ttk.Entry(r6, textvariable=self.var_base_var, width=6).pack(side="left", padx=2)
+
+        r7 = ttk.Frame(setup_f); r7.pack(fill="x", pady=2)
+        ttk.Label(r7, text="Parts WCS:").pack(side="left")
+        ttk.Entry(r7, textvariable=self.parts_var, width=14).pack(side="left", padx=5)
+        ttk.Label(r7, text="Bank +").pack(side="left")
+        ttk.Entry(r7, textvariable=self.bank_stride_var, width=5).pack(side="left", padx=2)
+
         # 2. Global Heights
         h_f = ttk.LabelFrame(input_panel, text=" Global Heights ", padding=10)
         h_f.pack(fill="x", pady=(0, 10))
@@ -85,146 +173,459 @@ class MeasureFeaturesTab(ttk.Frame):
         ttk.Entry(h_f, textvariable=self.clearance_z, width=8).grid(row=0, column=1, padx=5)
         ttk.Label(h_f, text="Protect Z:").grid(row=1, column=0, sticky="w")
         ttk.Entry(h_f, textvariable=self.protected_z, width=8).grid(row=1, column=1, padx=5)
+        ttk.Label(h_f, text="Protect F:").grid(row=1, column=2, sticky="w", padx=(10, 0))
+        ttk.Entry(h_f, textvariable=self.protect_feed_var, width=6).grid(row=1, column=3, padx=5)
+        ttk.Checkbutton(h_f, text="Height-aware linking", variable=self.linking_var).grid(row=2, column=0, columnspan=4, sticky="w")
+        ttk.Label(h_f, text="Regions:").grid(row=3, column=0, sticky="w")
+        ttk.Entry(h_f, textvariable=self.regions_var, width=30).grid(row=3, column=1, columnspan=3, padx=5, sticky="we")
+        ttk.Label(h_f, text="X0 Y0 X1 Y1 SAFE-Z; ...  (outside every region: full clearance)",
+                  font=("Segoe UI", 8, "italic")).grid(row=4, column=0, columnspan=4, sticky="w")
 
         # 3. Feature Sequence
         f_lab = ttk.LabelFrame(input_panel, text=" Probing Sequence ", padding=10)
         f_lab.pack(fill="both", expand=True)
         btn_f = ttk.Frame(f_lab); btn_f.pack(fill="x", pady=(0, 10))
         ttk.Button(btn_f, text="+ Add Feature", command=self._add_feature).pack(side="left", padx=2)
+        ttk.Button(btn_f, text="Remove Selected", command=self._remove_selected).pack(side="left", padx=2)
         ttk.Button(btn_f, text="Clear All", command=self._clear_features).pack(side="left", padx=2)
-        
-        self.canvas = tk.Canvas(f_lab, borderwidth=0, highlightthickness=0, width=500)
-        self.scrollbar = ttk.Scrollbar(f_lab, orient="vertical", command=self.canvas.yview)
-        self.scroll_frame = ttk.Frame(self.canvas)
-        self.scroll_frame.bind("<Configure>", lambda e: self.canvas.configure(scrollregion=self.canvas.bbox("all")))
-        self.canvas.create_window((0, 0), window=self.scroll_frame, anchor="nw")
-        self.canvas.configure(yscrollcommand=self.scrollbar.set)
-        self.canvas.pack(side="left", fill="both", expand=True)
+        ttk.Button(btn_f, text="Optimize Order", command=self._optimize_order).pack(side="left", padx=2)
+        ttk.Label(f_lab, text="Double-click a cell to edit, or Pin to keep a feature in place.",
+                  font=("Segoe UI", 8, "italic")).pack(anchor="w")
+        self.seq_status = tk.StringVar()
+        ttk.Label(f_lab, textvariable=self.seq_status, foreground="#27ae60").pack(anchor="w")
+
+        tree_f = ttk.Frame(f_lab); tree_f.pack(fill="both", expand=True)
+        self.tree = ttk.Treeview(tree_f, columns=[c[0] for c in COLUMNS], show="headings", height=18)
+        for field, heading, width in COLUMNS:
+            self.tree.heading(field, text=heading)
+            self.tree.column(field, width=width, minwidth=30, stretch=(field == "comment"),
+                             anchor="w" if field in ("cycle", "comment") else "center")
+        self.scrollbar = ttk.Scrollbar(tree_f, orient="vertical", command=self.tree.yview)
+        self.tree.configure(yscrollcommand=self._on_scroll)
+        self.tree.pack(side="left", fill="both", expand=True)
         self.scrollbar.pack(side="right", fill="y")
+        self.tree.bind("<Double-1>", self._begin_edit)
+        self.tree.bind("<Delete>", lambda e: self._remove_selected())
 
         # Output Panel (Right)
         output_panel = ttk.Frame(self)
         output_panel.grid(row=0, column=1, sticky="nsew", padx=(0, 20), pady=10)
         act_f = ttk.Frame(output_panel); act_f.pack(fill="x", pady=(0, 5))
         ttk.Button(act_f, text="GENERATE MEASUREMENTS", command=self._generate).pack(side="left", fill="x", expand=True)
+        self.cancel_btn = ttk.Button(act_f, text="Cancel", command=self._cancel_generate, state="disabled")
+        self.cancel_btn.pack(side="left", padx=(5, 0))
+        ttk.Button(act_f, text="Save .VAR", command=self._save_var_file).pack(side="left", padx=(5, 0))
+        ttk.Button(act_f, text="Save Skeleton", command=self._save_skeleton).pack(side="left", padx=(5, 0))
+        ttk.Checkbutton(act_f, text="Live Preview", variable=self.live_var, command=self._toggle_live).pack(side="left", padx=(10, 0))
+        ttk.Checkbutton(act_f, text="Optimize Output", variable=self.peephole_var, command=self._toggle_live).pack(side="left", padx=(10, 0))
         
+        self.time_var = tk.StringVar()
+        ttk.Label(output_panel, textvariable=self.time_var, foreground="#2980b9").pack(side="bottom", anchor="w", pady=(5, 0))
         self.out = tk.Text(output_panel, font=("Consolas", 11), bg="#1e272e", fg="#d2dae2", padx=15, pady=15)
         self.out.pack(fill="both", expand=True)
 
+    # --- Model / View ---
+
+    def _row_values(self, idx, feat):
+        """Display tuple for one row; args the cycle does not use show as a dash."""
+        req = self.cycle_specs.get(feat.cycle, {}).get("req", [])
+        vals = [idx]
+        for field, _, _ in COLUMNS[1:]:
+            if field in ARG_FIELDS and field.upper() not in req:
+                vals.append("-")
+            elif field == "pinned":
+                vals.append(PIN_MARK if feat.pinned else "")
+            else:
+                vals.append(getattr(feat, field))
+        return vals
+
+    def _renumber(self, start=0):
+        for i, iid in enumerate(self.tree.get_children()[start:], start=start + 1):
+            self.tree.set(iid, "idx", i)
+
     def _add_feature(self):
-        row = ttk.Frame(self.scroll_frame, relief="groove", borderwidth=1)
-        row.pack(fill="x", pady=3, padx=2)
         idx = len(self.features) + 1
-        
-        # State
-        type_var = tk.StringVar(value="A10 - Bore")
-        x_var, y_var = tk.StringVar(value="0.0"), tk.StringVar(value="0.0")
-        plane_var = tk.StringVar(value="0.1") 
-        d_var, e_var, h_var = [tk.StringVar(value="0.0") for _ in range(3)]
-        tol_var = tk.StringVar(value="") 
-        mac_var = tk.StringVar(value=str(900 + idx))
-        comment_var = tk.StringVar(value=f"Point {idx}")
-        
-        # UI Layout
-        top = ttk.Frame(row); top.pack(fill="x", padx=5, pady=2)
-        ttk.Label(top, text=f"#{idx}", font=("Segoe UI", 9, "bold")).pack(side="left")
-        cb = ttk.Combobox(top, textvariable=type_var, values=list(self.cycle_specs.keys()), state="readonly", width=18)
-        cb.pack(side="left", padx=5)
-        ttk.Entry(top, textvariable=comment_var, width=20).pack(side="left", fill="x", expand=True, padx=2)
-        ttk.Button(top, text="✖", width=3, command=lambda r=row: self._remove_feature(r)).pack(side="right")
-        
-        mid = ttk.Frame(row); mid.pack(fill="x", padx=5, pady=2)
-        ttk.Label(mid, text="X:").pack(side="left")
-        ttk.Entry(mid, textvariable=x_var, width=7).pack(side="left", padx=2)
-        ttk.Label(mid, text="Y:").pack(side="left")
-        ttk.Entry(mid, textvariable=y_var, width=7).pack(side="left", padx=2)
-        ttk.Label(mid, text="Plane Z:").pack(side="left")
-        ttk.Entry(mid, textvariable=plane_var, width=7).pack(side="left", padx=2)
-
-        args_f = ttk.Frame(row); args_f.pack(fill="x", padx=5, pady=2)
-        entries = {}
-        for char, var in [("D", d_var), ("E", e_var), ("H", h_var)]:
-            ttk.Label(args_f, text=f"{char}:").pack(side="left")
-            ent = ttk.Entry(args_f, textvariable=var, width=7)
-            ent.pack(side="left", padx=2)
-            entries[char] = ent
-
-        bot = ttk.Frame(row); bot.pack(fill="x", padx=5, pady=2)
-        ttk.Label(bot, text="Tol:").pack(side="left")
-        ttk.Entry(bot, textvariable=tol_var, width=8).pack(side="left", padx=2)
-        ttk.Label(bot, text="Target Macro: #").pack(side="left")
-        ttk.Entry(bot, textvariable=mac_var, width=6).pack(side="left", padx=2)
-
-        def update_locks(*args):
-            spec = self.cycle_specs[type_var.get()]
-            req = spec["req"]
-            for char, widget in entries.items():
-                widget.config(state="normal" if char in req else "disabled")
-        
-        type_var.trace_add("write", update_locks)
-        update_locks()
-
-        self.features.append({
-            "frame": row, "type": type_var, "x": x_var, "y": y_var, 
-            "plane": plane_var, "d": d_var, "e": e_var, "h": h_var, 
-            "tol": tol_var, "macro": mac_var, "comment": comment_var
-        })
-
-    def _remove_feature(self, frame):
-        if len(self.features) <= 1: return
-        for i, f in enumerate(self.features):
-            if f["frame"] == frame:
-                f["frame"].destroy()
-                self.features.pop(i)
-                break
+        alloc_mac = self.macros.allocate(owner=self)
+        feat = Feature(comment=f"Point {idx}", macro=str(alloc_mac), alloc=alloc_mac)
+
+        iid = f"F{self._next_iid}"
+        self._next_iid += 1
+        self.features.append(feat)
+        self._by_iid[iid] = feat
+        self.tree.insert("", "end", iid=iid, values=self._row_values(idx, feat))
+        self.tree.see(iid)
+        self._schedule_preview()
+
+    def _remove_selected(self):
+        self._end_edit(commit=False)
+        doomed = set(self.tree.selection())
+        if not doomed or len(doomed) >= len(self.features): return
+        first = min(self.tree.index(iid) for iid in doomed)
+        for iid in doomed:
+            feat = self._by_iid.pop(iid)
+            if feat.alloc is not None:
+                self.macros.release(feat.alloc)
+        self.tree.delete(*doomed)
+        self.features = [self._by_iid[iid] for iid in self.tree.get_children()]
+        self._renumber(first)
+        self._schedule_preview()
 
     def _clear_features(self):
-        for f in self.features: f["frame"].destroy()
+        self._end_edit(commit=False)
+        self.tree.delete(*self.tree.get_children())
+        self.macros.release_owner(self)
+        self._var_block = None
+        self._bank_claims = []
         self.features = []
+        self._by_iid = {}
         self._add_feature()
 
+    def _optimize_order(self):
+        """Reorders unpinned features to shorten XY rapid travel."""
+        self._end_edit(commit=True)
+        points = [{"x": f.x, "y": f.y, "pinned": f.pinned, "iid": iid}
+                  for iid, f in zip(self.tree.get_children(), self.features)]
+        try:
+            ordered, before, after = SEQ.reorder_features(points)
+        except ValueError as e:
+            messagebox.showerror("Sequencing Error", str(e))
+            return
+
+        iids = [p["iid"] for p in ordered]
+        self.tree.set_children("", *iids)
+        self.features = [self._by_iid[iid] for iid in iids]
+        self._renumber()
+        saved = (1 - after / before) * 100 if before else 0.0
+        self.seq_status.set(f"XY travel: {before:.3f} -> {after:.3f} ({saved:.1f}% shorter)")
+        self._schedule_preview()
+
+    # --- In-place editing ---
+
+    def _on_scroll(self, first, last):
+        # Editor is placed in tree coordinates; drop it when rows move underneath
+        self._end_edit(commit=True)
+        self.scrollbar.set(first, last)
+
+    def _begin_edit(self, event):
+        self._end_edit(commit=True)
+        iid = self.tree.identify_row(event.y)
+        col = self.tree.identify_column(event.x)
+        if not iid or not col: return
+        field = COLUMNS[int(col[1:]) - 1][0]
+        if field == "idx": return
+
+        feat = self._by_iid[iid]
+        if field == "pinned":
+            feat.pinned = not feat.pinned
+            self.tree.set(iid, "pinned", PIN_MARK if feat.pinned else "")
+            return
+        req = self.cycle_specs[feat.cycle]["req"]
+        if field in ARG_FIELDS and field.upper() not in req:
+            self.bell()
+            return
+
+        bbox = self.tree.bbox(iid, col)
+        if not bbox: return
+        x, y, w, h = bbox
+        var = tk.StringVar(value=getattr(feat, field))
+        if field == "cycle":
+            editor = ttk.Combobox(self.tree, textvariable=var, values=list(self.cycle_specs.keys()), state="readonly")
+            editor.bind("<<ComboboxSelected>>", lambda e: self._end_edit(commit=True))
+        else:
+            editor = ttk.Entry(self.tree, textvariable=var)
+            editor.select_range(0, tk.END)
+        editor.place(x=x, y=y, width=max(w, 60), height=h)
+        editor.focus_set()
+        editor.bind("<Return>", lambda e: self._end_edit(commit=True))
+        editor.bind("<Escape>", lambda e: self._end_edit(commit=False))
+        if field != "cycle":
+            # The combobox popdown steals focus, so only entries commit on focus loss
+            editor.bind("<FocusOut>", lambda e: self._end_edit(commit=True))
+        self._editor = (editor, var, iid, field)
+
+    def _end_edit(self, commit=True):
+        if self._editor is None: return
+        editor, var, iid, field = self._editor
+        self._editor = None
+        feat = self._by_iid.get(iid)
+        if commit and feat is not None:
+            value = var.get().strip() if field != "comment" else var.get()
+            if field != "macro" or self._claim_edit(feat, value):
+                setattr(feat, field, value)
+                self.tree.item(iid, values=self._row_values(self.tree.index(iid) + 1, feat))
+                self._schedule_preview()
+        editor.destroy()
+
+    def _claim_edit(self, feat, text):
+        """Moves the feature's allocator claim to a typed macro; False (edit rejected) if it cannot be claimed."""
+        num = macro_alloc.parse_macro(text)
+        if num == feat.alloc: return True
+        if num is not None and not self.macros.claim(num, owner=self):
+            why = "outside the Haas user macro ranges" if not self.macros.is_legal(num) else "already in use"
+            messagebox.showwarning("Result Macro", f"#{num} is {why}. The macro was not changed.")
+            return False
+        if feat.alloc is not None:
+            self.macros.release(feat.alloc)
+        feat.alloc = num
+        return True
+
+    def macro_claims(self):
+        """Macro numbers used by this tab, keyed per feature (and per extra part bank) for the session audit."""
+        claims = {f"Measure Features #{i+1}": [f.macro] for i, f in enumerate(self.features)}
+        try:
+            banks = NC.bank_macros([f.macro for f in self.features], *self._part_opts())
+        except ValueError:
+            banks = []  # the generator reports bad part settings
+        for k, bank in enumerate(banks[1:], start=2):
+            claims[f"Measure Features part {k}"] = bank
+        return claims
+
+    def project_state(self):
+        """Settings and feature models for the project file."""
+        self._end_edit(commit=True)
+        return {"settings": project.read_vars(self, PROJECT_VARS), "features": list(self.features)}
+
+    def load_project(self, section):
+        """Replaces settings and the feature list with a loaded project section."""
+        project.write_vars(self, PROJECT_VARS, section["settings"])
+        features = section.get("features")
+        if features is None: return
+        self._end_edit(commit=False)
+        self._cancel_generate()
+        self.tree.delete(*self.tree.get_children())
+        self.macros.release_owner(self)
+        self._var_block = None
+        self._bank_claims = []
+        for feat in features:
+            num = macro_alloc.parse_macro(feat.macro)
+            feat.alloc = num if num is not None and self.macros.claim(num, owner=self) else None
+
+        self.features = list(features)
+        self._by_iid = {}
+        for i, feat in enumerate(self.features, start=1):
+            iid = f"F{self._next_iid}"
+            self._next_iid += 1
+            self._by_iid[iid] = feat
+            self.tree.insert("", "end", iid=iid, values=self._row_values(i, feat))
+        if not self.features:
+            self._add_feature()
+        self._preview_blocks = None
+        self._schedule_preview()
+
+    def _collect_params(self):
+        """Global params + feature list in the shape the Brain expects."""
+        return {
+            "t_num": self.tool_var.get(),
+            "wcs": self.work_var.get(),
+            "is_ext": self.is_ext_var.get(),
+            "z_clr": self.clearance_z.get(),
+            "z_protect": self.protected_z.get(),
+            "features": [f.to_generator(self.cycle_specs[f.cycle]["key"]) for f in self.features]
+        }
+
+    def _part_opts(self):
+        """(parts, is_ext, bank_stride) as typed; parts None = single part."""
+        return (self.parts_var.get().strip() or None, self.is_ext_var.get(),
+                self.bank_stride_var.get().strip() or None)
+
+    def _link_opts(self):
+        """Linking generator options: safe-height regions (None = clearance/protect around every feature) and feed."""
+        regions = self.regions_var.get().strip() if self.linking_var.get() else ""
+        return {"linking": regions or None, "protect_feed": self.protect_feed_var.get().strip() or "50."}
+
+    def _link_summary(self, params, gen_opts):
+        """Status text: time the linked program saves over the classic clearance/protect moves."""
+        classic = {k: v for k, v in gen_opts.items() if k not in ("linking", "protect_feed")}
+        saved = cycle_time.saved_seconds(NC.iter_feature_sequence(params, **classic),
+                                         NC.iter_feature_sequence(params, **gen_opts))
+        return f"linking saves {cycle_time.format_seconds(saved)}"
+
+    def _reserve_banks(self, params):
+        """
+        Claims the result banks of parts 2..n in the session allocator, so new features
+        and the auto variable table never land in them. Returns generator options.
+        """
+        parts, is_ext, stride = self._part_opts()
+        banks = NC.bank_macros([f["macro"] for f in params["features"]], parts, is_ext, stride)
+        taken = {int(m) for bank in banks[1:] for m in bank}
+        for num in self._bank_claims: self.macros.release(num)
+        if self._var_block is not None and taken.intersection(self._var_block):
+            for num in self._var_block: self.macros.release(num)
+            self._var_block = None
+        self._bank_claims = [n for n in sorted(taken) if self.macros.claim(n, owner=self)]
+        return {"parts": parts, "bank_stride": stride}
+
+    def _var_table(self, params):
+        """Variable table base (None when off): user-set, else an auto-allocated block sized to the checks."""
+        if not self.var_file_var.get():
+            return None
+        count = max(1, NC.variable_table_size(params["features"]))
+        manual = self.var_base_var.get().replace("#", "").strip()
+        if manual or (self._var_block is not None and len(self._var_block) != count):
+            for num in self._var_block or (): self.macros.release(num)
+            self._var_block = None
+        if manual:
+            return int(manual)
+        if self._var_block is None:
+            self._var_block = self.macros.allocate_block(owner=self, count=count)
+        return self._var_block.start - 1
+
+    def _save_var_file(self):
+        if not self._var_lines:
+            messagebox.showinfo("Variable File", "Generate with 'Nominals/Tols in variable file' checked first.")
+            return
+        path = filedialog.asksaveasfilename(defaultextension=NC.VARIABLE_FILE_EXT,
+                                            filetypes=[("Haas macro variables", f"*{NC.VARIABLE_FILE_EXT}"),
+                                                       ("All files", "*.*")])
+        if not path: return
+        try:
+            with open(path, "w", newline="\n") as fh:
+                NC.write_program(self._var_lines, fh)
+        except OSError as e:
+            messagebox.showerror("Variable File", str(e))
+
+    def _save_skeleton(self):
+        """Factored programs call the skeleton with G65; it goes on the control as its own program."""
+        if not self._skel_lines:
+            messagebox.showinfo("Skeleton", "Generate with 'Factor features into G65 sub' checked first.")
+            return
+        path = filedialog.asksaveasfilename(defaultextension=".nc", initialfile=f"{self._skel_lines[1].split()[0]}.nc",
+                                            filetypes=[("NC programs", "*.nc"), ("All files", "*.*")])
+        if not path: return
+        try:
+            with open(path, "w", newline="\n") as fh:
+                NC.write_program(self._skel_lines, fh)
+        except OSError as e:
+            messagebox.showerror("Skeleton", str(e))
+
     def _generate(self):
         if not self.features: return
+        # 1. Build Params for Brain (Tk variables are only read here, on the Tk thread)
+        self._end_edit(commit=True)
+        params = self._collect_params()
+        try:
+            gen_opts = dict(self._reserve_banks(params), **self._link_opts())
+            var_table = self._var_table(params)
+            self._var_lines = NC.feature_variable_file(params, var_table) if var_table is not None else None
+        except ValueError as e:
+            messagebox.showerror("Generator Error", str(e))
+            return
+        opts = dict(full_pgm=self.post_header_var.get(),
+                    pgm_num=self.program_num_var.get(),
+                    use_m99=self.use_m99_var.get(),
+                    factored=self.factored_var.get(),
+                    var_table=var_table,
+                    lookahead="scoped" if self.scoped_var.get() else "routine",
+                    **gen_opts)
+        try:
+            self._skel_lines = NC.feature_skeleton(params, pgm_num=opts["pgm_num"], parts=gen_opts["parts"],
+                                                   linking=gen_opts["linking"], protect_feed=gen_opts["protect_feed"],
+                                                   lookahead=opts["lookahead"]) if opts["factored"] else None
+        except ValueError as e:
+            messagebox.showerror("Generator Error", str(e))
+            return
+        optimize = self.peephole_var.get()
+
+        # 2. Brain runs on a worker thread; post-passes too
+        def post(lines):
+            status = ""
+            if optimize:
+                lines, saved = peephole.optimize(lines)
+                status = "  |  " + peephole.summary(saved)
+            if gen_opts["linking"]:
+                status += "  |  " + self._link_summary(params, gen_opts)
+            return lines, cycle_time.summary(self._estimate(params, lines, opts["factored"], gen_opts)) + status
+
+        self._cancel_generate()
+        self._preview_blocks = None  # text no longer matches the block layout
+        self.cancel_btn.config(state="normal")
+        self._job = background.GenerationJob(
+            self, self.out, lambda: program_cache.feature_sequence(params, **opts), post,
+            on_status=self.time_var.set, on_done=self._generate_done, on_error=self._generate_failed).start()
+
+    def _cancel_generate(self):
+        if self._job is not None and self._job.running:
+            self._job.cancel()
+        self.cancel_btn.config(state="disabled")
+
+    def _generate_done(self, lines, status):
+        self.cancel_btn.config(state="disabled")
+        self.time_var.set(status)
+
+    def _generate_failed(self, e):
+        self.cancel_btn.config(state="disabled")
+        self.time_var.set("")
+        messagebox.showerror("Generator Error", str(e))
+
+    # --- Live Preview ---
+
+    def _toggle_live(self):
+        self._preview_blocks = None
+        self._schedule_preview()
+
+    def _schedule_preview(self, *args):
+        """Debounces edits: the preview refreshes once typing/editing pauses."""
+        if not self.live_var.get(): return
+        if self._preview_job is not None:
+            self.after_cancel(self._preview_job)
+        self._preview_job = self.after(PREVIEW_DELAY_MS, self._refresh_preview)
+
+    def _refresh_preview(self):
+        self._preview_job = None
+        if not self.live_var.get() or not self.features: return
+        if self._job is not None and self._job.running: return  # don't fight the generator over the text
         try:
-            # 1. Build Feature List for Brain
-            feature_list = []
-            for f in self.features:
-                spec = self.cycle_specs[f['type'].get()]
-                feature_list.append({
-                    "cycle_key": spec["key"],
-                    "comment": f["comment"].get(),
-                    "x": f["x"].get(),
-                    "y": f["y"].get(),
-                    "plane": f["plane"].get(),
-                    "macro": f["macro"].get(),
-                    "tol": f["tol"].get(),
-                    "args": {
-                        "D": f["d"].get(),
-                        "E": f["e"].get(),
-                        "H": f["h"].get()
-                    }
-                })
-
-            # 2. Build Global Params
-            params = {
-                "t_num": self.tool_var.get(),
-                "wcs": self.work_var.get(),
-                "is_ext": self.is_ext_var.get(),
-                "z_clr": self.clearance_z.get(),
-                "z_protect": self.protected_z.get(),
-                "features": feature_list
-            }
-
-            # 3. Request G-code from Brain (All formatting logic now happens inside Brain)
-            lines = NC.generate_feature_sequence(
-                params, 
-                full_pgm=self.post_header_var.get(), 
+            params = self._collect_params()
+            gen_opts = dict(self._reserve_banks(params), **self._link_opts())
+            blocks = NC.feature_sequence_blocks(
+                params,
+                full_pgm=self.post_header_var.get(),
                 pgm_num=self.program_num_var.get(),
-                use_m99=self.use_m99_var.get()
+                use_m99=self.use_m99_var.get(),
+                cache=self._block_cache,
+                factored=self.factored_var.get(),
+                var_table=self._var_table(params),
+                lookahead="scoped" if self.scoped_var.get() else "routine",
+                **gen_opts
             )
-            
+        except Exception:
+            return  # half-typed input; keep the last good preview
+        status = ""
+        if self.peephole_var.get():
+            # The pass works across block boundaries, so the preview becomes one block
+            lines, saved = peephole.optimize(line for b in blocks for line in b)
+            blocks = [tuple(lines)]
+            status = "  |  " + peephole.summary(saved)
+        self._patch_output(blocks)
+        self.time_var.set(cycle_time.summary(self._estimate(params, (line for b in blocks for line in b),
+                                                            self.factored_var.get(), gen_opts)) + status)
+
+    def _estimate(self, params, lines, factored=False, gen_opts=None):
+        """Cycle time; factored output is timed from the expanded program (same motion)."""
+        if factored:
+            lines = NC.iter_feature_sequence(params, **(gen_opts or {}))
+        return cycle_time.estimate(lines)
+
+    def _patch_output(self, blocks):
+        """Rewrites only the line range covered by blocks that differ from what is shown."""
+        old = self._preview_blocks
+        if old is None:
             self.out.delete("1.0", tk.END)
-            self.out.insert(tk.END, "\n".join(lines))
-            
-        except Exception as e:
-            messagebox.showerror("Generator Error", str(e))
\ No newline at end of file
+            old = []
+
+        lo, n = 0, min(len(old), len(blocks))
+        while lo < n and old[lo] == blocks[lo]:
+            lo += 1
+        hi_old, hi_new = len(old), len(blocks)
+        while hi_old > lo and hi_new > lo and old[hi_old - 1] == blocks[hi_new - 1]:
+            hi_old -= 1
+            hi_new -= 1
+        self._preview_blocks = blocks
+        if lo == hi_old == hi_new: return
+
+        start = 1 + sum(len(b) for b in old[:lo])
+        stop = start + sum(len(b) for b in old[lo:hi_old])
+        text = "".join(line + "\n" for b in blocks[lo:hi_new] for line in b)
+        self.out.delete(f"{start}.0", f"{stop}.0")
+        self.out.insert(f"{start}.0", text)
+        self.out.see(f"{start}.0")
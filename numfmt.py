@@ -0,0 +1,219 @@
+"""
+ApexProbe | lib/numfmt.py
+Fixed-precision number formatting for Haas address words
+- Rounds to a fixed decimal count (4 inch / 3 metric), trims trailing zeros
+  and always keeps the decimal point: 6.0 -> "6.", 0.30000000000000004 -> "0.3".
+- Never emits exponents, NaN/inf or "-0."; values too large for the control raise ValueError.
+- fmt(): scalar fast path, memoized on the raw value (UI strings repeat a lot).
+- fmt_many(): whole columns / NumPy arrays, digits built with array arithmetic.
+- Both follow Python's correctly rounded % formatting, so they agree digit for digit.
+Run "python -m lib.numfmt" for a benchmark against the old f_dec.
+"""
+
+import importlib.util
+import math
+import sys
+import time
+
+# NumPy is only needed when arrays are passed in; imported on first use
+NUMPY_AVAILABLE = importlib.util.find_spec("numpy") is not None
+np = None
+
+DECIMALS = {"inch": 4, "metric": 3}
+PLACES = DECIMALS["inch"]
+# Significant digits allowed in one address word (integer + decimal part)
+MAX_DIGITS = 9
+CACHE_LIMIT = 8192
+
+_cache = {}
+# Per decimal count: % template (rstrip("0") trims it to "d." / "d.ddd"), scale to
+# integer units, and the largest magnitude that still prints in MAX_DIGITS digits
+_PCT = {p: f"%.{p}f" if p else "%.0f." for p in range(7)}
+_SCALE = {p: 10 ** p for p in range(7)}
+_LIMITS = {p: 10.0 ** (MAX_DIGITS - p) - 0.5 / 10 ** p for p in range(7)}
+
+
+def _numpy():
+    global np
+    if np is None:
+        import numpy
+        np = numpy
+    return np
+
+
+def set_units(units):
+    """'inch' or 'metric': sets the default decimal count for every generator."""
+    global PLACES
+    PLACES = DECIMALS[units]
+    _cache.clear()
+
+
+def _illegal(value, places):
+    return ValueError(f"'{value}' is not a legal Haas number ({places} decimals, {MAX_DIGITS} digits max)")
+
+
+def _fixed(v, places, raw):
+    if not -_LIMITS[places] < v < _LIMITS[places]:  # also rejects NaN
+        raise _illegal(raw, places)
+    s = (_PCT[places] % v).rstrip("0")
+    return "0." if s == "-0." else s
+
+
+def _format(value, places):
+    if isinstance(value, str):
+        s = value.strip()
+        if not s:
+            return "0."
+        if s[0] in "#[":
+            return s  # macro variable / expression: the control evaluates it
+        try:
+            v = float(s)
+        except ValueError:
+            raise ValueError(f"'{value}' is not a number")
+        return _fixed(v, places, value)
+    return _fixed(float(value), places, value)
+
+
+def fmt(value, places=None):
+    """One value -> Haas number string at places decimals (default: current units)."""
+    p = PLACES if places is None else places
+    if type(value) is float:
+        return _fixed(value, p, value)  # computed coordinates rarely repeat: skip the cache
+    key = (value, p)
+    try:
+        out = _cache.get(key)
+    except TypeError:
+        return _format(value, p)  # unhashable (e.g. a 0-d array)
+    if out is None:
+        out = _format(value, p)
+        if len(_cache) >= CACHE_LIMIT:
+            _cache.clear()
+        _cache[key] = out
+    return out
+
+
+def _fmt_array(a, places):
+    """
+    Vectorized fixed-point formatting: digits go into one byte matrix (leading /
+    trailing zeros become spaces), then a single bytes.replace + split makes the strings.
+    """
+    limit = _LIMITS[places]
+    with np.errstate(invalid="ignore"):
+        bad = ~(np.abs(a) < limit)  # also catches NaN
+    if bad.any():
+        raise _illegal(a[bad.argmax()], places)
+
+    scale = _SCALE[places]
+    scaled = a * scale
+    q = np.rint(scaled).astype(np.int64)
+    # a * scale itself rounds; within a few ulps of a .5 the digit could differ from
+    # %-formatting, so those (rare) values are settled by % itself
+    near = np.abs(np.abs(scaled - np.trunc(scaled)) - 0.5) <= 4 * np.spacing(np.abs(scaled))
+    if near.any():
+        idx = np.flatnonzero(near)
+        q[idx] = [round(float(_PCT[places].rstrip(".") % v) * scale) for v in a[idx].tolist()]
+
+    m = np.abs(q)
+    ip, fp = np.divmod(m, scale)
+    n_int = MAX_DIGITS - places
+    width = 1 + n_int + 1 + places + 1  # sign, integer digits, point, decimals, newline
+    mat = np.full((len(a), width), ord(" "), dtype=np.uint8)
+    mat[q < 0, 0] = ord("-")
+    for k in range(n_int):
+        div = 10 ** (n_int - 1 - k)
+        col = (ip // div) % 10 + ord("0")
+        if k < n_int - 1:
+            col[ip < div] = ord(" ")  # leading zero; the units digit always prints
+        mat[:, 1 + k] = col
+    mat[:, 1 + n_int] = ord(".")
+    for j in range(places):
+        div = 10 ** (places - 1 - j)
+        col = (fp // div) % 10 + ord("0")
+        col[fp % (div * 10) == 0] = ord(" ")  # this digit and everything after it are zero
+        mat[:, 2 + n_int + j] = col
+    mat[:, -1] = ord("\n")
+    return mat.tobytes().replace(b" ", b"").decode("ascii").split("\n")[:-1]
+
+
+def fmt_many(values, places=None):
+    """
+    Sequence or NumPy array -> list of Haas number strings, same digits as fmt().
+    Numeric columns are formatted in one vectorized pass; columns holding blanks or
+    macro expressions (or no NumPy installed) fall back to fmt() per value.
+    """
+    p = PLACES if places is None else places
+    if not NUMPY_AVAILABLE:
+        return [fmt(v, p) for v in values]
+    _numpy()
+    try:
+        a = np.asarray(values, dtype=float).ravel()
+    except (TypeError, ValueError):
+        return [fmt(v, p) for v in values]
+    if not len(a):
+        return []
+    return _fmt_array(a, p)
+
+
+# --- Benchmark ---
+
+def _legacy_f_dec(value):
+    """The pre-numfmt codes.f_dec, kept only as the benchmark baseline."""
+    try:
+        s = str(value).strip()
+        if not s:
+            return "0."
+        return s if "." in s else f"{s}."
+    except:
+        return "0."
+
+
+def _naive(value, places):
+    """Straightforward per-value fixed precision: what a normalizing f_dec would cost."""
+    s = ("%.*f" % (places, float(value))).rstrip("0")
+    return "0." if s == "-0." else s
+
+
+def benchmark(n=100_000, places=4, seed=1, repeat=5):
+    """
+    Times the old f_dec, a per-value fixed-precision baseline, fmt() and fmt_many()
+    on n random coordinates (best of repeat). Returns [(name, seconds)].
+    """
+    import random
+    rng = random.Random(seed)
+    floats = [rng.uniform(-50.0, 50.0) for _ in range(n)]
+    strings = [f"{v:.6f}" for v in floats]
+    typed = [strings[i % 500] for i in range(n)]  # UI columns: few distinct values, many repeats
+    results = []
+
+    def clock(name, fn, *args):
+        best = None
+        for _ in range(repeat):
+            _cache.clear()
+            t = time.perf_counter()
+            fn(*args)
+            t = time.perf_counter() - t
+            best = t if best is None else min(best, t)
+        results.append((name, best))
+
+    clock("f_dec (old, no rounding)", lambda vs: [_legacy_f_dec(v) for v in vs], strings)
+    clock("per-value % baseline", lambda vs: [_naive(v, places) for v in vs], strings)
+    clock("fmt, unique strings", lambda vs: [fmt(v, places) for v in vs], strings)
+    clock("fmt, repeated strings", lambda vs: [fmt(v, places) for v in vs], typed)
+    clock("fmt, floats", lambda vs: [fmt(v, places) for v in vs], floats)
+    clock("fmt_many, strings", fmt_many, strings, places)
+    clock("fmt_many, floats", fmt_many, floats, places)
+    if NUMPY_AVAILABLE:
+        clock("fmt_many, ndarray", fmt_many, _numpy().array(floats), places)
+    _cache.clear()
+
+    assert fmt_many(floats, places) == [_format(v, places) for v in floats]
+    return results
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    timings = benchmark(count)
+    base = timings[1][1]  # speedups are against the per-value fixed-precision baseline
+    print(f"{count:,} coordinates")
+    for name, sec in timings:
+        print(f"  {name:<24}{sec * 1000:9.1f} ms  {base / sec:5.1f}x")
@@ -0,0 +1,199 @@
+"""
+ApexProbe | lib/patterns.py
+Point-pattern generators for the flatness tab
+- Rectangular grid (with edge margin), bolt circle, polyline stations, Poisson disc.
+- Every generator returns an (n, 2) float array; dedupe() drops coincident points.
+- Built on NumPy: thousands of points come back in one call, no per-point Tk work.
+"""
+
+import math
+
+from lib import numfmt as NF
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+# Points closer than this (inch) are treated as the same point
+DEDUPE_TOL = 0.0001
+
+
+def _need_numpy():
+    if not NUMPY_AVAILABLE:
+        raise RuntimeError("Point patterns need NumPy (pip install numpy).")
+
+
+def grid(x_min, x_max, y_min, y_max, nx, ny, margin=0.0):
+    """nx x ny grid inside the bounds inset by margin, in serpentine (zig-zag) order."""
+    _need_numpy()
+    if nx < 1 or ny < 1:
+        raise ValueError("Grid needs at least 1 column and 1 row.")
+    x0, x1 = min(x_min, x_max) + margin, max(x_min, x_max) - margin
+    y0, y1 = min(y_min, y_max) + margin, max(y_min, y_max) - margin
+    if x0 > x1 or y0 > y1:
+        raise ValueError("Margin is larger than the plate.")
+    xs = np.linspace(x0, x1, nx) if nx > 1 else np.array([(x0 + x1) / 2])
+    ys = np.linspace(y0, y1, ny) if ny > 1 else np.array([(y0 + y1) / 2])
+    gx, gy = np.meshgrid(xs, ys)
+    gx[1::2] = gx[1::2, ::-1]  # every other row runs backwards
+    return np.column_stack((gx.ravel(), gy.ravel()))
+
+
+def polar(cx, cy, radius, count, start_deg=0.0, rings=1):
+    """Bolt circle of count points; rings > 1 adds evenly spaced inner circles."""
+    _need_numpy()
+    if count < 1 or rings < 1:
+        raise ValueError("Bolt circle needs at least 1 point and 1 ring.")
+    radii = np.linspace(radius / rings, radius, rings)
+    ang = np.radians(start_deg + 360.0 * np.arange(count) / count)
+    r = np.repeat(radii, count)
+    a = np.tile(ang, rings)
+    return np.column_stack((cx + r * np.cos(a), cy + r * np.sin(a)))
+
+
+def parse_vertices(text):
+    """'0,0; 4,0; 4,3' -> [(0.0, 0.0), (4.0, 0.0), (4.0, 3.0)]"""
+    verts = []
+    for chunk in str(text).replace("\n", ";").split(";"):
+        if not chunk.strip(): continue
+        parts = chunk.replace(" ", ",").split(",")
+        nums = [float(p) for p in parts if p.strip()]
+        if len(nums) != 2:
+            raise ValueError(f"Vertex '{chunk.strip()}' must be X,Y.")
+        verts.append((nums[0], nums[1]))
+    return verts
+
+
+def polyline(vertices, spacing):
+    """Stations every spacing along an open polyline, both end points included."""
+    _need_numpy()
+    v = np.asarray(parse_vertices(vertices) if isinstance(vertices, str) else vertices, dtype=float)
+    if len(v) < 2:
+        raise ValueError("Polyline needs at least 2 vertices.")
+    if spacing <= 0:
+        raise ValueError("Polyline spacing must be positive.")
+    seg = np.hypot(*np.diff(v, axis=0).T)
+    s = np.concatenate(([0.0], np.cumsum(seg)))
+    stations = np.arange(0.0, s[-1], spacing)
+    stations = np.append(stations, s[-1])
+    return np.column_stack((np.interp(stations, s, v[:, 0]), np.interp(stations, s, v[:, 1])))
+
+
+def poisson_disc(x_min, x_max, y_min, y_max, radius, seed=None, k=30, limit=20000):
+    """
+    Bridson Poisson-disc sampling: random points no closer than radius.
+    Each step draws k candidates around one active sample and tests them against
+    an 11x11 window of the background grid in a single vectorized pass.
+    Points are handled as complex numbers to keep the per-step NumPy calls few.
+    """
+    _need_numpy()
+    if radius <= 0:
+        raise ValueError("Poisson disc spacing must be positive.")
+    x0, y0 = min(x_min, x_max), min(y_min, y_max)
+    w, h = abs(x_max - x_min), abs(y_max - y_min)
+    rng = np.random.default_rng(seed)
+    cell = radius / math.sqrt(2)
+    gw, gh = int(w / cell) + 1, int(h / cell) + 1
+    reach = 5  # candidates sit within 2r of the sample, their neighbours within 3r
+    grid_idx = np.full((gh + 2 * reach, gw + 2 * reach), -1, dtype=np.intp)
+    pts = np.empty(min(limit, gw * gh), dtype=complex)
+
+    def place(p, n):
+        pts[n] = p
+        grid_idx[int(p.imag / cell) + reach, int(p.real / cell) + reach] = n
+
+    def offsets(batch=1024):
+        # Annulus r..2r, drawn in bulk
+        ring = radius * (1 + rng.random((batch, k))) * np.exp(2j * np.pi * rng.random((batch, k)))
+        return iter(ring)
+
+    place(complex(rng.random() * w, rng.random() * h), 0)
+    n, active, ring = 1, [0], offsets()
+    while active and n < len(pts):
+        i = int(rng.integers(len(active)))
+        base = pts[active[i]]
+        off = next(ring, None)
+        if off is None:
+            ring = offsets()
+            off = next(ring)
+        cand = base + off
+        cand = cand[(cand.real >= 0) & (cand.real <= w) & (cand.imag >= 0) & (cand.imag <= h)]
+
+        gx, gy = int(base.real / cell) + reach, int(base.imag / cell) + reach
+        near = grid_idx[gy - reach:gy + reach + 1, gx - reach:gx + reach + 1]
+        near = pts[near[near >= 0]]
+        if len(cand):
+            ok = np.abs(cand[:, None] - near[None, :]).min(axis=1) >= radius
+            cand = cand[ok]
+        if len(cand):
+            place(cand[0], n)
+            active.append(n)
+            n += 1
+        else:
+            active[i] = active[-1]
+            active.pop()
+    return np.column_stack((pts[:n].real + x0, pts[:n].imag + y0))
+
+
+def dedupe(xy, existing=None, tol=DEDUPE_TOL):
+    """Drops points within tol of an earlier point (or of any existing point); keeps order."""
+    _need_numpy()
+    xy = np.asarray(xy, dtype=float).reshape(-1, 2)
+    n_old = 0
+    if existing is not None and len(existing):
+        old = np.asarray(existing, dtype=float).reshape(-1, 2)
+        n_old = len(old)
+        xy = np.vstack((old, xy))
+    keys = np.round(xy / tol).astype(np.int64)
+    _, first = np.unique(keys, axis=0, return_index=True)
+    keep = np.sort(first)
+    return xy[keep[keep >= n_old]]
+
+
+def format_points(xy, places=None):
+    """(n, 2) array -> [(x_str, y_str)] in Haas number format (lib/numfmt.py)."""
+    xy = np.asarray(xy, dtype=float).reshape(-1, 2)
+    return list(zip(NF.fmt_many(xy[:, 0], places), NF.fmt_many(xy[:, 1], places)))
+
+
+# Pattern registry: name -> (generator, [(arg, label, type, default)])
+PATTERNS = {
+    "Grid": (grid, [
+        ("x_min", "X Min", float, "-5.0"), ("x_max", "X Max", float, "5.0"),
+        ("y_min", "Y Min", float, "-5.0"), ("y_max", "Y Max", float, "5.0"),
+        ("nx", "Columns", int, "5"), ("ny", "Rows", int, "5"),
+        ("margin", "Edge Margin", float, "0.25"),
+    ]),
+    "Bolt Circle": (polar, [
+        ("cx", "Center X", float, "0.0"), ("cy", "Center Y", float, "0.0"),
+        ("radius", "Radius", float, "2.0"), ("count", "Count", int, "8"),
+        ("start_deg", "Start Deg", float, "0.0"), ("rings", "Rings", int, "1"),
+    ]),
+    "Polyline": (polyline, [
+        ("vertices", "X,Y; X,Y ...", str, "-4,-3; 4,-3; 4,3"),
+        ("spacing", "Spacing", float, "0.5"),
+    ]),
+    "Poisson Disc": (poisson_disc, [
+        ("x_min", "X Min", float, "-5.0"), ("x_max", "X Max", float, "5.0"),
+        ("y_min", "Y Min", float, "-5.0"), ("y_max", "Y Max", float, "5.0"),
+        ("radius", "Min Spacing", float, "0.75"), ("seed", "Seed", int, ""),
+    ]),
+}
+
+
+def build(name, raw):
+    """Runs a registered pattern from the strings typed in the UI ({arg: text})."""
+    func, spec = PATTERNS[name]
+    kwargs = {}
+    for arg, label, kind, _ in spec:
+        text = str(raw.get(arg, "")).strip()
+        if not text:
+            if kind is int and arg == "seed": continue
+            raise ValueError(f"{name}: '{label}' is empty.")
+        try:
+            kwargs[arg] = kind(float(text)) if kind is int else kind(text)
+        except ValueError:
+            raise ValueError(f"{name}: '{label}' must be a number.")
+    return func(**kwargs)
@@ -0,0 +1,249 @@
+"""
+ApexProbe | lib/peephole.py
+Peephole optimizer for generated programs
+- Tracks modal state (G00/G01, G90/G91, active WCS, G43 H, F) and known position.
+- Drops words that restate the modal state, and moves to where the tool already is.
+- Merges a modal-only block into the move that follows it, and collapses
+  back-to-back rapids along the same single axis.
+- Strips blank spacer lines.
+Anything it does not fully understand (macro expressions, IF/WHILE/GOTO,
+block delete, unknown G-codes, most G65 calls) passes through untouched and
+makes the tracked state unknown, so the pass never changes what the control does.
+"""
+
+import re
+
+# G65 calls that leave modal state alone (probe on / off)
+QUIET_CALLS = {9832, 9833}
+# G65 calls that move the machine: motion mode and position are unknown afterwards
+MOVING_CALLS = {9810, 9995}
+
+_WCS_G = set(range(54, 60)) | set(range(110, 130))
+_AXES = "XYZ"
+_TOKENS = re.compile(r"\s*([A-Z])([-+]?(?:\d+\.?\d*|\.\d+))")
+_COMMENT = re.compile(r"\(.*?\)")
+_LABEL_REF = re.compile(r"(?:GOTO\s*|M97\s*P)(\d+)")
+_LABEL = re.compile(r"^N(\d+)")
+
+
+def _parse(body):
+    """'G00 X1. Y2.' -> [('G', '00', 0.0), ...], or None if anything else is in the block."""
+    words, pos = [], 0
+    for m in _TOKENS.finditer(body):
+        if m.start() != pos: return None
+        words.append((m.group(1), m.group(2), float(m.group(2))))
+        pos = m.end()
+    return words if body[pos:].strip() == "" else None
+
+
+class _State:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.motion = self.dist = self.wcs = self.tlo = self.feed = None
+        self.pos = {a: None for a in _AXES}
+
+    def lose_position(self, axes=_AXES):
+        for a in axes:
+            self.pos[a] = None
+
+
+def _opaque(line, state):
+    """Updates state for a block the optimizer will not touch."""
+    up = line.upper()
+    if up.startswith(("/", "IF", "WHILE", "END", "GOTO", "%", "O", "M99", "M30", "M97", "M98")):
+        state.reset()
+    elif up.startswith("G65"):
+        m = re.search(r"P(\d+)", up)
+        call = int(m.group(1)) if m else None
+        if call in MOVING_CALLS:
+            state.motion = state.feed = None
+            state.lose_position()
+        elif call not in QUIET_CALLS:
+            state.reset()
+    elif not up.startswith("#"):
+        state.reset()
+
+
+def _groups(words):
+    """Modal groups set by a block: motion, distance, work offset."""
+    return {("M" if v in (0, 1) else "D" if v in (90, 91) else "W")
+            for l, _, v in words if l == "G" and v not in (43, 49, 103)}
+
+
+def optimize(lines):
+    """
+    Returns (optimized lines, stats). stats has blocks/bytes before and after
+    plus counts of blank lines, words and merged blocks removed.
+    """
+    lines = list(lines)
+    text = "\n".join(lines)
+    labels = set(_LABEL_REF.findall(text))
+    all_labels = "GOTO#" in text.replace(" ", "") or "GOTO[" in text.replace(" ", "")
+
+    stats = {"blocks_in": len(lines), "bytes_in": sum(len(l) + 1 for l in lines),
+             "blanks": 0, "words": 0, "merged": 0}
+    state = _State()
+    out, meta = [], []  # meta: parsed words of out[i] when it may still be merged, else None
+    pending = None      # modal-only words waiting for the next move
+
+    def flush_pending():
+        nonlocal pending
+        if pending is not None:
+            out.append(" ".join(l + t for l, t, _ in pending))
+            meta.append(None)
+            pending = None
+
+    for raw in lines:
+        line = raw.strip()
+        if not line:
+            stats["blanks"] += 1
+            continue
+
+        label = ""
+        m = _LABEL.match(line)
+        if m:
+            label = m.group(0)
+            if all_labels or m.group(1) in labels:
+                flush_pending()
+                state.reset()  # jump target: anything could be modal here
+
+        comment = " ".join(_COMMENT.findall(line))
+        body = _COMMENT.sub("", line[len(label):]).strip()
+        words = _parse(body.upper()) if body else []
+        gs = [] if words is None else [v for l, _, v in words if l == "G"]
+        ms = [] if words is None else [v for l, _, v in words if l == "M"]
+
+        if not words and not label:
+            flush_pending()
+            out.append(line)  # comment-only block
+            meta.append(None)
+            continue
+        if words is None or 65 in gs or any(v in (2, 30, 97, 98, 99) for v in ms):
+            flush_pending()
+            _opaque(line[len(label):].strip(), state)
+            out.append(line)
+            meta.append(None)
+            continue
+        if 28 in gs or 53 in gs:
+            # Home / machine moves: keep the block, forget the axes it touches
+            flush_pending()
+            for v in gs:
+                if v in (0, 1): state.motion = int(v)
+                if v in (90, 91): state.dist = int(v)
+            state.lose_position([l for l, _, _ in words if l in _AXES])
+            out.append(line)
+            meta.append(None)
+            continue
+        if any(v not in (0, 1, 43, 49, 90, 91, 103, 154) and int(v) not in _WCS_G for v in gs) \
+                or any(l not in "GXYZFHPMT" for l, _, _ in words) \
+                or (any(l == "P" for l, _, _ in words) and 154 not in gs and 103 not in gs):
+            flush_pending()
+            state.reset()
+            out.append(line)
+            meta.append(None)
+            continue
+
+        # --- Modal redundancy ---
+        h_val = next((v for l, _, v in words if l == "H"), None)
+        same_tlo = 43 in gs and h_val is not None and state.tlo == h_val
+        keep = []
+        skip_p = False
+        for n, (l, t, v) in enumerate(words):
+            if l == "P" and skip_p:
+                skip_p = False
+                continue
+            if l == "G" and v in (0, 1):
+                if state.motion == int(v): continue
+                state.motion = int(v)
+            elif l == "G" and v in (90, 91):
+                if state.dist == int(v): continue
+                state.dist = int(v)
+            elif l == "G" and (v == 154 or int(v) in _WCS_G):
+                key = int(v)
+                if v == 154:
+                    key = ("P", next((pv for pl, _, pv in words[n + 1:] if pl == "P"), None))
+                if state.wcs == key:
+                    skip_p = v == 154
+                    continue
+                state.wcs = key
+                state.lose_position()  # positions are relative to the old offset
+            elif l == "G" and v == 43:
+                if same_tlo: continue
+                state.tlo = h_val
+                state.lose_position("Z")
+            elif l == "H" and same_tlo:
+                continue
+            elif l == "G" and v == 49:
+                state.tlo = None
+                state.lose_position("Z")
+            elif l == "F":
+                if state.feed == v: continue
+                state.feed = v
+            elif l in _AXES:
+                if state.dist == 90 and state.pos[l] == v: continue
+                if state.dist == 90:
+                    state.pos[l] = v
+                elif state.dist == 91 and state.pos[l] is not None:
+                    state.pos[l] += v
+                else:
+                    state.pos[l] = None
+            elif l == "M" and v == 6:
+                state.tlo = None
+                state.lose_position()
+            keep.append((l, t, v))
+        stats["words"] += len(words) - len(keep)
+
+        if not keep:
+            if label:
+                flush_pending()
+                out.append(f"{label} {comment}".strip())
+                meta.append(None)
+            continue  # block only restated the current state
+
+        letters = {l for l, _, _ in keep}
+        modal_only = letters <= {"G", "P"} and all(l == "P" or v in (0, 1, 90, 91, 154) or int(v) in _WCS_G
+                                                     for l, _, v in keep)
+        if modal_only and not comment and not label:
+            flush_pending()
+            pending = keep
+            continue
+
+        moves = letters & set(_AXES)
+        plain = bool(moves) and letters <= {"G", "X", "Y", "Z", "F", "H", "P"}
+        if pending is not None:
+            if plain and not (_groups(pending) & _groups(keep)):
+                keep = pending + keep
+                stats["merged"] += 1
+                pending = None
+            else:
+                flush_pending()
+
+        # Collinear rapids: a lone single-axis G00 followed by another on the same axis
+        single = moves if len(moves) == 1 and letters <= {"G", "X", "Y", "Z"} and not label else None
+        rapid_abs = state.motion == 0 and state.dist == 90
+        if single and rapid_abs and meta and meta[-1] is not None and meta[-1][0] == single:
+            keep = [w for w in meta[-1][1] if w[0] == "G" and w not in keep] + keep
+            out.pop()
+            meta.pop()
+            stats["merged"] += 1
+
+        new = " ".join(l + t for l, t, _ in keep)
+        new = f"{label} {new}" if label else new
+        out.append(f"{new} {comment}" if comment else new)
+        meta.append((single, keep) if single and rapid_abs and not comment else None)
+
+    flush_pending()
+    stats["blocks_out"] = len(out)
+    stats["bytes_out"] = sum(len(l) + 1 for l in out)
+    return out, stats
+
+
+def summary(stats):
+    """One-line label text: what the pass saved."""
+    db = stats["blocks_in"] - stats["blocks_out"]
+    dc = stats["bytes_in"] - stats["bytes_out"]
+    pb = 100.0 * db / stats["blocks_in"] if stats["blocks_in"] else 0.0
+    pc = 100.0 * dc / stats["bytes_in"] if stats["bytes_in"] else 0.0
+    return f"Peephole: -{db} blocks ({pb:.0f}%), -{dc:,} bytes ({pc:.0f}%)"
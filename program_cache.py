@@ -0,0 +1,199 @@
+"""
+ApexProbe | lib/program_cache.py
+Content-addressed cache of generated programs
+- Key = sha256 of the generator name, codes.GENERATOR_VERSION, the number
+  format (decimals) and the normalized inputs. Numeric fields are keyed by
+  the exact number the generator reads, so "6", "6.0" and 6.0 share an entry
+  but "6.00004" and "6." do not, and a blank field never matches "0".
+- One <key>.nc file per program under ~/.apexprobe/programs, written atomically,
+  plus an optional <key>.json of facts about the build (batch: probing order,
+  travel and peephole stats) that cannot be recovered from the text.
+- A miss streams the build through and stores it only once it ran to the end,
+  so callers keep their progress and cancel; an abandoned build is not cached.
+- Least recently used entries are evicted once the cache exceeds MAX_ENTRIES
+  or MAX_BYTES; a hit refreshes the entry's mtime.
+"""
+
+import hashlib
+import json
+import os
+import threading
+
+from lib import codes as NC
+from lib import numfmt as NF
+
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".apexprobe", "programs")
+MAX_ENTRIES = 500
+MAX_BYTES = 64 * 1024 * 1024
+
+# Input fields whose value is a number in the program; keyed by the parsed float
+NUMERIC_KEYS = {
+    "x", "y", "plane", "tol", "tolerance", "nominal", "z_clr", "z_protect", "probe_plane",
+    "xpos", "ypos", "D", "E", "H", "d", "e", "h", "protect_feed",
+    "skip_feed", "skip_depth",
+}
+# Input fields that never reach the program as such. "pinned" only steers reordering:
+# a caller that reorders before generating keys the pins itself (see batch.py).
+IGNORED_KEYS = {"pinned", "alloc"}
+
+
+def _normalize(obj, key=None):
+    if isinstance(obj, dict):
+        return {str(k): _normalize(v, k) for k, v in obj.items() if k not in IGNORED_KEYS}
+    if isinstance(obj, (list, tuple)):
+        return [_normalize(v) for v in obj]
+    if key in NUMERIC_KEYS and isinstance(obj, (str, int, float)) and not isinstance(obj, bool):
+        return _number(obj)
+    return obj
+
+
+def _number(value):
+    """Key for a numeric field: the float it parses to, else the raw value (blanks, macro refs, bad input)."""
+    if isinstance(value, str) and (not value.strip() or value.strip()[0] in "#["):
+        return value  # blank means "use the default" to the generators, not 0
+    try:
+        return repr(float(value))
+    except ValueError:
+        return value  # the generator will reject it; key on the raw value
+
+
+def program_key(generator, params, options=None):
+    """Stable hex key for one program: same key <=> same output."""
+    doc = {
+        "generator": generator,
+        "version": NC.GENERATOR_VERSION,
+        "places": NF.PLACES,
+        "params": _normalize(params),
+        "options": _normalize(options or {}),
+    }
+    blob = json.dumps(doc, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()[:32]
+
+
+class ProgramCache:
+    """Finished programs on disk, keyed by program_key()."""
+
+    def __init__(self, root=CACHE_DIR, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES):
+        self.root = root
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = self.misses = 0
+
+    def _path(self, key, ext=".nc"):
+        return os.path.join(self.root, f"{key}{ext}")
+
+    def _write(self, path, text):
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8", newline="") as fh:
+            fh.write(text)
+        os.replace(tmp, path)
+
+    def get(self, key):
+        """Program text for key, or None."""
+        path = self._path(key)
+        try:
+            with open(path, encoding="utf-8", newline="") as fh:
+                text = fh.read()
+            os.utime(path)  # LRU: a hit counts as a use
+        except OSError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return text
+
+    def meta(self, key):
+        """The dict stored with key's program by put(..., meta=), or None."""
+        try:
+            with open(self._path(key, ".json"), encoding="utf-8") as fh:
+                return json.load(fh)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key, lines, meta=None):
+        """Stores lines (and meta, a JSON-able dict) under key and returns the program text."""
+        text = "".join(line + "\n" for line in lines)
+        try:
+            os.makedirs(self.root, exist_ok=True)
+            if meta is not None:
+                self._write(self._path(key, ".json"), json.dumps(meta))  # before the program: a hit finds both
+            self._write(self._path(key), text)
+            self.evict()
+        except OSError:
+            pass  # read-only home: generation still works, just uncached
+        return text
+
+    def lines(self, key, build):
+        """(lines, hit): cached program for key, else build() streamed through and stored once it completes."""
+        text = self.get(key)
+        if text is not None:
+            return text.split("\n")[:-1], True
+        return self._tee(key, build()), False
+
+    def _tee(self, key, lines):
+        kept = []
+        for line in lines:
+            kept.append(line)
+            yield line
+        self.put(key, kept)
+
+    def evict(self):
+        """Drops least recently used entries until both limits hold."""
+        entries = []
+        for name in os.listdir(self.root):
+            if not name.endswith(".nc"): continue
+            try:
+                st = os.stat(os.path.join(self.root, name))
+            except OSError:
+                continue  # removed by another process
+            entries.append((st.st_mtime, st.st_size, name))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        while entries and (len(entries) > self.max_entries or total > self.max_bytes):
+            _, size, name = entries.pop(0)
+            total -= size
+            for path in (os.path.join(self.root, name), self._path(name[:-3], ".json")):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def clear(self):
+        for name in os.listdir(self.root) if os.path.isdir(self.root) else []:
+            if name.endswith((".nc", ".json")):
+                os.remove(os.path.join(self.root, name))
+
+
+_default = None
+
+
+def default():
+    """Shared cache for the running app."""
+    global _default
+    if _default is None:
+        _default = ProgramCache()
+    return _default
+
+
+# --- Cached generators (same signatures as lib/codes.py, plus cache=) ---
+
+def feature_sequence(params, cache=None, **options):
+    """Lines on a hit; on a miss a lazy iterator, cached once it has been read to the end."""
+    cache = cache or default()
+    key = program_key("measure", params, options)
+    return cache.lines(key, lambda: NC.iter_feature_sequence(params, **options))[0]
+
+
+def toolpath(params, cache=None):
+    cache = cache or default()
+    return list(cache.lines(program_key("wips", params), lambda: NC.generate_toolpath(params))[0])
+
+
+def toolpath_chain(steps, cache=None):
+    cache = cache or default()
+    return list(cache.lines(program_key("wips_chain", {"steps": steps}), lambda: NC.generate_toolpath_chain(steps))[0])
+
+
+def flatness(params, cache=None, **options):
+    cache = cache or default()
+    key = program_key("flatness", params, options)
+    return cache.lines(key, lambda: NC.generate_flatness(params, **options))[0]
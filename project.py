@@ -0,0 +1,270 @@
+"""
+ApexProbe | lib/project.py
+Project files: Measure features, flatness points and every tab setting
+- Versioned JSON; model lists are stored column by column (one list per
+  field, cycle labels interned), so 10k features cost no per-row keys.
+- Validation runs over whole columns and reports every bad cell at once.
+- measure_job() / flatness_job() turn a loaded project straight into
+  generator arguments; no widgets are needed.
+"""
+
+import json
+import os
+
+from lib import codes as NC
+from lib import macro_alloc
+from lib.feature_model import Feature, FlatPoint
+
+FORMAT = "apexprobe-project"
+VERSION = 1
+EXT = ".apx"
+MAX_ERRORS = 25  # bad cells listed before the report is cut short
+
+# Settings saved per tab: project key -> default. Tabs map these to their Tk variables.
+MEASURE_SETTINGS = {
+    "t_num": "50", "wcs": "54", "is_ext": False, "z_clr": "6.0", "z_protect": "1.0",
+    "full_pgm": False, "pgm_num": "1234", "use_m99": False, "factored": False, "peephole": False,
+    "var_file": False, "var_base": "", "parts": "", "bank_stride": "",
+    "linking": False, "regions": "", "protect_feed": "50.", "scoped_lookahead": False,
+}
+FLATNESS_SETTINGS = {
+    "t_num": "50", "wcs": "54", "is_ext": False, "sac_wcs": "97", "sac_ext": True,
+    "z_clr": "6.0", "z_protect": "1.0", "probe_plane": "0.5", "tol": "0.001",
+    "tol_macro": "800", "min_macro": "801", "max_macro": "802", "dev_macro": "803",
+    "full_pgm": False, "pgm_num": "01234", "m30": False, "m99": True, "peephole": False,
+    "loop": False, "table_base": "", "var_file": False, "parts": "", "bank_stride": "",
+    "scoped_lookahead": False, "fast": False, "skip_feed": "30.", "skip_depth": "0.2", "protect_feed": "50.",
+}
+WIPS_SETTINGS = {
+    "t_num": "50", "wcs": "54", "is_ext": False, "full_pgm": False, "peephole": False,
+    "cycle": "A10 - Bore (Internal)", "xpos": "0.0", "ypos": "0.0", "probe_plane": "0.1",
+    "z_clr": "1.0", "z_protect": "0.5", "D": "1.0", "E": "1.0", "H": "-0.5",
+    "queue": [],  # chained cycles: collect_user_params dicts plus a "label"
+}
+SECTIONS = {"measure": MEASURE_SETTINGS, "flatness": FLATNESS_SETTINGS, "wips": WIPS_SETTINGS}
+
+# Columns that must hold a number (blank allowed where noted)
+_NUMERIC = {
+    "features": {"x": False, "y": False, "plane": False, "d": True, "e": True, "h": True, "tol": True},
+    "points": {"x": False, "y": False},
+}
+_MACRO_COLS = ("macro",)
+
+
+class ProjectError(ValueError):
+    """Raised with every problem found in a project file, one per line."""
+
+
+def new_project():
+    """Empty project with default settings for every tab."""
+    return {name: {"settings": dict(defaults)} for name, defaults in SECTIONS.items()}
+
+
+# --- Encoding ---
+
+def _encode_models(models, fields, intern=()):
+    cols = {"n": len(models)}
+    for f in fields:
+        values = [getattr(m, f) for m in models]
+        if f in intern:
+            table = list(dict.fromkeys(values))
+            index = {v: i for i, v in enumerate(table)}
+            cols[f + "_table"] = table
+            values = [index[v] for v in values]
+        elif values and isinstance(values[0], bool):
+            values = [int(v) for v in values]
+        cols[f] = values
+    return cols
+
+
+def dumps(project):
+    """Project dict (model lists) -> compact JSON text."""
+    doc = {"format": FORMAT, "version": VERSION}
+    for name in SECTIONS:
+        section = project.get(name)
+        if section is None: continue
+        out = {"settings": section.get("settings", {})}
+        if "features" in section:
+            out["features"] = _encode_models(section["features"], Feature.FIELDS, intern=("cycle",))
+        if "points" in section:
+            out["points"] = _encode_models(section["points"], FlatPoint.FIELDS)
+        doc[name] = out
+    return json.dumps(doc, separators=(",", ":"))
+
+
+def save(path, project):
+    """Writes atomically, so a failed save never truncates the previous file."""
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as fh:
+        fh.write(dumps(project))
+    os.replace(tmp, path)
+
+
+# --- Decoding / validation ---
+
+def _is_number(value, blank_ok):
+    s = str(value).strip()
+    if not s:
+        return blank_ok
+    try:
+        float(s)
+        return True
+    except ValueError:
+        return False
+
+
+def _decode_models(where, cols, cls, errors, intern=()):
+    """Columns -> model list. Bad cells are appended to errors, not raised one by one."""
+    n = cols.get("n")
+    if not isinstance(n, int) or n < 0:
+        errors.append(f"{where}: missing row count")
+        return []
+    fields = cls.FIELDS
+    data = {}
+    for f in fields:
+        values = cols.get(f)
+        if values is None:
+            values = [cls.__init__.__defaults__[fields.index(f)]] * n  # column added after this file was saved
+        if not isinstance(values, list) or len(values) != n:
+            errors.append(f"{where}: column '{f}' has {len(values) if isinstance(values, list) else 0} rows, expected {n}")
+            continue
+        if f in intern:
+            table = cols.get(f + "_table", [])
+            try:
+                values = [table[i] for i in values]
+            except (IndexError, TypeError):
+                errors.append(f"{where}: column '{f}' points outside its table")
+                continue
+        elif f == "pinned":
+            values = [bool(v) for v in values]
+        else:
+            values = ["" if v is None else str(v) for v in values]
+        data[f] = values
+    if len(data) != len(fields):
+        return []
+
+    for f, blank_ok in _NUMERIC.get(where, {}).items():
+        for i, v in enumerate(data[f]):
+            if not _is_number(v, blank_ok):
+                errors.append(f"{where} row {i + 1}: {f} '{v}' is not a number")
+    for f in _MACRO_COLS:
+        for i, v in enumerate(data.get(f, ())):
+            if str(v).strip() and macro_alloc.parse_macro(v) is None:
+                errors.append(f"{where} row {i + 1}: macro '{v}' is not a macro number")
+    if "cycle" in data:
+        known = {c["label"] for c in NC.CYCLES.values()}
+        for v in sorted(set(data["cycle"]) - known, key=str):
+            rows = [i + 1 for i, c in enumerate(data["cycle"]) if c == v]
+            errors.append(f"{where} row {rows[0]}: unknown cycle '{v}' ({len(rows)} rows)")
+
+    # Positional construction: one call per row, no per-field setattr
+    return [cls(*row) for row in zip(*(data[f] for f in fields))]
+
+
+def loads(text):
+    """JSON text -> project dict. Raises ProjectError listing every problem found."""
+    try:
+        doc = json.loads(text)
+    except ValueError as e:
+        raise ProjectError(f"Not a project file: {e}")
+    if not isinstance(doc, dict) or doc.get("format") != FORMAT:
+        raise ProjectError("Not an ApexProbe project file.")
+    if not isinstance(doc.get("version"), int) or doc["version"] > VERSION:
+        raise ProjectError(f"Project version {doc.get('version')} is newer than this app supports ({VERSION}).")
+
+    errors = []
+    project = new_project()
+    for name, defaults in SECTIONS.items():
+        section = doc.get(name)
+        if not isinstance(section, dict): continue
+        settings = section.get("settings", {})
+        project[name]["settings"].update({k: v for k, v in settings.items() if k in defaults})
+        if "features" in section:
+            project[name]["features"] = _decode_models("features", section["features"], Feature, errors,
+                                                       intern=("cycle",))
+        if "points" in section:
+            project[name]["points"] = _decode_models("points", section["points"], FlatPoint, errors)
+
+    if errors:
+        more = len(errors) - MAX_ERRORS
+        lines = errors[:MAX_ERRORS] + ([f"... and {more} more"] if more > 0 else [])
+        raise ProjectError("\n".join(lines))
+    return project
+
+
+def load(path):
+    with open(path, encoding="utf-8") as fh:
+        return loads(fh.read())
+
+
+# --- Generator import path ---
+
+def _auto_base(used, count):
+    """Base of a fresh contiguous block of count macros that avoids every macro in used."""
+    alloc = macro_alloc.MacroAllocator()
+    for raw in used:
+        num = macro_alloc.parse_macro(raw)
+        if num is not None: alloc.claim(num, owner="project")
+    return alloc.allocate_block("table", count).start - 1
+
+
+def measure_job(project):
+    """
+    (params, options) for codes.iter_feature_sequence / generate_feature_sequence.
+    With the variable file on, a blank table base is auto-allocated clear of every part's bank.
+    """
+    s = project["measure"]["settings"]
+    features = project["measure"].get("features", [])
+    params = {k: s[k] for k in ("t_num", "wcs", "is_ext", "z_clr", "z_protect")}
+    params["features"] = [f.to_generator(NC.CYCLE_KEYS[f.cycle]) for f in features]
+    parts, stride = s["parts"].strip() or None, s["bank_stride"].strip() or None
+    var_table = None
+    if s["var_file"]:
+        var_table = s["var_base"].replace("#", "").strip() or None
+        if var_table is None:
+            used = [m for bank in NC.bank_macros([f.macro for f in features], parts, s["is_ext"], stride) for m in bank]
+            var_table = _auto_base(used, max(1, NC.variable_table_size(params["features"])))
+    opts = {"full_pgm": s["full_pgm"], "pgm_num": s["pgm_num"], "use_m99": s["use_m99"], "factored": s["factored"],
+            "var_table": var_table, "parts": parts, "bank_stride": stride,
+            "linking": s["regions"].strip() or None if s["linking"] else None,
+            "protect_feed": s["protect_feed"].strip() or "50.",
+            "lookahead": "scoped" if s["scoped_lookahead"] else "routine"}
+    return params, opts
+
+
+def flatness_job(project):
+    """(params, options) for codes.generate_flatness. A blank loop table base is auto-allocated."""
+    s = project["flatness"]["settings"]
+    points = project["flatness"].get("points", [])
+    params = {k: s[k] for k in ("t_num", "wcs", "is_ext", "sac_wcs", "sac_ext", "z_clr", "z_protect", "probe_plane",
+                                "tol", "tol_macro", "min_macro", "max_macro", "dev_macro")}
+    params["points"] = [p.to_generator() for p in points]
+    term = "M30" if s["m30"] else "M99" if s["m99"] else None
+
+    parts, stride = s["parts"].strip() or None, s["bank_stride"].strip() or None
+    table_base = None
+    if s["loop"]:
+        table_base = s["table_base"].replace("#", "").strip() or None
+        if table_base is None:
+            banked = [s[k] for k in ("min_macro", "max_macro", "dev_macro")] + [p.macro for p in points]
+            used = [s["tol_macro"]] + [m for bank in NC.bank_macros(banked, parts, s["is_ext"], stride) for m in bank]
+            table_base = _auto_base(used, 2 * len(points))
+    opts = {"full_pgm": s["full_pgm"], "pgm_num": s["pgm_num"], "term": term, "loop": s["loop"],
+            "table_base": table_base, "var_file": s["var_file"],
+            "parts": parts, "bank_stride": stride, "lookahead": "scoped" if s["scoped_lookahead"] else "routine",
+            "fast": s["fast"], "skip_feed": s["skip_feed"], "skip_depth": s["skip_depth"],
+            "protect_feed": s["protect_feed"]}
+    return params, opts
+
+
+# --- Tk glue ---
+
+def read_vars(tab, var_map):
+    """{project key: tab Tk variable attribute} -> settings dict."""
+    return {key: getattr(tab, attr).get() for key, attr in var_map.items()}
+
+
+def write_vars(tab, var_map, settings):
+    for key, attr in var_map.items():
+        if key in settings:
+            getattr(tab, attr).set(settings[key])
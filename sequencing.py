@@ -0,0 +1,146 @@
+"""
+ApexProbe | lib/sequencing.py
+Probe-path sequencing: reorders features to shorten XY rapid travel
+- Nearest-neighbour construction followed by 2-opt segment reversal.
+- Pinned features keep their position in the sequence.
+- Distances come from a vectorized NumPy matrix when NumPy is installed.
+"""
+
+import math
+import time
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+# Path starts at part zero of the active WCS
+DEFAULT_START = (0.0, 0.0)
+
+
+def _coords(features):
+    try:
+        return [(float(f.get("x", 0) or 0), float(f.get("y", 0) or 0)) for f in features]
+    except ValueError as e:
+        raise ValueError(f"Sequencing needs numeric X/Y on every feature ({e})")
+
+
+def path_length(xy, order=None, start=DEFAULT_START):
+    """Total XY travel from start through the points in order."""
+    order = range(len(xy)) if order is None else order
+    total, (px, py) = 0.0, start
+    for i in order:
+        x, y = xy[i]
+        total += math.hypot(x - px, y - py)
+        px, py = x, y
+    return total
+
+
+def _distance_matrix(xy, start):
+    """(n+1)x(n+1) matrix; index n is the start point."""
+    pts = np.asarray(list(xy) + [start], dtype=float)
+    x, y = pts[:, 0], pts[:, 1]
+    return np.hypot(x[:, None] - x[None, :], y[:, None] - y[None, :])
+
+
+def _nearest_neighbour(n, pinned, dist, start_idx):
+    """Fills free slots greedily; pinned slots keep their original feature."""
+    free = [i for i in range(n) if i not in pinned]
+    order, cur = [], start_idx
+    if NUMPY_AVAILABLE:
+        remaining = np.zeros(n + 1, dtype=bool)
+        remaining[free] = True
+        for pos in range(n):
+            if pos in pinned:
+                cur = pos
+            else:
+                row = np.where(remaining, dist[cur], np.inf)
+                cur = int(row.argmin())
+                remaining[cur] = False
+            order.append(cur)
+        return order
+
+    remaining = set(free)
+    for pos in range(n):
+        if pos in pinned:
+            cur = pos
+        else:
+            cur = min(remaining, key=lambda j: dist(cur, j))
+            remaining.discard(cur)
+        order.append(cur)
+    return order
+
+
+def _two_opt(order, pinned, dist, start_idx, deadline):
+    """Vectorized 2-opt on an open path: reverses order[i..j] when that shortens it."""
+    n = len(order)
+    tour = np.asarray(order, dtype=np.intp)
+    # Reversals may not cross a pinned slot
+    locked = np.fromiter((p in pinned for p in range(n)), dtype=bool, count=n)
+    # Don't-look bits: only revisit slots whose neighbourhood changed
+    active = ~locked
+    improved = True
+    while improved and time.perf_counter() < deadline:
+        improved = False
+        for i in np.flatnonzero(active[:-1]).tolist():
+            active[i] = False
+            stop = i + 1
+            while stop < n and not locked[stop]:
+                stop += 1
+            if stop - i < 2: continue
+
+            a = tour[i - 1] if i > 0 else start_idx
+            b = tour[i]
+            cs = tour[i + 1:stop]                      # candidate segment ends j
+            es = tour[i + 2:stop + 1] if stop < n else np.append(tour[i + 2:stop], -1)
+            has_next = es >= 0
+            es_safe = np.where(has_next, es, cs)
+            delta = dist[a, cs] - dist[a, b]
+            delta = delta + np.where(has_next, dist[b, es_safe] - dist[cs, es_safe], 0.0)
+            k = int(delta.argmin())
+            if delta[k] < -1e-9:
+                j = i + 1 + k
+                tour[i:j + 1] = tour[i:j + 1][::-1].copy()
+                active[max(i - 1, 0):i + 2] = True
+                active[j:min(j + 2, n)] = True
+                active &= ~locked
+                improved = True
+            if time.perf_counter() >= deadline: break
+    return tour.tolist()
+
+
+def optimize_order(xy, pinned=(), start=DEFAULT_START, time_budget=0.8):
+    """
+    Returns (order, before, after) for a list of (x, y) points.
+    order is a permutation of indices; pinned indices stay where they are.
+    """
+    n = len(xy)
+    pinned = set(pinned)
+    before = path_length(xy, start=start)
+    if n < 3 or len(pinned) >= n - 1:
+        return list(range(n)), before, before
+
+    deadline = time.perf_counter() + time_budget
+    if NUMPY_AVAILABLE:
+        dist = _distance_matrix(xy, start)
+        order = _nearest_neighbour(n, pinned, dist, n)
+        order = _two_opt(order, pinned, dist, n, deadline)
+    else:
+        pts = list(xy) + [start]
+        order = _nearest_neighbour(n, pinned, lambda i, j: math.dist(pts[i], pts[j]), n)
+
+    after = path_length(xy, order, start=start)
+    if after >= before:
+        return list(range(n)), before, before
+    return order, before, after
+
+
+def reorder_features(features, start=DEFAULT_START, time_budget=0.8):
+    """
+    Sequencing stage for generator feature dicts (features with "pinned": True
+    keep their slot). Returns (reordered features, travel before, travel after).
+    """
+    pinned = [i for i, f in enumerate(features) if f.get("pinned")]
+    order, before, after = optimize_order(_coords(features), pinned, start, time_budget)
+    return [features[i] for i in order], before, after
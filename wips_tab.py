@@ -4,37 +4,36 @@ APEXPROBE | Virtual WIPS Tab (V11 "Golden Goose" Logic)
 Scope: 
 UI Layout preserved. Logic driven by lib/codes.py.
 Tabs page handles UI building and argument collection only.
-Housings for PNG cycle diagrams are managed here.
+Housings for PNG cycle diagrams are managed here; loading, scaling and
+caching of the diagrams lives in lib/image_cache.py.
+The cycle queue chains several single cycles into one program (one tool
+change, probe on once) via codes.generate_toolpath_chain.
 """
 
 import tkinter as tk
 from tkinter import ttk, messagebox
 from lib import codes as NC
-import os
+from lib import cycle_time
+from lib import image_cache
+from lib import peephole
+from lib import background
+from lib import project
+from lib import program_cache
 
-# Pillow is required for handling PNG/JPG diagrams in Tkinter
-try:
-    from PIL import Image, ImageTk
-    PILLOW_AVAILABLE = True
-except ImportError:
-    PILLOW_AVAILABLE = False
-    print("CRITICAL: Pillow library not found. Run 'pip install Pillow' in your terminal.")
+# Diagrams start loading this long after the tab is built (first paint comes first)
+DIAGRAM_DELAY_MS = 100
 
 
 # --- IMAGE MAPPING ---
-# This is the "Source of Truth" for visual cycle identification
-CYCLE_IMAGES = {
-    "A10 - Bore (Internal)": "bore.png",
-    "A11 - Boss (External)": "boss.png",
-    "A12 - Rectangular Pocket": "rect_pocket.png", 
-    "A13 - Rectangular Boss": "rect_boss.png",
-    "A14 - Web X": "web_x.png",
-    "A15 - Pocket X": "pocket_x.png",
-    "A16 - Web Y": "web_y.png",
-    "A17 - Pocket Y": "pocket_y.png",
-    "A20 - Surface Z": "surf_z.png",
-    "A20 - Surface X": "surf_x.png",
-    "A20 - Surface Y": "surf_y.png"
+# Derived from the cycle registry in lib/codes.py (the "Source of Truth")
+CYCLE_IMAGES = {c["wips_label"]: c["image"] for c in NC.CYCLES.values()}
+
+# Project file settings -> Tk variable attributes
+PROJECT_VARS = {
+    "t_num": "tool_var", "wcs": "work_var", "is_ext": "is_ext_var",
+    "full_pgm": "post_header_var", "peephole": "peephole_var", "cycle": "cycle_var",
+    "xpos": "x_pos", "ypos": "y_pos", "probe_plane": "probing_plane_z",
+    "z_clr": "clear_z", "z_protect": "prot_z", "D": "d_var", "E": "e_var", "H": "h_var",
 }
 
 class WIPSTab(ttk.Frame):
@@ -46,6 +45,11 @@ class WIPSTab(ttk.Frame):
         self.work_var = tk.StringVar(value="54")
         self.is_ext_var = tk.BooleanVar(value=False)
         self.post_header_var = tk.BooleanVar(value=False) 
+        self.peephole_var = tk.BooleanVar(value=False)
+        self._job = None  # background generation in flight
+
+        # Cycle queue: [(selection, params)] chained into one program, one tool change
+        self.queue = []
         
         # Position Parameters (X/Y Start)
         self.x_pos = tk.StringVar(value="0.0")
@@ -70,10 +74,19 @@ class WIPSTab(ttk.Frame):
         self.img_label = None 
 
         self._build_ui()
+
+        # Diagrams: decode all of them in the background, show from the LRU
+        self.diagrams = image_cache.DiagramCache(self, size=(350, 250))
         
         # Trace changes to sync UI behavior and Visuals
         self.cycle_var.trace_add("write", self._sync_all)
-        self._sync_all()
+        self._sync_v11_logic()
+        self.after(DIAGRAM_DELAY_MS, self._start_diagrams)
+
+    def _start_diagrams(self):
+        """Deferred until after first paint: Pillow import, preload and first image."""
+        self.diagrams.preload(CYCLE_IMAGES.values())
+        self._update_image()
 
     def _sync_all(self, *args):
         """Orchestrates UI updates and image swapping."""
@@ -108,31 +121,16 @@ class WIPSTab(ttk.Frame):
         """Resolves and loads the cycle diagram from the assets folder."""
         if not self.img_label: return
 
-        if not PILLOW_AVAILABLE:
+        if not image_cache.PILLOW_AVAILABLE:
             self.img_label.configure(text="Pillow library missing.\nRun: pip install Pillow", image="")
             return
 
         selection = self.cycle_var.get()
         img_name = CYCLE_IMAGES.get(selection, "placeholder.png")
-        
-        # Find path to assets relative to this file
-        search_paths = [
-            os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "assets", img_name),
-            os.path.join(os.getcwd(), "assets", img_name)
-        ]
-
-        img_path = None
-        for path in search_paths:
-            if os.path.exists(path):
-                img_path = path
-                break
 
         try:
-            target_w, target_h = 350, 250
-            if img_path:
-                pill_img = Image.open(img_path)
-                pill_img = pill_img.resize((target_w, target_h), Image.Resampling.LANCZOS)
-                tk_img = ImageTk.PhotoImage(pill_img)
+            tk_img = self.diagrams.photo(img_name)
+            if tk_img is not None:
                 self.img_label.configure(image=tk_img, text="")
                 self.img_label.image = tk_img 
             else:
@@ -156,6 +154,7 @@ class WIPSTab(ttk.Frame):
         ttk.Entry(setup_f, textvariable=self.work_var, width=10).grid(row=1, column=1, padx=5, pady=2)
         ttk.Checkbutton(setup_f, text="Ext P1-99", variable=self.is_ext_var).grid(row=1, column=2, padx=10)
         ttk.Checkbutton(setup_f, text="Post % / O-Num", variable=self.post_header_var).grid(row=0, column=2, padx=10)
+        ttk.Checkbutton(setup_f, text="Optimize Output", variable=self.peephole_var).grid(row=0, column=3, padx=10)
 
         # Start Position (X/Y)
         ttk.Label(setup_f, text="X Start:").grid(row=2, column=0, sticky="w")
@@ -211,57 +210,176 @@ class WIPSTab(ttk.Frame):
         btn_f.pack(fill="x", pady=(10, 0))
         ttk.Button(btn_f, text="GENERATE G-CODE", command=self.generate).pack(side="left", expand=True, fill="x", padx=5)
         ttk.Button(btn_f, text="COPY", command=self.copy_to_clip).pack(side="left", expand=True, fill="x", padx=5)
+        self.cancel_btn = ttk.Button(btn_f, text="Cancel", command=self._cancel_generate, state="disabled")
+        self.cancel_btn.pack(side="left", padx=5)
 
         # --- RIGHT PANEL: OUTPUT ---
-        self.txt = tk.Text(self, font=("Consolas", 11), bg="#1e272e", fg="#d2dae2", 
+        out_f = ttk.Frame(self)
+        out_f.pack(side="right", fill="both", expand=True, padx=(5, 10), pady=10)
+
+        # Cycle queue: one chained program, one T M06 / probe on for every cycle
+        q_frame = ttk.LabelFrame(out_f, text=" Cycle Queue ", padding=5)
+        q_frame.pack(side="top", fill="x", pady=(0, 5))
+        self.queue_list = tk.Listbox(q_frame, height=5, font=("Consolas", 10), selectmode="extended")
+        self.queue_list.pack(fill="x")
+        q_btns = ttk.Frame(q_frame)
+        q_btns.pack(fill="x", pady=(5, 0))
+        ttk.Button(q_btns, text="Add Current", command=self._queue_add).pack(side="left", padx=2)
+        ttk.Button(q_btns, text="Remove", command=self._queue_remove).pack(side="left", padx=2)
+        ttk.Button(q_btns, text="Clear", command=self._queue_clear).pack(side="left", padx=2)
+        ttk.Button(q_btns, text="GENERATE QUEUE", command=self.generate_queue).pack(side="right", padx=2)
+
+        self.time_var = tk.StringVar()
+        ttk.Label(out_f, textvariable=self.time_var, foreground="#2980b9").pack(side="bottom", anchor="w", pady=(5, 0))
+        self.txt = tk.Text(out_f, font=("Consolas", 11), bg="#1e272e", fg="#d2dae2", 
                           padx=15, pady=15, relief="flat")
-        self.txt.pack(side="right", fill="both", expand=True, padx=(5, 10), pady=10)
+        self.txt.pack(fill="both", expand=True)
+
+    def _collect_params(self):
+        """(selection, params) for the cycle currently on screen."""
+        selection = self.cycle_var.get()
+        cycle_key = NC.CYCLE_KEYS.get(selection, selection.split("-")[0].strip())
+
+        # Collect params through lib/codes.py collector
+        return selection, NC.collect_user_params(
+            t_num=self.tool_var.get(),
+            wcs=self.work_var.get(),
+            probe_cycle=cycle_key,
+            z_clr=self.clear_z.get(),
+            z_protect=self.prot_z.get(),
+            probe_plane=self.probing_plane_z.get(),
+            xpos=self.x_pos.get(),
+            ypos=self.y_pos.get(),
+            is_ext=self.is_ext_var.get(),
+            args_dict={"D": self.d_var.get(), "E": self.e_var.get(), "H": self.h_var.get()}
+        )
+
+    @staticmethod
+    def _wrap(prog):
+        """Optional post wrapping: %, O-number, M30."""
+        prog.insert(0, "%")
+        prog.insert(1, "O1001 (WIPS V11 APEXPROBE)")
+        if prog[-1].strip() != "M01": prog.append("M01")
+        prog.append("M30")
+        prog.append("%")
+        return prog
 
     def generate(self):
+        # Tk variables are read here; building and post-passes run on a worker thread
         try:
-            selection = self.cycle_var.get()
-            raw_key = selection.split("-")[0].strip()
-            
-            # Map sub-keys for surface cycles (A20 variants)
-            cycle_key = raw_key
-            if raw_key == "A20":
-                if "Surface X" in selection: cycle_key = "A20X"
-                elif "Surface Y" in selection: cycle_key = "A20Y"
-                elif "Surface Z" in selection: cycle_key = "A20Z"
-
             # 1. Collect params through lib/codes.py collector
-            params = NC.collect_user_params(
-                t_num=self.tool_var.get(),
-                wcs=self.work_var.get(),
-                probe_cycle=cycle_key,
-                z_clr=self.clear_z.get(),
-                z_protect=self.prot_z.get(),
-                probe_plane=self.probing_plane_z.get(),
-                xpos=self.x_pos.get(),
-                ypos=self.y_pos.get(),
-                is_ext=self.is_ext_var.get(),
-                args_dict={"D": self.d_var.get(), "E": self.e_var.get(), "H": self.h_var.get()}
-            )
+            selection, params = self._collect_params()
 
+            wrap = self.post_header_var.get()
+            optimize = self.peephole_var.get()
+        except Exception as e:
+            messagebox.showerror("Generator Error", f"Invalid input parameters.\n{str(e)}")
+            return
+
+        def build():
             # 2. Generate toolpath using the Brain engine
-            prog = NC.generate_toolpath(params)
+            prog = program_cache.toolpath(params)
             
             # Add descriptive header
             prog.insert(0, f"(PROBE CYCLE: {selection})")
 
             # Handle Optional Post wrapping
-            if self.post_header_var.get():
-                prog.insert(0, "%")
-                prog.insert(1, "O1001 (WIPS V11 APEXPROBE)")
-                if prog[-1].strip() != "M01": prog.append("M01")
-                prog.append("M30")
-                prog.append("%")
-            
-            self.txt.delete("1.0", "end")
-            self.txt.insert("end", "\n".join(prog))
-            
+            return self._wrap(prog) if wrap else prog
+
+        self._start_job(build, self._post(optimize))
+
+    def _post(self, optimize, extra=None):
+        def post(prog):
+            status = ""
+            if optimize:
+                prog, saved = peephole.optimize(prog)
+                status = "  |  " + peephole.summary(saved)
+            if extra is not None:
+                status += "  |  " + extra()
+            return prog, cycle_time.summary(cycle_time.estimate(prog)) + status
+        return post
+
+    def _start_job(self, build, post):
+        self._cancel_generate()
+        self.cancel_btn.config(state="normal")
+        self._job = background.GenerationJob(
+            self, self.txt, build, post,
+            on_status=self.time_var.set, on_done=self._generate_done, on_error=self._generate_failed).start()
+
+    # --- Cycle queue ---
+
+    def _queue_text(self, n, selection, params):
+        g_wcs, _ = NC.format_wcs(params["wcs"], is_ext=params["is_ext"])
+        return f"{n}. {selection}  {g_wcs} X{params['xpos']} Y{params['ypos']}"
+
+    def _refresh_queue(self):
+        self.queue_list.delete(0, "end")
+        for n, (selection, params) in enumerate(self.queue, 1):
+            self.queue_list.insert("end", self._queue_text(n, selection, params))
+
+    def _queue_add(self):
+        try:
+            entry = self._collect_params()
+            NC.generate_toolpath_chain([p for _, p in self.queue] + [entry[1]])  # same probe, valid inputs
         except Exception as e:
-            messagebox.showerror("Generator Error", f"Invalid input parameters.\n{str(e)}")
+            messagebox.showerror("Cycle Queue", f"Cannot queue this cycle.\n{str(e)}")
+            return
+        self.queue.append(entry)
+        self._refresh_queue()
+
+    def _queue_remove(self):
+        for i in reversed(self.queue_list.curselection()):
+            del self.queue[i]
+        self._refresh_queue()
+
+    def _queue_clear(self):
+        self.queue = []
+        self._refresh_queue()
+
+    def generate_queue(self):
+        """Every queued cycle in one program: one tool change, the probe stays on between cycles."""
+        if not self.queue:
+            messagebox.showinfo("Cycle Queue", "Add cycles to the queue first.")
+            return
+        steps = [params for _, params in self.queue]
+        wrap = self.post_header_var.get()
+        optimize = self.peephole_var.get()
+
+        def build():
+            prog = program_cache.toolpath_chain(steps)
+            prog.insert(0, f"(PROBE CYCLE QUEUE: {len(steps)} CYCLES)")
+            return self._wrap(prog) if wrap else prog
+
+        # Saving is timed on the raw programs: chain vs one sandwich per cycle
+        savings = lambda: cycle_time.chain_summary([NC.generate_toolpath(p) for p in steps],
+                                                   NC.generate_toolpath_chain(steps))
+        self._start_job(build, self._post(optimize, savings))
+
+    def _cancel_generate(self):
+        if self._job is not None and self._job.running:
+            self._job.cancel()
+        self.cancel_btn.config(state="disabled")
+
+    def _generate_done(self, prog, status):
+        self.cancel_btn.config(state="disabled")
+        self.time_var.set(status)
+
+    def _generate_failed(self, e):
+        self.cancel_btn.config(state="disabled")
+        self.time_var.set("")
+        messagebox.showerror("Generator Error", f"Invalid input parameters.\n{str(e)}")
+
+    def project_state(self):
+        settings = project.read_vars(self, PROJECT_VARS)
+        settings["queue"] = [dict(params, label=selection) for selection, params in self.queue]
+        return {"settings": settings}
+
+    def load_project(self, section):
+        project.write_vars(self, PROJECT_VARS, section["settings"])
+        queue = section["settings"].get("queue") or []
+        self.queue = [(step.get("label", step.get("probe_cycle", "")),
+                       {k: v for k, v in step.items() if k != "label"}) for step in queue if isinstance(step, dict)]
+        self._refresh_queue()
 
     def copy_to_clip(self):
         self.txt.tag_add("sel", "1.0", "end")